@@ -1,12 +1,10 @@
 from __future__ import print_function, division
 import os
 import torch
-import pandas as pd
-from skimage import io, transform
+from skimage import io
 import numpy as np
-import matplotlib.pyplot as plt
 from torch.utils.data import Dataset, DataLoader
-from torchvision import transforms, utils, datasets, models
+from torchvision import transforms
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -19,6 +17,86 @@ warnings.filterwarnings("ignore")
                  #dir_antenna= , 
                     
 
+
+def worker_rng(dataset):
+    """
+    Return a numpy Generator private to the current DataLoader worker.
+
+    Workers are seeded from torch's per-worker seed (which follows torch.manual_seed and
+    changes every epoch); the main process uses dataset.seed. The global numpy RNG is never touched.
+    """
+    info = torch.utils.data.get_worker_info()
+    seed = dataset.seed if info is None else info.seed
+    if dataset._rng is None or dataset._rng_seed != seed:
+        dataset._rng = np.random.default_rng(seed)
+        dataset._rng_seed = seed
+    return dataset._rng
+
+
+def build_sample_index(maps_inds, num_samples, seed=0, width=256):
+    """
+    Precompute fixed measurement locations for every map, once.
+
+    Each map gets its own Generator seeded by (seed, map index), so the locations of a map are the same
+    in every split, worker and epoch, independent of the transmitter.
+    Returns an int32 array [len(maps_inds), num_samples] of flat pixel indices (x*width + y).
+    """
+    index = np.empty((len(maps_inds), num_samples), dtype=np.int32)
+    for i, map_ind in enumerate(maps_inds):
+        rng = np.random.default_rng([seed, int(map_ind)])
+        x_samples = rng.integers(0, 255, size=num_samples)
+        y_samples = rng.integers(0, 255, size=num_samples)
+        index[i] = x_samples * width + y_samples
+    return index
+
+
+def scatter_samples(flat_inds, values=None, height=256, width=256):
+    """
+    Build a [height, width] measurement image with a single vectorized scatter.
+
+    Args:
+        flat_inds: flat pixel indices (x*width + y).
+        values: [height, width(, 1)] image sampled at flat_inds. If None, a binary mask is returned.
+    """
+    image_samples = np.zeros(height * width)
+    if values is None:
+        image_samples[flat_inds] = 1
+    else:
+        image_samples[flat_inds] = values.reshape(-1)[flat_inds]
+    return image_samples.reshape(height, width)
+
+def check_manifest(dataset):
+    """
+    Return the manifest of dataset.dir_dataset (see guided_diffusion/manifest.py), or None if it has none.
+
+    With a manifest, every file the loader may read for its maps (buildings, every missing-buildings
+    version it can draw, antennas, radio maps, cars) is checked against the index before the first
+    epoch, without touching the filesystem, so a missing file fails the construction instead of a
+    worker mid-epoch.
+    """
+    from guided_diffusion.manifest import load_manifest
+    manifest = load_manifest(dataset.dir_dataset)
+    if manifest is None:
+        return None
+    if dataset.cityMap == "complete":
+        building_dirs = [dataset.dir_buildings]
+    else:
+        missing = [dataset.missing] if dataset.cityMap == "missing" else range(1, 5)
+        building_dirs = [dataset.dir_buildings + str(m) + "/" + str(v) + "/" for m in missing for v in range(1, 7)]
+    if dataset.simulation == "rand":
+        gain_dirs = [dataset.dir_gainDPM, dataset.dir_gainIRT2]
+    else:
+        gain_dirs = [dataset.dir_gain]
+    map_dirs = [manifest.relpath(d) + "/" for d in building_dirs + ([dataset.dir_cars] if dataset.carsInput != "no" else [])]
+    tx_dirs = [manifest.relpath(d) + "/" for d in [dataset.dir_Tx] + gain_dirs]
+    rels = []
+    for map_ind in dataset.maps_inds[dataset.ind1:dataset.ind2 + 1] + 1:
+        rels += ["%s%d.png" % (d, map_ind) for d in map_dirs]
+        rels += ["%s%d_%d.png" % (d, map_ind, tx) for d in tx_dirs for tx in range(dataset.numTx)]
+    manifest.require(rels, type(dataset).__name__)
+    return manifest
+
+
 class RadioUNet_c(Dataset):
     """RadioMapSeer Loader for accurate buildings and no measurements (RadioUNet_c)"""
     def __init__(self,maps_inds=np.zeros(1), phase="train",
@@ -129,6 +207,7 @@ class RadioUNet_c(Dataset):
         
         self.height = 256
         self.width = 256
+        self.manifest = check_manifest(self)
 
         
     def __len__(self):
@@ -221,6 +300,7 @@ class RadioUNet_c_sprseIRT4(Dataset):
                  cityMap="complete",
                  missing=1,
                  num_samples=300,
+                 seed=0,
                  transform= transforms.ToTensor()):
         """
         Args:
@@ -238,6 +318,7 @@ class RadioUNet_c_sprseIRT4(Dataset):
                       a random number of missing buildings.
             missing: 1 to 4. in case of input map with missing buildings, and not "rand", the number of missing buildings. Default=1.
             num_samples: number of samples in the sparse IRT4 radio map. Default=300.
+            seed: seed of the per-map sample locations and of the main-process random generator. Default=0.
             transform: Transform to apply on the images of the loader.  Default= transforms.ToTensor())
             
         Output:
@@ -245,9 +326,8 @@ class RadioUNet_c_sprseIRT4(Dataset):
         """
         if maps_inds.size==1:
             self.maps_inds=np.arange(0,700,1,dtype=np.int16)
-            #Determenistic "random" shuffle of the maps:
-            np.random.seed(42)
-            np.random.shuffle(self.maps_inds)
+            #Determenistic "random" shuffle of the maps (same order as seeding the global RNG with 42):
+            np.random.RandomState(42).shuffle(self.maps_inds)
         else:
             self.maps_inds=maps_inds
             
@@ -303,6 +383,12 @@ class RadioUNet_c_sprseIRT4(Dataset):
         
         self.num_samples=num_samples
         
+        #Sparse IRT4 sample locations, fixed per map and computed once
+        self.seed=seed
+        self._rng=None
+        self._rng_seed=None
+        self.sample_index=build_sample_index(self.maps_inds, self.num_samples, seed)
+        
         self.dir_Tx = self.dir_dataset+ "png/antennas/" 
         #later check if reading the JSON file and creating antenna images on the fly is faster
         if carsInput!="no":
@@ -327,14 +413,15 @@ class RadioUNet_c_sprseIRT4(Dataset):
         name1 = str(dataset_map_ind) + ".png"
         #names of files that depend on the map and the Tx:
         name2 = str(dataset_map_ind) + "_" + str(idxc) + ".png"
+        rng = worker_rng(self)
         
         #Load buildings:
         if self.cityMap == "complete":
             img_name_buildings = os.path.join(self.dir_buildings, name1)
         else:
             if self.cityMap == "rand":
-                self.missing=np.random.randint(low=1, high=5)
-            version=np.random.randint(low=1, high=7)
+                self.missing=rng.integers(low=1, high=5)
+            version=rng.integers(low=1, high=7)
             img_name_buildings = os.path.join(self.dir_buildings+str(self.missing)+"/"+str(version)+"/", name1)
             str(self.missing)
         image_buildings = np.asarray(io.imread(img_name_buildings))   
@@ -352,7 +439,7 @@ class RadioUNet_c_sprseIRT4(Dataset):
             img_name_gainIRT2 = os.path.join(self.dir_gainIRT2, name2) 
             #image_gainDPM = np.expand_dims(np.asarray(io.imread(img_name_gainDPM)),axis=2)/255
             #image_gainIRT2 = np.expand_dims(np.asarray(io.imread(img_name_gainIRT2)),axis=2)/255
-            w=np.random.uniform(0,self.IRT2maxW) # IRT2 weight of random average
+            w=rng.uniform(0,self.IRT2maxW) # IRT2 weight of random average
             image_gain= w*np.expand_dims(np.asarray(io.imread(img_name_gainIRT2)),axis=2)/256  \
                         + (1-w)*np.expand_dims(np.asarray(io.imread(img_name_gainDPM)),axis=2)/256
         
@@ -363,13 +450,8 @@ class RadioUNet_c_sprseIRT4(Dataset):
             image_gain=image_gain-self.thresh*np.ones(np.shape(image_gain))
             image_gain=image_gain/(1-self.thresh)
         
-        #Saprse IRT4 samples, determenistic and fixed samples per map
-        image_samples = np.zeros((self.width,self.height))
-        seed_map=np.sum(image_buildings) # Each map has its fixed samples, independent of the transmitter location.
-        np.random.seed(seed_map)       
-        x_samples=np.random.randint(0, 255, size=self.num_samples)
-        y_samples=np.random.randint(0, 255, size=self.num_samples)
-        image_samples[x_samples,y_samples]= 1
+        #Saprse IRT4 samples, determenistic and fixed samples per map (independent of the transmitter location)
+        image_samples = scatter_samples(self.sample_index[idxr+self.ind1], height=self.height, width=self.width)
         
         #inputs to radioUNet
         if self.carsInput=="no":
@@ -418,6 +500,8 @@ class RadioUNet_s(Dataset):
                  fix_samples=0,
                  num_samples_low= 10, 
                  num_samples_high= 300,
+                 fixed_masks="no",
+                 seed=0,
                  transform= transforms.ToTensor()):
         """
         Args:
@@ -438,6 +522,9 @@ class RadioUNet_s(Dataset):
             fix_samples: fixed or a random number of samples. If zero, fixed, else, fix_samples is the number of samples. Default = 0.
             num_samples_low: if random number of samples, this is the minimum number of samples. Default = 10. 
             num_samples_high: if random number of samples, this is the maximal number of samples. Default = 300.
+            fixed_masks: "no", "yes". If "yes", measurements are drawn from a pool of locations fixed per map (precomputed once),
+                      instead of fresh random locations for every item. Default="no".
+            seed: seed of the per-map sample locations and of the main-process random generator. Default=0.
             transform: Transform to apply on the images of the loader.  Default= transforms.ToTensor())
                  
         Output:
@@ -452,9 +539,8 @@ class RadioUNet_s(Dataset):
                 
         if maps_inds.size==1:
             self.maps_inds=np.arange(0,700,1,dtype=np.int16)
-            #Determenistic "random" shuffle of the maps:
-            np.random.seed(42)
-            np.random.shuffle(self.maps_inds)
+            #Determenistic "random" shuffle of the maps (same order as seeding the global RNG with 42):
+            np.random.RandomState(42).shuffle(self.maps_inds)
         else:
             self.maps_inds=maps_inds
             
@@ -511,6 +597,14 @@ class RadioUNet_s(Dataset):
         self.fix_samples= fix_samples
         self.num_samples_low= num_samples_low 
         self.num_samples_high= num_samples_high
+        
+        self.fixed_masks=fixed_masks
+        self.seed=seed
+        self._rng=None
+        self._rng_seed=None
+        if fixed_masks=="yes":
+            pool_size=int(max(num_samples_high, np.floor(fix_samples)))
+            self.sample_index=build_sample_index(self.maps_inds, pool_size, seed)
                 
         self.transform= transform
         
@@ -521,6 +615,7 @@ class RadioUNet_s(Dataset):
         
         self.height = 256
         self.width = 256
+        self.manifest = check_manifest(self)
 
         
     def __len__(self):
@@ -535,14 +630,15 @@ class RadioUNet_s(Dataset):
         name1 = str(dataset_map_ind) + ".png"
         #names of files that depend on the map and the Tx:
         name2 = str(dataset_map_ind) + "_" + str(idxc) + ".png"
+        rng = worker_rng(self)
         
         #Load buildings:
         if self.cityMap == "complete":
             img_name_buildings = os.path.join(self.dir_buildings, name1)
         else:
             if self.cityMap == "rand":
-                self.missing=np.random.randint(low=1, high=5)
-            version=np.random.randint(low=1, high=7)
+                self.missing=rng.integers(low=1, high=5)
+            version=rng.integers(low=1, high=7)
             img_name_buildings = os.path.join(self.dir_buildings+str(self.missing)+"/"+str(version)+"/", name1)
             str(self.missing)
         image_buildings = np.asarray(io.imread(img_name_buildings))/256  
@@ -560,7 +656,7 @@ class RadioUNet_s(Dataset):
             img_name_gainIRT2 = os.path.join(self.dir_gainIRT2, name2) 
             #image_gainDPM = np.expand_dims(np.asarray(io.imread(img_name_gainDPM)),axis=2)/255
             #image_gainIRT2 = np.expand_dims(np.asarray(io.imread(img_name_gainIRT2)),axis=2)/255
-            w=np.random.uniform(0,self.IRT2maxW) # IRT2 weight of random average
+            w=rng.uniform(0,self.IRT2maxW) # IRT2 weight of random average
             image_gain= w*np.expand_dims(np.asarray(io.imread(img_name_gainIRT2)),axis=2)/256  \
                         + (1-w)*np.expand_dims(np.asarray(io.imread(img_name_gainDPM)),axis=2)/256
         
@@ -576,14 +672,17 @@ class RadioUNet_s(Dataset):
                                   # Important: when evaluating the accuracy, remember to devide the errors by 256!
                  
         #input measurements
-        image_samples = np.zeros((256,256))
         if self.fix_samples==0:
-            num_samples=np.random.randint(self.num_samples_low, self.num_samples_high, size=1)
+            num_samples=rng.integers(self.num_samples_low, self.num_samples_high, size=1)
+        else:
+            num_samples=np.floor(self.fix_samples).astype(int)
+        n=int(np.ravel(num_samples)[0])
+        if self.fixed_masks=="no":
+            sample_inds=rng.integers(0, 255, size=n)*self.width + rng.integers(0, 255, size=n)
         else:
-            num_samples=np.floor(self.fix_samples).astype(int)               
-        x_samples=np.random.randint(0, 255, size=num_samples)
-        y_samples=np.random.randint(0, 255, size=num_samples)
-        image_samples[x_samples,y_samples]= image_gain[x_samples,y_samples,0]
+            pool=self.sample_index[idxr+self.ind1]
+            sample_inds=pool[rng.permutation(len(pool))[0:n]]
+        image_samples = scatter_samples(sample_inds, image_gain, height=self.height, width=self.width)
         
         #inputs to radioUNet
         if self.carsInput=="no":
@@ -627,6 +726,7 @@ class RadioUNet_s_sprseIRT4(Dataset):
                  fix_samples=0,
                  num_samples_low= 10, 
                  num_samples_high= 299,
+                 seed=0,
                  transform= transforms.ToTensor()):
         """
         Args:
@@ -647,6 +747,7 @@ class RadioUNet_s_sprseIRT4(Dataset):
             fix_samples: fixed or a random number of samples. If zero, fixed, else, fix_samples is the number of samples. Default = 0.
             num_samples_low: if random number of samples, this is the minimum number of samples. Default = 10. 
             num_samples_high: if random number of samples, this is the maximal number of samples. Default = 300.
+            seed: seed of the per-map sample locations and of the main-process random generator. Default=0.
             transform: Transform to apply on the images of the loader.  Default= transforms.ToTensor())
             
         Output:
@@ -654,9 +755,8 @@ class RadioUNet_s_sprseIRT4(Dataset):
         """
         if maps_inds.size==1:
             self.maps_inds=np.arange(0,700,1,dtype=np.int16)
-            #Determenistic "random" shuffle of the maps:
-            np.random.seed(42)
-            np.random.shuffle(self.maps_inds)
+            #Determenistic "random" shuffle of the maps (same order as seeding the global RNG with 42):
+            np.random.RandomState(42).shuffle(self.maps_inds)
         else:
             self.maps_inds=maps_inds
             
@@ -713,6 +813,12 @@ class RadioUNet_s_sprseIRT4(Dataset):
         self.num_samples_low= num_samples_low 
         self.num_samples_high= num_samples_high
         
+        #Sparse IRT4 sample locations, fixed per map and computed once
+        self.seed=seed
+        self._rng=None
+        self._rng_seed=None
+        self.sample_index=build_sample_index(self.maps_inds, self.data_samples, seed)
+        
         self.transform= transform
         
         
@@ -740,17 +846,18 @@ class RadioUNet_s_sprseIRT4(Dataset):
         name1 = str(dataset_map_ind) + ".png"
         #names of files that depend on the map and the Tx:
         name2 = str(dataset_map_ind) + "_" + str(idxc) + ".png"
+        rng = worker_rng(self)
         
         #Load buildings:
         if self.cityMap == "complete":
             img_name_buildings = os.path.join(self.dir_buildings, name1)
         else:
             if self.cityMap == "rand":
-                self.missing=np.random.randint(low=1, high=5)
-            version=np.random.randint(low=1, high=7)
+                self.missing=rng.integers(low=1, high=5)
+            version=rng.integers(low=1, high=7)
             img_name_buildings = os.path.join(self.dir_buildings+str(self.missing)+"/"+str(version)+"/", name1)
             str(self.missing)
-        image_buildings = np.asarray(io.imread(img_name_buildings))  #Will be normalized later, after random seed is computed from it
+        image_buildings = np.asarray(io.imread(img_name_buildings))/256
         
         #Load Tx (transmitter):
         img_name_Tx = os.path.join(self.dir_Tx, name2)
@@ -765,7 +872,7 @@ class RadioUNet_s_sprseIRT4(Dataset):
             img_name_gainIRT2 = os.path.join(self.dir_gainIRT2, name2) 
             #image_gainDPM = np.expand_dims(np.asarray(io.imread(img_name_gainDPM)),axis=2)/255
             #image_gainIRT2 = np.expand_dims(np.asarray(io.imread(img_name_gainIRT2)),axis=2)/255
-            w=np.random.uniform(0,self.IRT2maxW) # IRT2 weight of random average
+            w=rng.uniform(0,self.IRT2maxW) # IRT2 weight of random average
             image_gain= w*np.expand_dims(np.asarray(io.imread(img_name_gainIRT2)),axis=2)/256  \
                         + (1-w)*np.expand_dims(np.asarray(io.imread(img_name_gainDPM)),axis=2)/256
         
@@ -780,29 +887,18 @@ class RadioUNet_s_sprseIRT4(Dataset):
                                   # Namely, the loss of RadioUNet_s is 256 the loss of RadioUNet_c
                                   # Important: when evaluating the accuracy, remember to devide the errors by 256!
                     
-        #Saprse IRT4 samples, determenistic and fixed samples per map
-        sparse_samples = np.zeros((self.width,self.height))
-        seed_map=np.sum(image_buildings) # Each map has its fixed samples, independent of the transmitter location.
-        np.random.seed(seed_map)       
-        x_samples=np.random.randint(0, 255, size=self.data_samples)
-        y_samples=np.random.randint(0, 255, size=self.data_samples)
-        sparse_samples[x_samples,y_samples]= 1
+        #Saprse IRT4 samples, determenistic and fixed samples per map (independent of the transmitter location)
+        sample_inds=self.sample_index[idxr+self.ind1]
+        sparse_samples = scatter_samples(sample_inds, height=self.height, width=self.width)
         
         #input samples from the sparse gain samples
-        input_samples = np.zeros((256,256))
         if self.fix_samples==0:
-            num_in_samples=np.random.randint(self.num_samples_low, self.num_samples_high, size=1)
+            num_in_samples=rng.integers(self.num_samples_low, self.num_samples_high, size=1)
         else:
             num_in_samples=np.floor(self.fix_samples).astype(int)
-            
-        data_inds=range(self.data_samples)
-        input_inds=np.random.permutation(data_inds)[0:num_in_samples[0]]      
-        x_samples_in=x_samples[input_inds]
-        y_samples_in=y_samples[input_inds]
-        input_samples[x_samples_in,y_samples_in]= image_gain[x_samples_in,y_samples_in,0]
-        
-        #normalize image_buildings, after random seed computed from it as an int
-        image_buildings=image_buildings/256
+        n_in=int(np.ravel(num_in_samples)[0])
+        input_inds=rng.permutation(self.data_samples)[0:n_in]
+        input_samples = scatter_samples(sample_inds[input_inds], image_gain, height=self.height, width=self.width)
         
         #inputs to radioUNet
         if self.carsInput=="no":
@@ -835,4 +931,59 @@ class RadioUNet_s_sprseIRT4(Dataset):
     
     
     
-    
\ No newline at end of file
+        
+    
+    
+    
+class RadioUNet_resized(Dataset):
+    """Wraps a RadioMapSeer loader and resizes its inputs and radio map, e.g. for a low-resolution cascade stage"""
+    def __init__(self, dataset, size=64):
+        """
+        Args:
+            dataset: a RadioUNet loader returning (inputs, image_gain, ...) tensors.
+            size: side of the resized maps. Default=64.
+            
+        Output:
+            The items of dataset, with inputs max-pooled (so single-pixel transmitters and measurements survive)
+            and image_gain area-averaged to size x size.
+        """
+        self.dataset=dataset
+        self.size=size
+        
+    def __len__(self):
+        return len(self.dataset)
+    
+    def __getitem__(self, idx):
+        item=list(self.dataset[idx])
+        item[0]=torch.nn.functional.adaptive_max_pool2d(item[0], self.size)
+        item[1]=torch.nn.functional.interpolate(item[1][None], size=(self.size,self.size), mode="area")[0]
+        return item
+
+
+class RadioUNet_teacher(Dataset):
+    """Radio maps predicted by a teacher model, e.g. RMDM, with the exact inputs they were predicted from, for distillation"""
+    def __init__(self, cache_dir):
+        """
+        Args:
+            cache_dir: directory of teacher_{idx:06d}.npz files, each holding the inputs and image_gain
+                a RadioUNet loader returned for item idx, the teacher map predicted from those inputs
+                and the item name. The inputs are stored rather than read again from the loader, since
+                loaders with random measurements, simulations or building versions return different
+                inputs on every read.
+            
+        Output:
+            (inputs, image_gain, teacher_gain, name) with teacher_gain shaped like image_gain.
+        """
+        self.cache_dir=cache_dir
+        self.files=sorted(f for f in os.listdir(cache_dir) if f.startswith("teacher_") and f.endswith(".npz"))
+        
+    def __len__(self):
+        return len(self.files)
+    
+    def __getitem__(self, idx):
+        with np.load(os.path.join(self.cache_dir, self.files[idx])) as item:
+            inputs=torch.from_numpy(item["inputs"])
+            image_gain=torch.from_numpy(item["image_gain"])
+            teacher=torch.from_numpy(item["teacher"].astype(np.float32)).reshape(image_gain.shape)
+            name=str(item["name"])
+        return (inputs, image_gain, teacher, name)
@@ -1,6 +1,5 @@
 import torch
 import torch.nn as nn
-from torchvision import models
 
 def convrelu(in_channels, out_channels, kernel, padding, pool):
     return nn.Sequential(
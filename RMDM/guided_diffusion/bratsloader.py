@@ -3,8 +3,60 @@ import torch.nn
 import numpy as np
 import os
 import os.path
+from collections import OrderedDict
 import nibabel
-import torchvision.utils as vutils
+
+from .manifest import load_manifest
+
+
+def subject_dirs(directory, manifest=None):
+    """
+    (folder, sorted file names) of every folder holding files but no
+    subfolders, from the manifest if there is one, else from os.walk.
+    """
+    if manifest is not None:
+        return list(manifest.leaf_dirs().items())
+    return [(root, sorted(files)) for root, dirs, files in os.walk(directory) if not dirs]
+
+
+def volume_cache_path(cache_dir, directory, nifti_path, seqtype):
+    """
+    Path of the .npy copy of one modality: the subject folder relative to
+    directory, mirrored under cache_dir.
+    """
+    subject = os.path.relpath(os.path.dirname(nifti_path), directory)
+    return os.path.join(cache_dir, subject, seqtype + ".npy")
+
+
+def load_volume(nifti_path, dtype=np.float32):
+    """
+    Decode a .nii.gz volume into a slice-major [Z x X x Y] array, so that one
+    slice is a contiguous block.
+    """
+    vol = nibabel.load(nifti_path).get_fdata(dtype=np.float32)
+    return np.ascontiguousarray(np.moveaxis(vol, -1, 0), dtype=dtype)
+
+
+def convert_brats_volumes(directory, cache_dir, dtype=np.float32, test_flag=False):
+    """
+    Decode every volume of a BRATS tree once into uncompressed slice-major
+    .npy files under cache_dir, read back by BRATSDataset3D(cache_dir=...)
+    as memory maps. Volumes already converted are skipped.
+
+    :return: the number of volumes written.
+    """
+    written = 0
+    for filedict in BRATSDataset3D(directory, None, test_flag=test_flag).database:
+        for seqtype, path in filedict.items():
+            out = volume_cache_path(cache_dir, directory, path, seqtype)
+            if os.path.exists(out):
+                continue
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            # segmentation labels are small integers, exact in any float dtype
+            np.save(out + ".tmp.npy", load_volume(path, dtype))
+            os.replace(out + ".tmp.npy", out)
+            written += 1
+    return written
 
 
 class BRATSDataset(torch.utils.data.Dataset):
@@ -29,24 +81,25 @@ class BRATSDataset(torch.utils.data.Dataset):
             self.seqtypes = ['t1', 't1ce', 't2', 'flair', 'seg']
 
         self.seqtypes_set = set(self.seqtypes)
+        self.manifest = load_manifest(self.directory)
         self.database = []
-        for root, dirs, files in os.walk(self.directory):
-            # if there are no subdirs, we have data
-            if not dirs:
-                files.sort()
-                datapoint = dict()
-                # extract all files as channels
-                for f in files:
-                    seqtype = f.split('_')[3]
-                    datapoint[seqtype] = os.path.join(root, f)
-                assert set(datapoint.keys()) == self.seqtypes_set, \
-                    f'datapoint is incomplete, keys are {datapoint.keys()}'
-                self.database.append(datapoint)
+        # folders without subfolders hold the data
+        for root, files in subject_dirs(self.directory, self.manifest):
+            datapoint = dict()
+            # extract all files as channels
+            for f in files:
+                seqtype = f.split('_')[3]
+                datapoint[seqtype] = os.path.join(root, f)
+            assert set(datapoint.keys()) == self.seqtypes_set, \
+                f'datapoint is incomplete, keys are {datapoint.keys()}'
+            self.database.append(datapoint)
 
     def __getitem__(self, x):
         out = []
         filedict = self.database[x]
         for seqtype in self.seqtypes:
+            if self.manifest is not None:
+                self.manifest.check(filedict[seqtype])
             nib_img = nibabel.load(filedict[seqtype])
             path=filedict[seqtype]
             out.append(torch.tensor(nib_img.get_fdata()))
@@ -75,7 +128,7 @@ class BRATSDataset(torch.utils.data.Dataset):
         return len(self.database)
 
 class BRATSDataset3D(torch.utils.data.Dataset):
-    def __init__(self, directory, transform, test_flag=False):
+    def __init__(self, directory, transform, test_flag=False, cache_dir=None, cache_volumes=2):
         '''
         directory is expected to contain some folder structure:
                   if some subfolder contains only files, all of these
@@ -84,10 +137,25 @@ class BRATSDataset3D(torch.utils.data.Dataset):
                   where XXX is one of t1, t1ce, t2, flair, seg
                   we assume these five files belong to the same image
                   seg is supposed to contain the segmentation
+        cache_dir: output of convert_brats_volumes(directory, cache_dir); slices
+                  are then read from memory-mapped .npy files instead of
+                  decoding whole .nii.gz volumes. Subjects missing from it
+                  are decoded from directory.
+        A manifest.json at the root of directory (scripts/RMDM_build_manifest.py)
+                  replaces the os.walk scan, and every volume decoded is
+                  checked against it once.
+        cache_volumes: number of subjects whose volumes (decoded arrays or
+                  memory maps) are kept per process, least recently used
+                  first out. Consecutive slices of a subject, e.g. with
+                  shuffle=False, then decode it only once. 0 disables the
+                  LRU: every item decodes (or maps) its volumes again.
         '''
         super().__init__()
         self.directory = os.path.expanduser(directory)
         self.transform = transform
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        self.cache_volumes = cache_volumes
+        self._volumes = OrderedDict()
 
         self.test_flag=test_flag
         if test_flag:
@@ -96,36 +164,52 @@ class BRATSDataset3D(torch.utils.data.Dataset):
             self.seqtypes = ['t1', 't1ce', 't2', 'flair', 'seg']
 
         self.seqtypes_set = set(self.seqtypes)
+        self.manifest = load_manifest(self.directory)
         self.database = []
-        for root, dirs, files in os.walk(self.directory):
-            # if there are no subdirs, we have data
-            if not dirs:
-                files.sort()
-                datapoint = dict()
-                # extract all files as channels
-                for f in files:
-                    seqtype = f.split('_')[3].split('.')[0]
-                    datapoint[seqtype] = os.path.join(root, f)
-                assert set(datapoint.keys()) == self.seqtypes_set, \
-                    f'datapoint is incomplete, keys are {datapoint.keys()}'
-                self.database.append(datapoint)
+        # folders without subfolders hold the data
+        for root, files in subject_dirs(self.directory, self.manifest):
+            datapoint = dict()
+            # extract all files as channels
+            for f in files:
+                seqtype = f.split('_')[3].split('.')[0]
+                datapoint[seqtype] = os.path.join(root, f)
+            assert set(datapoint.keys()) == self.seqtypes_set, \
+                f'datapoint is incomplete, keys are {datapoint.keys()}'
+            self.database.append(datapoint)
     
     def __len__(self):
         return len(self.database) * 155
 
+    def _subject_volumes(self, n):
+        """
+        The [Z x X x Y] volumes of subject n, one per seqtype, through the LRU.
+        """
+        if n in self._volumes:
+            self._volumes.move_to_end(n)
+            return self._volumes[n]
+        filedict = self.database[n]
+        volumes = []
+        for seqtype in self.seqtypes:
+            cached = self.cache_dir and volume_cache_path(self.cache_dir, self.directory, filedict[seqtype], seqtype)
+            if cached and os.path.exists(cached):
+                # copy-on-write map: slices are read from the page cache, never decoded
+                volumes.append(np.load(cached, mmap_mode="c"))
+            else:
+                if self.manifest is not None:
+                    self.manifest.check(filedict[seqtype])
+                volumes.append(load_volume(filedict[seqtype]))
+        if self.cache_volumes > 0:
+            self._volumes[n] = volumes
+            while len(self._volumes) > self.cache_volumes:
+                self._volumes.popitem(last=False)
+        return volumes
+
     def __getitem__(self, x):
-        out = []
         n = x // 155
         slice = x % 155
         filedict = self.database[n]
-        for seqtype in self.seqtypes:
-            nib_img = nibabel.load(filedict[seqtype])
-            path=filedict[seqtype]
-            o = torch.tensor(nib_img.get_fdata())[:,:,slice]
-            # if seqtype != 'seg':
-            #     o = o / o.max()
-            out.append(o)
-        out = torch.stack(out)
+        path = filedict[self.seqtypes[-1]]
+        out = torch.stack([torch.from_numpy(v[slice]).float() for v in self._subject_volumes(n)])
         if self.test_flag:
             image=out
             # image = image[..., 8:-8, 8:-8]     #crop to a size of (224, 224)
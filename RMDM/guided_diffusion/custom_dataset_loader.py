@@ -14,14 +14,21 @@ import pandas as pd
 from skimage.transform import rotate
 from glob import glob
 from sklearn.model_selection import train_test_split
+from .manifest import load_manifest
 
 class CustomDataset(Dataset):
     def __init__(self, args, data_path , transform = None, mode = 'Training',plane = False):
 
         print("loading data from the directory :",data_path)
         path=data_path
-        images = sorted(glob(os.path.join(path, "images/*.png")))
-        masks = sorted(glob(os.path.join(path, "masks/*.png")))
+        self.manifest = load_manifest(path)
+        if self.manifest is not None:
+            # listed from manifest.json, no directory scan
+            images = self.manifest.glob("images", ".png")
+            masks = self.manifest.glob("masks", ".png")
+        else:
+            images = sorted(glob(os.path.join(path, "images/*.png")))
+            masks = sorted(glob(os.path.join(path, "masks/*.png")))
 
         self.name_list = images
         self.label_list = masks
@@ -41,6 +48,9 @@ class CustomDataset(Dataset):
         mask_name = self.label_list[index]
         msk_path = os.path.join(mask_name)
 
+        if self.manifest is not None:
+            self.manifest.check(img_path)
+            self.manifest.check(msk_path)
         img = Image.open(img_path).convert('RGB')
         mask = Image.open(msk_path).convert('L')
 
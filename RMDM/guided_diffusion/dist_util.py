@@ -58,7 +58,22 @@ def dev():
 def load_state_dict(path, **kwargs):
     """
     Load a PyTorch file without redundant fetches across MPI ranks.
+
+    Local files are memory-mapped rather than read into memory, so tensors are
+    paged in from the file only when they are copied into a model, and no
+    second copy of the checkpoint is held. `.safetensors` files are loaded with
+    safetensors, on kwargs["map_location"] if given.
     """
+    if path.endswith(".safetensors"):
+        from safetensors.torch import load_file
+
+        return load_file(path, device=str(kwargs.get("map_location") or "cpu"))
+    if "://" not in path:
+        try:
+            return th.load(path, mmap=True, **kwargs)
+        except (TypeError, RuntimeError):
+            # torch < 2.1 has no mmap, and legacy (non-zip) files cannot be mapped
+            pass
     mpigetrank=0
     if mpigetrank==0:
         with bf.BlobFile(path, "rb") as f:
@@ -69,6 +84,20 @@ def load_state_dict(path, **kwargs):
     return th.load(io.BytesIO(data), **kwargs)
 
 
+def strip_state_dict_prefix(state_dict, prefixes=("module.", "_orig_mod.")):
+    """
+    Remove the key prefixes added by model wrappers (DataParallel/DDP's
+    `module.`, torch.compile's `_orig_mod.`), however they are nested.
+    Keys without a prefix are kept unchanged.
+    """
+    stripped = {}
+    for k, v in state_dict.items():
+        while k.startswith(prefixes):
+            k = k[len(next(p for p in prefixes if k.startswith(p))):]
+        stripped[k] = v
+    return stripped
+
+
 def sync_params(params):
     """
     Synchronize a sequence of Tensors across ranks from rank 0.
@@ -0,0 +1,95 @@
+"""
+Progressive distillation of the DDIM sampler (Salimans & Ho, 2022).
+
+A student with the teacher's architecture, highway included, learns to take
+one DDIM step where the teacher takes two. Each stage halves the number of
+sampling steps, and the trained student becomes the teacher of the next
+stage. Students sample on the nested grids of student_timesteps(), so a
+4- or 8-step checkpoint is used with exactly the timesteps it was trained on.
+"""
+
+import numpy as np
+import torch as th
+
+from . import dist_util, logger
+from .nn import mean_flat
+from .train_util import TrainLoop
+
+
+def student_timesteps(num_timesteps, steps):
+    """
+    The descending DDIM timesteps of a `steps`-step sampler.
+
+    Grids of n and 2n steps are nested: step k of the n-step grid is step 2k
+    of the 2n-step grid, so one student step spans two teacher steps.
+
+    :return: a list of `steps` timesteps, the last step going to t = -1 (x_0).
+    """
+    return [(k * num_timesteps) // steps - 1 for k in range(steps, 0, -1)]
+
+
+class DistillLoop(TrainLoop):
+    """
+    A TrainLoop whose loss makes `model` match two DDIM steps of `teacher`
+    in one step of a `student_steps`-step sampler.
+
+    :param teacher: the frozen teacher, on the same device as the model.
+    :param student_steps: sampling steps of the student; the teacher samples
+                          with twice as many.
+    """
+
+    def __init__(self, *, teacher, student_steps, clip_denoised=True, **kwargs):
+        super().__init__(**kwargs)
+        self.teacher = teacher.eval().requires_grad_(False)
+        self.student_steps = student_steps
+        self.clip_denoised = clip_denoised
+        grid = student_timesteps(self.diffusion.num_timesteps, 2 * student_steps) + [-1]
+        self.teacher_grid = th.tensor(grid, device=dist_util.dev())
+        self.alphas_cumprod = th.tensor(
+            np.append(1.0, self.diffusion.alphas_cumprod), device=dist_util.dev(), dtype=th.float32
+        )
+
+    def _alpha_sigma(self, t):
+        # index 0 is alpha_bar = 1, i.e. t = -1
+        alpha_bar = self.alphas_cumprod[t + 1].view(-1, 1, 1, 1)
+        return alpha_bar.sqrt(), (1 - alpha_bar).sqrt()
+
+    def forward_backward(self, batch, cond):
+        self.mp_trainer.zero_grad()
+        for i in range(0, batch.shape[0], self.microbatch):
+            micro = batch[i : i + self.microbatch].to(dist_util.dev())
+            x_start = micro[:, -1:]
+            x = micro.clone()
+            x[:, 0] = micro[:, 0] + 10 * micro[:, 1]
+
+            # a random student step k covers teacher steps 2k and 2k + 1
+            k = th.randint(0, self.student_steps, (micro.shape[0],), device=micro.device)
+            t, t_mid, t_end = (self.teacher_grid[2 * k + j] for j in range(3))
+            noise = th.randn_like(x_start)
+            x[:, -1:] = self.diffusion.q_sample(x_start, t, noise=noise)
+
+            with th.no_grad():
+                mid = self.diffusion.ddim_sample(
+                    self.teacher, x, t, clip_denoised=self.clip_denoised, t_prev=t_mid
+                )
+                end = self.diffusion.ddim_sample(
+                    self.teacher, mid["sample"], t_mid, clip_denoised=self.clip_denoised, t_prev=t_end
+                )
+                # the x_0 that takes the student from z_t to the teacher's z_end in one DDIM step
+                alpha_t, sigma_t = self._alpha_sigma(t)
+                alpha_end, sigma_end = self._alpha_sigma(t_end)
+                ratio = sigma_end / sigma_t
+                target = (end["sample"][:, -1:] - ratio * x[:, -1:]) / (alpha_end - ratio * alpha_t)
+                teacher_cal = mid["cal"]
+
+            out = self.diffusion.p_mean_variance(self.ddp_model, x, t, clip_denoised=False)
+            # truncated SNR weighting, max(SNR, 1)
+            weight = th.clamp(alpha_t ** 2 / sigma_t ** 2, min=1.0).flatten()
+            losses = {
+                "loss_distill": weight * mean_flat((out["pred_xstart"] - target) ** 2),
+                "loss_cal": mean_flat((out["cal"] - teacher_cal) ** 2),
+            }
+            loss = (losses["loss_distill"] + losses["loss_cal"]).mean()
+            for key, value in losses.items():
+                logger.logkv_mean(key, value.mean().item())
+            self.mp_trainer.backward(loss)
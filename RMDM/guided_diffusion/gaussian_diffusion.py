@@ -3,10 +3,8 @@ This code started out as a PyTorch port of Ho et al's diffusion models:
 https://github.com/hojonathanho/diffusion/blob/1e0dceb3b3495bbe19116a5e1b3596cd0706c543/diffusion_tf/diffusion_utils_2.py
 Docstrings have been added, as well as DDIM sampling and a new collection of beta schedules.
 """
-from torch.autograd import Variable
 import enum
 import torch.nn.functional as F
-from torchvision.utils import save_image
 import torch
 import math
 import os
@@ -15,13 +13,10 @@ import os
 import numpy as np
 import torch as th
 import torch.nn as nn
-from .train_util import visualize
+from . import profiling
 from .nn import mean_flat
 from .losses import normal_kl, discretized_gaussian_log_likelihood
-from scipy import ndimage
-from torchvision import transforms
 from .utils import staple, dice_score, norm
-import torchvision.utils as vutils
 from .dpm_solver import NoiseScheduleVP, model_wrapper, DPM_Solver
 import string
 import random
@@ -472,6 +467,12 @@ class GaussianDiffusion:
             - pred_xstart
         ) / _extract_into_tensor(self.sqrt_recipm1_alphas_cumprod, t, x_t.shape)
 
+    def model_timesteps(self):
+        """
+        The timestep values the model is called with, one per diffusion step.
+        """
+        return self._scale_timesteps(th.arange(self.num_timesteps))
+
     def _scale_timesteps(self, t):
         if self.rescale_timesteps:
 
@@ -626,7 +627,7 @@ class GaussianDiffusion:
         progress=False,
     ):
         if device is None:
-            device = next(model.parameters()).device
+            device = model_device(model)
 
         img = img.to(device).float()
 
@@ -681,7 +682,7 @@ class GaussianDiffusion:
         classifier=None
     ):
         if device is None:
-            device = next(model.parameters()).device
+            device = model_device(model)
         img = img.to(device).float()
         
         # 确保输入图像通道数正确
@@ -774,16 +775,11 @@ class GaussianDiffusion:
         classifier=None
     ):
         if device is None:
-            device = next(model.parameters()).device
+            device = model_device(model)
         assert isinstance(shape, (tuple, list))
         img = img.to(device)
-        noise = th.randn_like(img[:, :1, ...]).to(device)
-        x_noisy = torch.cat((img[:, :-1,  ...], noise), dim=1)  #add noise as the last channel
-        
-       
-
-
-        img=img.to(device)
+        noise = th.randn_like(img[:, :1, ...])
+        x_noisy = torch.cat((img[:, :-1,  ...], noise), dim=1)  #add noise as the last channel; the loop copies it into its own buffer
 
         # if self.dpm_solver:
         #     final = {}
@@ -878,6 +874,7 @@ class GaussianDiffusion:
                 model_kwargs=model_kwargs,
                 device=device,
                 progress=progress,
+                final_only=True,
             ):
                 final = sample
                 # i += 1
@@ -914,53 +911,58 @@ class GaussianDiffusion:
         model_kwargs=None,
         device=None,
         progress=False,
+        final_only=False,
         ):
         """
         Generate samples from the model and yield intermediate samples from
         each timestep of diffusion.
         Arguments are the same as p_sample_loop().
+
+        The loop keeps a single [N, C, H, W] buffer holding the conditioning
+        channels and the current sample in the last channel; each step only
+        writes that last channel in place. The yielded 'sample' is a view into
+        the buffer and is overwritten by the next step, so clone() it to keep it.
+
+        :param final_only: if True, only yield the output of the last step.
         Returns a generator over dicts, where each dict is the return value of
         p_sample().
         """
 
         if device is None:
-            device = next(model.parameters()).device
+            device = model_device(model)
         assert isinstance(shape, (tuple, list))
+        img = th.empty(*(noise.shape if noise is not None else shape), device=device, dtype=th.float32)
         if noise is not None:
-            img = noise
+            img.copy_(noise)
         else:
-            img = th.randn(*shape, device=device)
+            img.normal_()
+        seg = img[:, -1:, ...]
         indices = list(range(time))[::-1]
-        org_c = img.size(1)
-        org_MRI = img[:, :-1, ...]      #original brain MR image
         if progress:
             # Lazy import so that we don't depend on tqdm.
             from tqdm.auto import tqdm
 
             indices = tqdm(indices)
 
-        else:
-           for i in indices:
-                t = th.tensor([i] * shape[0], device=device)
-                # if i%100==0:
-                    # print('sampling step', i)
-                    # viz.image(visualize(img.cpu()[0, -1,...]), opts=dict(caption="sample"+ str(i) ))
-
-                with th.no_grad():
-                    # print('img bef size',img.size())
-                    if img.size(1) != org_c:
-                        img = torch.cat((org_MRI,img), dim=1)       #in every step, make sure to concatenate the original image to the sampled segmentation mask
-
-                    out = self.p_sample(
-                        model,
-                        img.float(),
-                        t,
-                        clip_denoised=clip_denoised,
-                        denoised_fn=denoised_fn,
-                        model_kwargs=model_kwargs,
-                    )
-                    yield out
-                    img = out["sample"]
+        out = None
+        for i in indices:
+            t = th.tensor([i] * shape[0], device=device)
+            with th.no_grad():
+                out = self.p_sample(
+                    model,
+                    img,
+                    t,
+                    clip_denoised=clip_denoised,
+                    denoised_fn=denoised_fn,
+                    model_kwargs=model_kwargs,
+                )
+                seg.copy_(out["sample"])
+            if not final_only:
+                out["sample"] = seg
+                yield out
+        if final_only and out is not None:
+            out["sample"] = seg
+            yield out
 
     def ddim_sample(
             self,
@@ -1118,7 +1120,9 @@ class GaussianDiffusion:
         cond_fn=None,
         model_kwargs=None,
         eta=0.0,
+        inplace=False,
     ):
+        # inplace=True 时直接把新的分割通道写回 x 的最后一通道, 不再拼接新张量
         # 将输入拆分为条件部分和去噪部分
         condition_part = x[:, :-1, ...]  # 前C-1个通道作为条件
         seg_part = x[:, -1:, ...]       # 最后一个通道需要去噪
@@ -1168,7 +1172,11 @@ class GaussianDiffusion:
         new_seg = mean_pred + nonzero_mask * sigma * noise
 
         # 拼接条件部分和新生成的分割
-        sample = th.cat([condition_part, new_seg], dim=1)
+        if inplace:
+            seg_part.copy_(new_seg)
+            sample = x
+        else:
+            sample = th.cat([condition_part, new_seg], dim=1)
 
         return {"sample": sample, "pred_xstart": pred_xstart}
 
@@ -1182,10 +1190,14 @@ class GaussianDiffusion:
     cond_fn=None,
     model_kwargs=None,
     eta=0.0,
+    inplace=False,
+    t_prev=None,
 ):
         """
         对输入 x 在时刻 t 使用 DDIM 更新"最后一个通道"。
         x.shape = [N, condition_channels + 1, H, W]
+        inplace=True: 新的分割通道直接写回 x[:, -1:], 返回的 sample 就是 x 本身 (不分配新张量)。
+        t_prev: 跳步采样时的上一个时间步 (-1 表示 x_0)。为 None 时退化为 t-1。
         """
         if model_kwargs is None:
             model_kwargs = {}
@@ -1212,7 +1224,11 @@ class GaussianDiffusion:
 
         # 4) 计算 DDIM 参数
         alpha_bar     = _extract_into_tensor(self.alphas_cumprod,      t, seg_x.shape)
-        alpha_bar_prev= _extract_into_tensor(self.alphas_cumprod_prev, t, seg_x.shape)
+        if t_prev is None:
+            alpha_bar_prev= _extract_into_tensor(self.alphas_cumprod_prev, t, seg_x.shape)
+        else:
+            # alphas_cumprod of the actual previous strided step; index 0 is alpha_bar = 1 (t_prev = -1)
+            alpha_bar_prev= _extract_into_tensor(np.append(1.0, self.alphas_cumprod), t_prev + 1, seg_x.shape)
 
         sigma = (
             eta
@@ -1230,8 +1246,12 @@ class GaussianDiffusion:
         new_seg = mean_pred + nonzero_mask * sigma * noise
 
         # 6) 把 "其他通道" + "更新后的分割通道" 拼回去
-        condition_part = x[:, :-1, ...]
-        x_updated = torch.cat([condition_part, new_seg], dim=1)
+        if inplace:
+            seg_x.copy_(new_seg)
+            x_updated = x
+        else:
+            condition_part = x[:, :-1, ...]
+            x_updated = torch.cat([condition_part, new_seg], dim=1)
 
         return {
             "sample": x_updated,        # [N, condition_channels+1, H, W]
@@ -1252,6 +1272,7 @@ class GaussianDiffusion:
         model_kwargs=None,
         device=None,
         progress=False,
+        timesteps=None,
     ):
         """
         演示如何对“多模态 MRI + 最后一通道 segmentation” 的图像进行 DDIM 推理：
@@ -1261,9 +1282,10 @@ class GaussianDiffusion:
         shape: (N, total_channels, H, W)
         img:   (N, total_channels, H, W)，其中最后一通道是 GT / 标注 / 或原来的初始化。
         noise: 若不为 None，就替换最后一通道为 noise，否则随机生成。
+        timesteps: 显式给定的降序 DDIM 时间步 (如蒸馏学生模型的步表), 给定时忽略 step。
         """
         if device is None:
-            device = next(model.parameters()).device
+            device = model_device(model)
 
         img = img.to(device).float()     # 原图
 
@@ -1289,6 +1311,8 @@ class GaussianDiffusion:
             device=device,
             progress=progress,
             eta=0.0,  # 根据需要可修改
+            final_only=True,
+            timesteps=timesteps,
         ):
             final = sample  # 不断更新，直到最后一次
 
@@ -1325,7 +1349,7 @@ class GaussianDiffusion:
         progress=False,
     ):
         if device is None:
-            device = next(model.parameters()).device
+            device = model_device(model)
         assert isinstance(shape, (tuple, list))
         b = shape[0]
         t = th.randint(499,500, (b,), device=device).long().to(device)
@@ -1374,7 +1398,7 @@ class GaussianDiffusion:
         """
         final = None
         if device is None:
-            device = next(model.parameters()).device
+            device = model_device(model)
         assert isinstance(shape, (tuple, list))
         b = shape[0]
         t = th.randint(99, 100, (b,), device=device).long().to(device)
@@ -1459,41 +1483,47 @@ class GaussianDiffusion:
     device=None,
     progress=False,
     eta=0.0,
+    final_only=False,
+    timesteps=None,
 ):
+        """
+        预分配一个 [N, C, H, W] 缓冲区, 每一步只原地更新最后一通道。
+        yield 出的 'sample' 是该缓冲区本身 (会被下一步覆盖, 需要保留请 clone())。
+        final_only=True: 只 yield 最后一步的结果。
+        timesteps: 显式给定的降序时间步 (如 distillation.student_timesteps), 给定时忽略 time。
+        """
         if device is None:
-            device = next(model.parameters()).device
+            device = model_device(model)
 
         # 修改初始化，确保保留多通道条件信息
+        img = torch.empty(*(noise.shape if noise is not None else shape), device=device, dtype=torch.float32)
         if noise is not None:
-            img = noise.to(device)
+            img.copy_(noise)
         else:
             # 假设 shape = (N, total_channels, H, W)
             # 前面的 total_channels - 1 是条件通道，最后1个是需要去噪的分割通道
-            N, total_channels, H, W = shape
-            condition_channels = total_channels - 1
-            
-            # 在此处，应使用你的实际条件数据，而非全零或随机数据
-            # 比如，如果你有固定的MRI条件图像，可以这样做：
-            # condition_part = 已知的 MRI 图像 [N, condition_channels, H, W]
-            # 这里暂时用zeros来示例
-            condition_part = torch.zeros((N, condition_channels, H, W), device=device)
-            
-            segmentation_noise = torch.randn((N, 1, H, W), device=device)
-            img = torch.cat([condition_part, segmentation_noise], dim=1)
-
-        # 以下部分保持不变
-        total_steps = self.num_timesteps
-        step_indices = np.linspace(0, total_steps - 1, time, dtype=int)
-        indices = list(step_indices[::-1])
-        if indices[-1] != 0:
-            indices.append(0)
+            # 没有给定条件时, 条件通道置零 (应使用实际的条件数据)
+            img.zero_()
+            img[:, -1:, ...].normal_()
+
+        # time 个跳步时间步 (去重, 保证 time > num_timesteps 时不会重复走同一步), 每步使用真实的 (t, t_prev)
+        if timesteps is None:
+            total_steps = self.num_timesteps
+            step_indices = np.unique(np.linspace(0, total_steps - 1, time, dtype=int))
+            indices = list(step_indices[::-1])
+        else:
+            indices = [int(i) for i in timesteps]
+        prev_indices = indices[1:] + [-1]
+        steps = list(zip(indices, prev_indices))
 
         if progress:
             from tqdm.auto import tqdm
-            indices = tqdm(indices)
+            steps = tqdm(steps)
 
-        for i in indices:
+        out = None
+        for i, i_prev in steps:
             t = torch.tensor([i] * shape[0], device=device)
+            t_prev = torch.tensor([i_prev] * shape[0], device=device)
             with torch.no_grad():
                 out = self.ddim_sample(
                     model,
@@ -1504,9 +1534,13 @@ class GaussianDiffusion:
                     cond_fn=cond_fn,
                     model_kwargs=model_kwargs,
                     eta=eta,
+                    inplace=True,
+                    t_prev=t_prev,
                 )
+            if not final_only:
+                yield out
+        if final_only and out is not None:
             yield out
-            img = out["sample"]
 
     def ddim_sample_loop_progressive_1(
         self,
@@ -1523,7 +1557,7 @@ class GaussianDiffusion:
         eta=0.0,  # 默认确定性采样
     ):
         if device is None:
-            device = next(model.parameters()).device
+            device = model_device(model)
 
         if noise is not None:
             img = noise.to(device)
@@ -1591,7 +1625,7 @@ class GaussianDiffusion:
         :return: 生成器，逐步返回采样结果。
         """
         if device is None:
-            device = next(model.parameters()).device
+            device = model_device(model)
 
         # 初始化噪声
         if noise is not None:
@@ -1649,7 +1683,7 @@ class GaussianDiffusion:
         注意：只在最后一通道执行扩散，还原，其它通道视作条件不变。
         """
         if device is None:
-            device = next(model.parameters()).device
+            device = model_device(model)
 
         # 初始 x，如果没有外部 noise，就随机初始化
         if noise is not None:
@@ -1771,20 +1805,29 @@ class GaussianDiffusion:
 
 
 
-    def training_losses_segmentation(self, model, classifier, x_start, t, model_kwargs=None, noise=None):
+    def training_losses_segmentation(self, model, classifier, x_start, t, model_kwargs=None, noise=None, timesteps_per_sample=1):
         """
         Compute training losses for a single timestep.
         :param model: the model to evaluate loss on.
         :param x_start: the [N x C x ...] tensor of inputs.
-        :param t: a batch of timestep indices.
+        :param t: a batch of timestep indices, of shape [N * timesteps_per_sample].
         :param model_kwargs: if not None, a dict of extra keyword arguments to
             pass to the model. This can be used for conditioning.
         :param noise: if specified, the specific Gaussian noise to try to remove.
-        :return: a dict with the key "loss" containing a tensor of shape [N].
+        :param timesteps_per_sample: K > 1 noises each conditioning sample at K
+            timesteps; the highway branch (and PINN loss) is then evaluated
+            once per conditioning sample and shared by its K copies.
+        :return: a dict with the key "loss" containing a tensor of shape [N * K].
                  Some mean or variance settings may also have other keys.
         """
         if model_kwargs is None:
             model_kwargs = {}
+        K = timesteps_per_sample
+        if K > 1:
+            # rows of the same conditioning sample are contiguous: [b0 t0, b0 t1, ..., b1 t0, ...]
+            x_start = x_start.repeat_interleave(K, dim=0)
+            model_kwargs = {k: v.repeat_interleave(K, dim=0) for k, v in model_kwargs.items()}
+            model_kwargs["highway_repeats"] = K
         if noise is None:
             noise = th.randn_like(x_start[:, -1:, ...])
 
@@ -1834,8 +1877,11 @@ class GaussianDiffusion:
                 ModelMeanType.EPSILON: noise,
             }[self.model_mean_type]
 
-            loss_pinn = torch.tensor(self.cal_pinn(cal[:,0,:,:], x_t[:,0,:,:], x_t[:,1,:,:], k=0.2))
+            with profiling.phase("pinn"):
+                loss_pinn = torch.tensor(self.cal_pinn(cal[::K,0,:,:], x_t[::K,0,:,:], x_t[::K,1,:,:], k=0.2))
             loss_pinn = loss_pinn.to(x_t.device)
+            if K > 1:
+                loss_pinn = loss_pinn.repeat_interleave(K, dim=0)
             
 
             # model_output = (cal > 0.5) * (model_output >0.5) * model_output if 2. * (cal*model_output).sum() / (cal+model_output).sum() < 0.75 else model_output
@@ -2005,6 +2051,18 @@ class GaussianDiffusion:
         }
 
 
+def model_device(model):
+    """
+    The device a sampling loop allocates its tensors on: the model's `device`
+    attribute if it has one (e.g. an OnnxRuntimeModel backend), otherwise the
+    device of its first parameter.
+    """
+    device = getattr(model, "device", None)
+    if device is not None:
+        return device
+    return next(model.parameters()).device
+
+
 def _extract_into_tensor(arr, timesteps, broadcast_shape):
     """
     Extract values from a 1-D numpy array for a batch of indices.
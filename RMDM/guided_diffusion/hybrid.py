@@ -0,0 +1,78 @@
+"""
+Confidence-gated hybrid inference.
+
+The Generic_UNet highway of UNetModel_newpreview predicts a radio map (`cal`)
+from the conditioning channels alone, at the cost of one highway pass. Its
+PINN residual (GaussianDiffusion.cal_pinn, the physics loss used in training)
+serves as a confidence signal: samples whose residual is at most `threshold`
+keep the highway map, and only the others go through the reverse diffusion
+chain, either in full or as a truncated chain warm-started from the noised
+highway map.
+"""
+
+import numpy as np
+import torch as th
+
+from .gaussian_diffusion import model_device
+
+
+def pinn_residual(diffusion, cal, x):
+    """
+    Per-sample PINN residual of highway maps, as in training_losses_segmentation.
+
+    :param cal: [N x 1 x H x W] highway maps.
+    :param x: [N x C x H x W] model input; channel 0 is buildings + 10 * Tx,
+              channel 1 is Tx.
+    :return: an [N] float Tensor on cal's device.
+    """
+    residual = diffusion.cal_pinn(cal[:, 0], x[:, 0], x[:, 1], k=0.2)
+    return th.tensor(residual, dtype=th.float32, device=cal.device)
+
+
+def hybrid_sample(
+    diffusion,
+    model,
+    img,
+    threshold,
+    steps=50,
+    warm_start=None,
+    clip_denoised=True,
+):
+    """
+    Highway first, diffusion only for the samples it is not confident about.
+
+    :param img: an [N x C x H x W] batch prepared like for ddim_sample_loop_known
+                (channel 0 = buildings + 10 * Tx, last channel ignored).
+    :param threshold: largest PINN residual accepted from the highway.
+    :param steps: DDIM steps of a full chain.
+    :param warm_start: if set, a timestep t0; routed samples run only the DDIM
+                       steps of the `steps` grid at or below t0, starting from
+                       the highway map noised to the first of them.
+    :return: a dict with "sample" ([N x 1 x H x W] radio maps), "cal" (the
+             highway maps), "residual" ([N]) and "routed" ([N] bool).
+    """
+    assert hasattr(model, "hwm") and model.hwm.anchor_out, "needs a model with an anchor-out highway"
+    device = model_device(model)
+    img = img.to(device).float()
+    with th.no_grad():
+        _, cal = model.highway_forward(img[:, :-1])
+        residual = pinn_residual(diffusion, cal, img)
+        routed = residual > threshold
+        result = cal.clone()
+        if routed.any():
+            sub = img[routed]
+            kwargs = {}
+            if warm_start is None:
+                noise = None
+            else:
+                grid = np.unique(np.linspace(0, diffusion.num_timesteps - 1, steps, dtype=int))[::-1]
+                kwargs["timesteps"] = [int(t) for t in grid if t <= warm_start]
+                # start exactly at the first grid step of the truncated chain
+                t0 = th.full((sub.shape[0],), kwargs["timesteps"][0], device=device, dtype=th.long)
+                noise = diffusion.q_sample(cal[routed], t0)
+            sample, _, _, _, _ = diffusion.ddim_sample_loop_known(
+                model, tuple(sub.shape), sub, step=steps, noise=noise,
+                clip_denoised=clip_denoised, **kwargs
+            )
+            result[routed] = sample[:, -1:]
+    return {"sample": result, "cal": cal, "residual": residual, "routed": routed}
@@ -12,6 +12,7 @@ import torchvision.transforms.functional as F
 import torchvision.transforms as transforms
 import pandas as pd
 from skimage.transform import rotate
+from .manifest import load_manifest
 
 class ISICDataset(Dataset):
     def __init__(self, args, data_path , transform = None, mode = 'Training',plane = False):
@@ -22,6 +23,9 @@ class ISICDataset(Dataset):
         self.label_list = df.iloc[:,2].tolist()
         self.data_path = data_path
         self.mode = mode
+        self.manifest = load_manifest(data_path)
+        if self.manifest is not None:
+            self.manifest.require(self.name_list + self.label_list, what="ISIC " + mode + " set")
 
         self.transform = transform
 
@@ -36,6 +40,9 @@ class ISICDataset(Dataset):
         mask_name = self.label_list[index]
         msk_path = os.path.join(self.data_path, mask_name)
 
+        if self.manifest is not None:
+            self.manifest.check(img_path)
+            self.manifest.check(msk_path)
         img = Image.open(img_path).convert('RGB')
         mask = Image.open(msk_path).convert('L')
 
@@ -8,6 +8,7 @@ import sys
 import shutil
 import os.path as osp
 import json
+import math
 import time
 import datetime
 import tempfile
@@ -147,6 +148,140 @@ class CSVOutputFormat(KVWriter):
         self.file.close()
 
 
+class MetricsOutputFormat(KVWriter):
+    """
+    Append-only metrics store, read back with read_metrics().
+
+    Rows are buffered and appended as JSON lines to numbered segments
+    (seg-00000.jsonl, ...) in `dir`, so a new key never rewrites earlier rows.
+    Once a segment holds `rows_per_segment` rows it is closed and, if pyarrow
+    is installed, compacted into seg-NNNNN.parquet with the union of its keys
+    as schema. A new writer, e.g. of a resumed run, starts a new segment.
+    """
+
+    def __init__(self, dir, flush_every=20, flush_secs=30.0, rows_per_segment=50000):
+        os.makedirs(dir, exist_ok=True)
+        self.dir = dir
+        self.flush_every = flush_every
+        self.flush_secs = flush_secs
+        self.rows_per_segment = rows_per_segment
+        segments = _metric_segments(dir)
+        for jsonl, parquet in segments.values():
+            if jsonl and parquet:
+                # left over by a compaction interrupted after the parquet file was written
+                os.remove(jsonl)
+        self.segment = max(segments, default=-1) + 1
+        self.buffer = []
+        self.rows = 0
+        self.last_flush = time.time()
+        self.file = open(self._path(".jsonl"), "at")
+
+    def _path(self, ext):
+        return osp.join(self.dir, "seg-%05i%s" % (self.segment, ext))
+
+    def writekvs(self, kvs):
+        row = {k: float(v) if hasattr(v, "dtype") else v for k, v in kvs.items()}
+        # NaN/Infinity are not JSON, and pyarrow rejects them: store null
+        row = {k: None if isinstance(v, float) and not math.isfinite(v) else v for k, v in row.items()}
+        self.buffer.append(json.dumps(row))
+        if len(self.buffer) >= self.flush_every or time.time() - self.last_flush >= self.flush_secs:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write("\n".join(self.buffer) + "\n")
+            self.file.flush()
+            self.rows += len(self.buffer)
+            self.buffer = []
+        self.last_flush = time.time()
+        if self.rows >= self.rows_per_segment:
+            self.file.close()
+            self._compact()
+            self.segment += 1
+            self.rows = 0
+            self.file = open(self._path(".jsonl"), "at")
+
+    def _compact(self):
+        jsonl = self._path(".jsonl")
+        if self.rows == 0:
+            os.remove(jsonl)
+            return
+        try:
+            import pyarrow.json as paj
+            import pyarrow.parquet as pq
+        except ImportError:
+            return
+        tmp = self._path(".parquet.tmp")
+        try:
+            pq.write_table(paj.read_json(jsonl), tmp)
+        except Exception as e:
+            # runs inside the training loop: keep the .jsonl segment, read_metrics reads it as is
+            warnings.warn("could not compact %s, keeping it: %s" % (jsonl, e))
+            if osp.exists(tmp):
+                os.remove(tmp)
+            return
+        os.replace(tmp, self._path(".parquet"))
+        os.remove(jsonl)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        self._compact()
+
+
+def _metric_segments(dir):
+    """
+    :return: {segment number: (jsonl path or None, parquet path or None)}.
+    """
+    segments = defaultdict(lambda: [None, None])
+    for name in os.listdir(dir):
+        base, ext = osp.splitext(name)
+        if base.startswith("seg-") and ext in (".jsonl", ".parquet"):
+            segments[int(base[4:])][ext == ".parquet"] = osp.join(dir, name)
+    return {seg: tuple(paths) for seg, paths in sorted(segments.items())}
+
+
+def read_metrics(dir):
+    """
+    Load every row written by MetricsOutputFormat into `dir` as a pandas
+    DataFrame, in write order; keys missing from a row are NaN. Uses pyarrow
+    if installed (required for compacted segments), pandas otherwise.
+    """
+    import pandas
+
+    try:
+        import pyarrow as pa
+        import pyarrow.json as paj
+        import pyarrow.parquet as pq
+    except ImportError:
+        pa = None
+    tables = []
+    for jsonl, parquet in _metric_segments(dir).values():
+        if parquet:
+            if pa is None:
+                raise ImportError("pyarrow is required to read compacted segment %s" % parquet)
+            tables.append(pq.read_table(parquet))
+        elif os.path.getsize(jsonl):
+            if pa is None:
+                tables.append(pandas.read_json(jsonl, lines=True))
+                continue
+            try:
+                tables.append(paj.read_json(jsonl))
+            except pa.ArrowInvalid:
+                # a segment pyarrow cannot parse, e.g. with NaN written by an older writer
+                tables.append(pa.Table.from_pandas(pandas.read_json(jsonl, lines=True), preserve_index=False))
+    if not tables:
+        return pandas.DataFrame()
+    if pa is None:
+        return pandas.concat(tables, ignore_index=True, sort=False)
+    try:
+        table = pa.concat_tables(tables, promote_options="permissive")
+    except TypeError:
+        # pyarrow < 14
+        table = pa.concat_tables(tables, promote=True)
+    return table.to_pandas()
+
+
 class TensorBoardOutputFormat(KVWriter):
     """
     Dumps key/value pairs into TensorBoard's numeric format.
@@ -188,6 +323,33 @@ class TensorBoardOutputFormat(KVWriter):
             self.writer = None
 
 
+class VisdomOutputFormat(KVWriter):
+    """
+    Plots every numeric key/value pair as a line in a Visdom server.
+    visdom is imported, and the server contacted, only when this format is used.
+    """
+
+    def __init__(self, port):
+        from visdom import Visdom
+
+        self.viz = Visdom(port=port)
+        self.step = 0
+
+    def writekvs(self, kvs):
+        for k, v in kvs.items():
+            if hasattr(v, "dtype"):
+                v = float(v)
+            if isinstance(v, (int, float)):
+                self.viz.line(
+                    X=[self.step], Y=[v], win=k, update="append" if self.step else None,
+                    opts=dict(title=k),
+                )
+        self.step += 1
+
+    def close(self):
+        pass
+
+
 def make_output_format(format, ev_dir, log_suffix=""):
     os.makedirs(ev_dir, exist_ok=True)
     if format == "stdout":
@@ -198,8 +360,12 @@ def make_output_format(format, ev_dir, log_suffix=""):
         return JSONOutputFormat(osp.join(ev_dir, "progress%s.json" % log_suffix))
     elif format == "csv":
         return CSVOutputFormat(osp.join(ev_dir, "progress%s.csv" % log_suffix))
+    elif format == "metrics":
+        return MetricsOutputFormat(osp.join(ev_dir, "metrics%s" % log_suffix))
     elif format == "tensorboard":
         return TensorBoardOutputFormat(osp.join(ev_dir, "tb%s" % log_suffix))
+    elif format == "visdom":
+        return VisdomOutputFormat(int(os.getenv("VISDOM_PORT", "8850")))
     else:
         raise ValueError("Unknown format specified: %s" % (format,))
 
@@ -460,7 +626,7 @@ def configure(dir='./results', format_strs=None, comm=None, log_suffix=""):
 
     if format_strs is None:
         if rank == 0:
-            format_strs = os.getenv("OPENAI_LOG_FORMAT", "stdout,log,csv").split(",")
+            format_strs = os.getenv("OPENAI_LOG_FORMAT", "stdout,log,metrics").split(",")
         else:
             format_strs = os.getenv("OPENAI_LOG_FORMAT_MPI", "log").split(",")
     format_strs = filter(None, format_strs)
@@ -0,0 +1,205 @@
+"""
+Persistent dataset index manifests.
+
+A manifest records, once, every file under a dataset root: its relative path,
+size, mtime and, where the header can be read cheaply, shape and dtype
+(.png, .npy, .nii/.nii.gz), plus an optional CRC32. Loaders open it instead of
+scanning the tree, which on a networked filesystem with hundreds of thousands
+of files takes minutes, and check the files they need against it at
+construction without touching the filesystem. Files are validated lazily: the
+first time a process reads a file, check() compares its size with the record.
+
+Build one with scripts/RMDM_build_manifest.py; loaders look for
+MANIFEST_NAME at the root of their dataset.
+"""
+
+import json
+import os
+import zlib
+
+MANIFEST_NAME = "manifest.json"
+VERSION = 1
+
+
+def _header(path):
+    """
+    :return: (shape, dtype) from the file header, or (None, None).
+    """
+    try:
+        if path.endswith(".npy"):
+            import numpy as np
+
+            with open(path, "rb") as f:
+                if np.lib.format.read_magic(f) == (1, 0):
+                    shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+            return list(shape), str(dtype)
+        if path.endswith(".png"):
+            from PIL import Image
+
+            with Image.open(path) as img:
+                bands = len(img.getbands())
+                return ([img.height, img.width] + ([bands] if bands > 1 else [])), img.mode
+        if path.endswith((".nii", ".nii.gz")):
+            import nibabel
+
+            header = nibabel.load(path).header
+            return list(header.get_data_shape()), str(header.get_data_dtype())
+    except Exception:
+        pass
+    return None, None
+
+
+def _crc32(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            crc = zlib.crc32(chunk, crc)
+    return "%08x" % crc
+
+
+def build_manifest(root, headers=True, checksums=False, out=None):
+    """
+    Index every file under root and write the manifest to out (default
+    root/MANIFEST_NAME).
+
+    :param headers: record shape and dtype of image and volume files.
+    :param checksums: record a CRC32 of every file; reads all the data.
+    :return: the Manifest.
+    """
+    files = {}
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=True):
+                    stack.append(entry.path)
+                    continue
+                rel = os.path.relpath(entry.path, root).replace(os.sep, "/")
+                if rel == MANIFEST_NAME:
+                    continue
+                st = entry.stat()
+                record = dict(size=st.st_size, mtime=int(st.st_mtime))
+                if headers:
+                    shape, dtype = _header(entry.path)
+                    if shape is not None:
+                        record.update(shape=shape, dtype=dtype)
+                if checksums:
+                    record["crc32"] = _crc32(entry.path)
+                files[rel] = record
+    out = out or os.path.join(root, MANIFEST_NAME)
+    with open(out + ".tmp", "w") as f:
+        json.dump(dict(version=VERSION, files=dict(sorted(files.items()))), f, separators=(",", ":"))
+    os.replace(out + ".tmp", out)
+    return Manifest(root, files)
+
+
+def load_manifest(root, path=None):
+    """
+    :return: the Manifest at path (default root/MANIFEST_NAME), or None if
+             there is none.
+    """
+    path = path or os.path.join(root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != VERSION:
+        raise ValueError(f"{path}: unsupported manifest version {data.get('version')}, rebuild it")
+    return Manifest(root, data["files"])
+
+
+class Manifest:
+    """
+    The file index of one dataset root; paths are relative to it, with "/".
+    """
+
+    def __init__(self, root, files):
+        self.root = root
+        self.files = files
+        self._checked = set()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, rel):
+        return rel in self.files
+
+    def relpath(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def require(self, rels, what="dataset"):
+        """
+        Raise FileNotFoundError naming the first missing files if any of rels
+        is not in the manifest; no filesystem access.
+        """
+        missing = [rel for rel in rels if rel not in self.files]
+        if missing:
+            raise FileNotFoundError(
+                f"{len(missing)} files of the {what} are missing from {self.root} "
+                f"(according to its manifest), e.g. {missing[:5]}"
+            )
+
+    def leaf_dirs(self):
+        """
+        {directory: sorted file names} of the directories holding files but
+        no subdirectories, like the leaves of os.walk.
+        """
+        dirs = {}
+        for rel in self.files:
+            parent, name = rel.rsplit("/", 1) if "/" in rel else ("", rel)
+            dirs.setdefault(parent, []).append(name)
+        parents = set()
+        for d in dirs:
+            while d:
+                d = d.rsplit("/", 1)[0] if "/" in d else ""
+                parents.add(d)
+        return {
+            os.path.join(self.root, d): sorted(names)
+            for d, names in sorted(dirs.items()) if d not in parents
+        }
+
+    def glob(self, directory, suffix):
+        """
+        Sorted absolute paths of the files directly in directory (relative to
+        root) ending in suffix.
+        """
+        prefix = directory.strip("/") + "/" if directory.strip("/") else ""
+        return [
+            os.path.join(self.root, rel) for rel in sorted(self.files)
+            if rel.startswith(prefix) and "/" not in rel[len(prefix):] and rel.endswith(suffix)
+        ]
+
+    def check(self, path):
+        """
+        Lazy validation: the first time a process opens path, compare its
+        size with the record. Raise FileNotFoundError / IOError on a
+        mismatch.
+        """
+        if path in self._checked:
+            return
+        rel = self.relpath(path)
+        record = self.files.get(rel)
+        if record is None:
+            raise FileNotFoundError(f"{path} is not in the manifest of {self.root}")
+        size = os.stat(path).st_size
+        if size != record["size"]:
+            raise IOError(f"{path} has {size} bytes, the manifest of {self.root} records {record['size']}; rebuild it")
+        self._checked.add(path)
+
+    def verify(self, rel):
+        """
+        Full check of one file against its record, CRC32 included if recorded.
+        :return: None if it matches, else a description of the mismatch.
+        """
+        path = os.path.join(self.root, rel)
+        record = self.files[rel]
+        if not os.path.exists(path):
+            return "missing"
+        if os.stat(path).st_size != record["size"]:
+            return "size differs"
+        if "crc32" in record and _crc32(path) != record["crc32"]:
+            return "checksum differs"
+        return None
@@ -0,0 +1,100 @@
+"""
+ONNX export of the denoiser and an ONNX Runtime model backend for sampling.
+
+The exported graph takes ("x", "timesteps") and returns ("out", "cal"), like
+UNetModel_newpreview.forward, with a dynamic batch axis. OnnxRuntimeModel is
+called the same way as the torch module, so it can be passed as `model` to the
+GaussianDiffusion / SpacedDiffusion sampling loops.
+"""
+
+import numpy as np
+import torch as th
+import torch.nn as nn
+
+
+class _ExportWrapper(nn.Module):
+    """
+    Fixes the forward signature to (x, timesteps) -> (out, cal) for export.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x, timesteps):
+        out, cal = self.model(x, timesteps)
+        return out, cal
+
+
+def export_onnx(model, path, in_channels, image_size, batch_size=2, opset=17):
+    """
+    Export a denoiser to an ONNX file with a dynamic batch axis.
+
+    The timestep cache is a lookup with data-dependent checks, so it is
+    bypassed while tracing; the exported graph computes the timestep
+    embedding itself.
+
+    :param model: a UNetModel_newpreview (or any model returning (out, cal)).
+    :param in_channels: channels of x, conditioning channels plus the noisy one.
+    :param batch_size: batch of the example input; keep it above 1 so no
+                       batch-1 shape is baked into the graph.
+    """
+    device = next(model.parameters()).device
+    was_training = model.training
+    cache = getattr(model, "timestep_cache_index", None)
+    model.eval()
+    if cache is not None:
+        model.timestep_cache_index = None
+    try:
+        x = th.randn(batch_size, in_channels, image_size, image_size, device=device)
+        timesteps = th.arange(batch_size, device=device, dtype=th.float32)
+        with th.no_grad():
+            th.onnx.export(
+                _ExportWrapper(model),
+                (x, timesteps),
+                path,
+                input_names=["x", "timesteps"],
+                output_names=["out", "cal"],
+                dynamic_axes={name: {0: "batch"} for name in ("x", "timesteps", "out", "cal")},
+                opset_version=opset,
+                do_constant_folding=True,
+            )
+    finally:
+        if cache is not None:
+            model.timestep_cache_index = cache
+        model.train(was_training)
+    return path
+
+
+class OnnxRuntimeModel:
+    """
+    A model backend that runs an exported denoiser in ONNX Runtime.
+
+    Callable as model(x, timesteps) -> (out, cal) with torch tensors in and
+    out; results are returned on `device` (the CPU by default).
+
+    :param path: the .onnx file written by export_onnx().
+    :param providers: ONNX Runtime execution providers.
+    :param num_threads: intra-op threads, 0 for the ONNX Runtime default.
+    """
+
+    def __init__(self, path, providers=("CPUExecutionProvider",), num_threads=0, device="cpu"):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, sess_options=options, providers=list(providers))
+        self.device = th.device(device)
+
+    def __call__(self, x, timesteps, **kwargs):
+        assert not kwargs, f"the ONNX graph takes no extra inputs, got {sorted(kwargs)}"
+        out, cal = self.session.run(
+            ["out", "cal"],
+            {
+                "x": x.detach().float().cpu().numpy(),
+                "timesteps": timesteps.detach().cpu().numpy().astype(np.float32),
+            },
+        )
+        return th.from_numpy(out).to(self.device), th.from_numpy(cal).to(self.device)
@@ -0,0 +1,160 @@
+"""
+Per-phase step timers and torch.profiler helpers.
+
+Phase timers are cheap enough to leave on: a phase adds its wall time to a
+per-step total, and end_step() publishes every total as
+logger.logkv_mean("time_<phase>"), so the logged value is the mean time per
+step. Phases are opened with `with profiling.phase(name):` anywhere in the
+code base and are no-ops until enable() is called. attach_module_timers()
+times the model's own parts with forward hooks:
+
+- highway: the Generic_UNet highway (hwm);
+- unet_body: the model's forward minus the highway run inside it;
+- attention / ffparser: all AttentionBlock / FFParser calls, part of
+  unet_body.
+
+Module timers measure forwards only; with use_checkpoint, forwards re-run
+during the backward pass are counted too. CUDA kernels run asynchronously,
+so without sync=True, GPU time is attributed to whichever phase waits for
+it. Timers work the same on CPU.
+"""
+
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import torch as th
+
+from . import logger
+
+_TOTALS = None
+_SYNC = False
+
+
+def enable(sync=False):
+    """
+    Turn the phase timers on.
+
+    :param sync: synchronize CUDA around every phase so that GPU time is
+                 attributed exactly, at the cost of throughput.
+    """
+    global _TOTALS, _SYNC
+    _TOTALS = defaultdict(float)
+    _SYNC = sync and th.cuda.is_available()
+
+
+def synchronized_time():
+    """
+    time.perf_counter() after waiting for pending CUDA work, if any.
+    """
+    if th.cuda.is_available() and th.cuda.is_initialized():
+        th.cuda.synchronize()
+    return time.perf_counter()
+
+
+def _now():
+    if _SYNC:
+        th.cuda.synchronize()
+    return time.perf_counter()
+
+
+def add(name, seconds):
+    if _TOTALS is not None:
+        _TOTALS[name] += seconds
+
+
+@contextmanager
+def phase(name):
+    if _TOTALS is None:
+        yield
+        return
+    start = _now()
+    try:
+        yield
+    finally:
+        _TOTALS[name] += _now() - start
+
+
+def end_step():
+    """
+    Publish the phase totals of the step that just finished.
+    """
+    if _TOTALS is None:
+        return
+    for name, seconds in _TOTALS.items():
+        logger.logkv_mean("time_" + name, seconds)
+    _TOTALS.clear()
+
+
+def attach_module_timers(model):
+    """
+    Time the highway, UNet body, attention and FFParser of a model with
+    forward hooks (see the module docstring).
+
+    :return: the hook handles; call .remove() on each to detach.
+    """
+    from .unet import AttentionBlock, FFParser
+
+    starts = {}
+    highway_in_model = [0.0]
+    handles = []
+
+    def pre(module, inputs):
+        starts.setdefault(id(module), []).append(_now())
+
+    def post(name):
+        def hook(module, inputs, output):
+            elapsed = _now() - starts[id(module)].pop()
+            if name == "model":
+                add("unet_body", elapsed - highway_in_model[0])
+                highway_in_model[0] = 0.0
+            else:
+                add(name, elapsed)
+                if name == "highway" and starts.get(id(model)):
+                    highway_in_model[0] += elapsed
+        return hook
+
+    named = [(model, "model")]
+    if hasattr(model, "hwm"):
+        named.append((model.hwm, "highway"))
+    for module in model.modules():
+        if isinstance(module, AttentionBlock):
+            named.append((module, "attention"))
+        elif isinstance(module, FFParser):
+            named.append((module, "ffparser"))
+    for module, name in named:
+        handles.append(module.register_forward_pre_hook(pre))
+        handles.append(module.register_forward_hook(post(name)))
+    return handles
+
+
+def make_profiler(out_dir, start, steps, record_shapes=False):
+    """
+    A torch.profiler.profile that skips `start` steps (the last of them
+    serves as warm-up) and records the next `steps`; call .step() after every
+    training step or sample. When the window closes, it writes a Chrome trace
+    (trace.json, open in chrome://tracing or Perfetto) and the operator table
+    sorted by self time (ops.txt) to out_dir.
+    """
+    from torch.profiler import ProfilerActivity, profile, schedule
+
+    os.makedirs(out_dir, exist_ok=True)
+    activities = [ProfilerActivity.CPU]
+    if th.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    sort_by = "self_cuda_time_total" if th.cuda.is_available() else "self_cpu_time_total"
+
+    def on_trace_ready(prof):
+        prof.export_chrome_trace(os.path.join(out_dir, "trace.json"))
+        with open(os.path.join(out_dir, "ops.txt"), "w") as f:
+            f.write(prof.key_averages().table(sort_by=sort_by, row_limit=50))
+        logger.log(f"profiler trace and operator table written to {out_dir}")
+
+    return profile(
+        activities=activities,
+        schedule=schedule(wait=max(start - 1, 0), warmup=1 if start > 0 else 0, active=steps, repeat=1),
+        on_trace_ready=on_trace_ready,
+        record_shapes=record_shapes,
+        with_stack=False,
+    )
@@ -0,0 +1,149 @@
+"""
+Post-training int8 quantization of the denoiser for CPU inference.
+
+Eager-mode workflow on torch.ao.quantization:
+  - every Conv1d/Conv2d/Linear outside attention blocks is wrapped in a
+    QuantWrapper (quantize -> int8 op -> dequantize) and quantized statically,
+    with activation ranges observed during a calibration pass;
+  - the qkv/proj_out projections of AttentionBlock are 1x1 Conv1d; they are
+    rewritten as equivalent Linear layers and quantized dynamically, since
+    their activation ranges vary most between timesteps;
+  - GroupNorm, BatchNorm/InstanceNorm, the attention matmuls and the FFParser
+    FFTs are left untouched and run in float.
+
+Quantized kernels are CPU only. Typical use:
+
+    prepare_int8(model)
+    calibrate(model, diffusion, calibration_batches)
+    convert_int8(model)
+    th.save(model.state_dict(), path)
+
+and, to load such a checkpoint into a freshly created model:
+
+    quantize_structure(model)
+    model.load_state_dict(th.load(path))
+"""
+
+import warnings
+
+import torch as th
+import torch.nn as nn
+from torch.ao import quantization as tq
+
+from .unet import AttentionBlock
+
+
+class Conv1x1Linear(nn.Module):
+    """
+    A kernel-size-1 Conv1d over [N x C x T] expressed as a Linear over C.
+    """
+
+    def __init__(self, conv):
+        super().__init__()
+        assert conv.kernel_size == (1,) and conv.groups == 1
+        self.linear = nn.Linear(conv.in_channels, conv.out_channels, bias=conv.bias is not None)
+        with th.no_grad():
+            self.linear.weight.copy_(conv.weight[:, :, 0])
+            if conv.bias is not None:
+                self.linear.bias.copy_(conv.bias)
+
+    def forward(self, x):
+        return self.linear(x.transpose(1, 2)).transpose(1, 2)
+
+
+def _wrap_static(module, qconfig):
+    for name, child in module.named_children():
+        if isinstance(child, Conv1x1Linear):
+            # attention projection, left in float for convert_int8's dynamic pass
+            continue
+        if isinstance(child, AttentionBlock):
+            child.qkv = Conv1x1Linear(child.qkv)
+            child.proj_out = Conv1x1Linear(child.proj_out)
+        elif isinstance(child, (nn.Conv1d, nn.Conv2d, nn.Linear)):
+            wrapper = tq.QuantWrapper(child)
+            wrapper.qconfig = qconfig
+            setattr(module, name, wrapper)
+            continue
+        _wrap_static(child, qconfig)
+
+
+def prepare_int8(model, engine=None):
+    """
+    Rewrite a float model in place for static int8 and insert observers.
+
+    :param engine: the quantized engine, "fbgemm" (x86) or "qnnpack" (ARM);
+                   defaults to the current th.backends.quantized.engine.
+    """
+    engine = engine or th.backends.quantized.engine
+    th.backends.quantized.engine = engine
+    model.cpu().eval()
+    if hasattr(model, "clear_timestep_cache"):
+        model.clear_timestep_cache()
+    _wrap_static(model, tq.get_default_qconfig(engine))
+    tq.prepare(model, inplace=True)
+    return model
+
+
+def calibrate(model, diffusion, batches, steps=10, clip_denoised=True):
+    """
+    Run the DDIM reverse loop over calibration batches so the observers see
+    activations at the timesteps used for sampling.
+
+    :param batches: an iterable of (b, m, ...) loader batches, b being the
+                    conditioning channels as returned by the RadioMapSeer loaders.
+    """
+    with th.no_grad():
+        for batch in batches:
+            b = batch[0].float()
+            img = th.cat((b, th.randn_like(b[:, :1])), dim=1)
+            img[:, 0] = b[:, 0] + 10 * b[:, 1]
+            diffusion.ddim_sample_loop_known(
+                model, tuple(img.shape), img, step=steps, clip_denoised=clip_denoised
+            )
+    return model
+
+
+def convert_int8(model):
+    """
+    Swap observed modules for their int8 kernels and quantize the attention
+    projections dynamically.
+    """
+    tq.convert(model, inplace=True)
+    dynamic = {
+        name: tq.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, Conv1x1Linear)
+    }
+    if dynamic:
+        tq.quantize_dynamic(model, qconfig_spec=dynamic, dtype=th.qint8, inplace=True)
+    _check_dynamic_attention(model)
+    return model
+
+
+def _check_dynamic_attention(model):
+    """
+    Raise if an attention projection of a converted model is not a dynamic
+    int8 Linear, e.g. because it was quantized statically by mistake.
+    """
+    for name, module in model.named_modules():
+        if isinstance(module, AttentionBlock):
+            for proj in ("qkv", "proj_out"):
+                linear = getattr(module, proj).linear
+                if not isinstance(linear, nn.quantized.dynamic.Linear):
+                    raise RuntimeError(
+                        f"{name}.{proj} was converted to {type(linear).__name__}, "
+                        "expected a dynamically quantized Linear"
+                    )
+
+
+def quantize_structure(model, engine=None):
+    """
+    Give a float model the module structure of a converted int8 model, ready
+    for load_state_dict() of a checkpoint saved after convert_int8().
+    """
+    prepare_int8(model, engine)
+    with warnings.catch_warnings():
+        # the observers have seen no data; the loaded state dict sets the real qparams
+        warnings.simplefilter("ignore")
+        convert_int8(model)
+    return model
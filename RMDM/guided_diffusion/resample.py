@@ -5,17 +5,19 @@ import torch as th
 import torch.distributed as dist
 
 
-def create_named_schedule_sampler(name, diffusion, maxt):
+def create_named_schedule_sampler(name, diffusion, maxt, sync_every=1):
     """
     Create a ScheduleSampler from a library of pre-defined samplers.
 
     :param name: the name of the sampler.
     :param diffusion: the diffusion object to sample for.
+    :param sync_every: for loss-aware samplers, the number of updates between
+                       synchronizations of the loss history across ranks.
     """
     if name == "uniform":
         return UniformSampler(diffusion, maxt)
     elif name == "loss-second-moment":
-        return LossSecondMomentResampler(diffusion)
+        return LossSecondMomentResampler(diffusion, sync_every=sync_every)
     else:
         raise NotImplementedError(f"unknown schedule sampler: {name}")
 
@@ -68,18 +70,34 @@ class UniformSampler(ScheduleSampler):
 
 
 class LossAwareSampler(ScheduleSampler):
+    sync_every = 1
+
     def update_with_local_losses(self, local_ts, local_losses):
         """
         Update the reweighting using losses from a model.
 
         Call this method from each rank with a batch of timesteps and the
         corresponding losses for each of those timesteps.
-        This method will perform synchronization to make sure all of the ranks
-        maintain the exact same reweighting.
+        Losses are buffered on the device and, every `sync_every` calls, all
+        ranks exchange their buffers in a single all_gather, so that all of
+        them maintain the exact same reweighting.
 
         :param local_ts: an integer Tensor of timesteps.
         :param local_losses: a 1D Tensor of losses.
         """
+        if not hasattr(self, "_pending"):
+            self._pending = []
+        self._pending.append((local_ts.detach(), local_losses.detach()))
+        if len(self._pending) < self.sync_every:
+            return
+        local_ts = th.cat([ts for ts, _ in self._pending])
+        local_losses = th.cat([losses for _, losses in self._pending])
+        self._pending = []
+
+        if not dist.is_initialized() or dist.get_world_size() == 1:
+            self.update_with_all_losses(local_ts, local_losses)
+            return
+
         batch_sizes = [
             th.tensor([0], dtype=th.int32, device=local_ts.device)
             for _ in range(dist.get_world_size())
@@ -89,18 +107,18 @@ class LossAwareSampler(ScheduleSampler):
             th.tensor([len(local_ts)], dtype=th.int32, device=local_ts.device),
         )
 
-        # Pad all_gather batches to be the maximum batch size.
+        # Pad all_gather batches to be the maximum batch size, and send
+        # timesteps and losses together.
         batch_sizes = [x.item() for x in batch_sizes]
         max_bs = max(batch_sizes)
 
-        timestep_batches = [th.zeros(max_bs).to(local_ts) for bs in batch_sizes]
-        loss_batches = [th.zeros(max_bs).to(local_losses) for bs in batch_sizes]
-        dist.all_gather(timestep_batches, local_ts)
-        dist.all_gather(loss_batches, local_losses)
-        timesteps = [
-            x.item() for y, bs in zip(timestep_batches, batch_sizes) for x in y[:bs]
-        ]
-        losses = [x.item() for y, bs in zip(loss_batches, batch_sizes) for x in y[:bs]]
+        local = th.zeros([2, max_bs], dtype=th.float64, device=local_ts.device)
+        local[0, : len(local_ts)] = local_ts.to(th.float64)
+        local[1, : len(local_ts)] = local_losses.to(th.float64)
+        gathered = [th.zeros_like(local) for _ in batch_sizes]
+        dist.all_gather(gathered, local)
+        timesteps = th.cat([y[0, :bs] for y, bs in zip(gathered, batch_sizes)]).long()
+        losses = th.cat([y[1, :bs] for y, bs in zip(gathered, batch_sizes)])
         self.update_with_all_losses(timesteps, losses)
 
     @abstractmethod
@@ -116,39 +134,81 @@ class LossAwareSampler(ScheduleSampler):
         ranks with identical arguments. Thus, it should have deterministic
         behavior to maintain state across workers.
 
-        :param ts: a list of int timesteps.
-        :param losses: a list of float losses, one per timestep.
+        :param ts: an integer Tensor (or list) of timesteps.
+        :param losses: a float Tensor (or list) of losses, one per timestep.
         """
 
 
 class LossSecondMomentResampler(LossAwareSampler):
-    def __init__(self, diffusion, history_per_term=10, uniform_prob=0.001):
+    """
+    Sample timesteps proportionally to the RMS of their recent losses.
+
+    The last `history_per_term` losses of every timestep are kept in a ring
+    buffer on the training device; updates are a single scatter and sampling
+    uses torch.multinomial, so nothing is copied to the host per step.
+    """
+
+    def __init__(self, diffusion, history_per_term=10, uniform_prob=0.001, sync_every=1):
         self.diffusion = diffusion
         self.history_per_term = history_per_term
         self.uniform_prob = uniform_prob
-        self._loss_history = np.zeros(
-            [diffusion.num_timesteps, history_per_term], dtype=np.float64
+        self.sync_every = sync_every
+        self._loss_history = th.zeros(
+            [diffusion.num_timesteps, history_per_term], dtype=th.float64
         )
-        self._loss_counts = np.zeros([diffusion.num_timesteps], dtype=np.int)
-
-    def weights(self):
-        if not self._warmed_up():
-            return np.ones([self.diffusion.num_timesteps], dtype=np.float64)
-        weights = np.sqrt(np.mean(self._loss_history ** 2, axis=-1))
-        weights /= np.sum(weights)
+        self._loss_counts = th.zeros([diffusion.num_timesteps], dtype=th.long)
+        # next ring-buffer slot to write, per timestep
+        self._write_pos = th.zeros([diffusion.num_timesteps], dtype=th.long)
+
+    def _to(self, device):
+        if self._loss_history.device != th.device(device):
+            self._loss_history = self._loss_history.to(device)
+            self._loss_counts = self._loss_counts.to(device)
+            self._write_pos = self._write_pos.to(device)
+
+    def _weights(self):
+        weights = th.sqrt(th.mean(self._loss_history ** 2, dim=-1))
+        weights /= th.sum(weights)
         weights *= 1 - self.uniform_prob
         weights += self.uniform_prob / len(weights)
-        return weights
+        # uniform until every timestep has a full history (selected on device, no host sync)
+        warmed_up = (self._loss_counts == self.history_per_term).all()
+        return th.where(warmed_up, weights, th.ones_like(weights))
+
+    def weights(self):
+        return self._weights().cpu().numpy()
+
+    def sample(self, batch_size, device):
+        self._to(device)
+        p = self._weights()
+        p = p / th.sum(p)
+        indices = th.multinomial(p, batch_size, replacement=True)
+        weights = (1 / (len(p) * p[indices])).float()
+        return indices, weights
 
     def update_with_all_losses(self, ts, losses):
-        for t, loss in zip(ts, losses):
-            if self._loss_counts[t] == self.history_per_term:
-                # Shift out the oldest loss term.
-                self._loss_history[t, :-1] = self._loss_history[t, 1:]
-                self._loss_history[t, -1] = loss
-            else:
-                self._loss_history[t, self._loss_counts[t]] = loss
-                self._loss_counts[t] += 1
+        if th.is_tensor(ts):
+            self._to(ts.device)
+        ts = th.as_tensor(ts, device=self._loss_history.device).long()
+        losses = th.as_tensor(losses, device=self._loss_history.device).to(th.float64)
+        if len(ts) == 0:
+            return
+        T, H = self._loss_history.shape
+
+        # Rank of every loss among the losses of the same timestep, in order.
+        order = th.sort(ts, stable=True)[1]
+        sorted_ts = ts[order]
+        occurrences = th.bincount(ts, minlength=T)
+        group_start = th.cumsum(occurrences, 0) - occurrences
+        rank = th.arange(len(ts), device=ts.device) - group_start[sorted_ts]
+
+        # Only the last H losses of a timestep survive; each goes to its own slot.
+        keep = rank >= occurrences[sorted_ts] - H
+        slots = (self._write_pos[sorted_ts] + rank) % H
+        self._loss_history[sorted_ts[keep], slots[keep]] = losses[order][keep]
+
+        self._write_pos = (self._write_pos + occurrences) % H
+        self._loss_counts = th.clamp(self._loss_counts + occurrences, max=H)
 
     def _warmed_up(self):
-        return (self._loss_counts == self.history_per_term).all()
+        return bool((self._loss_counts == self.history_per_term).all())
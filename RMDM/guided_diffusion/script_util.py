@@ -307,6 +307,7 @@ def sr_model_and_diffusion_defaults():
 def sr_create_model_and_diffusion(
     large_size,
     small_size,
+    in_ch,
     class_cond,
     learn_sigma,
     num_channels,
@@ -327,12 +328,14 @@ def sr_create_model_and_diffusion(
     use_scale_shift_norm,
     resblock_updown,
     use_fp16,
+    dpm_solver,
 ):
     model = sr_create_model(
         large_size,
         small_size,
         num_channels,
         num_res_blocks,
+        in_ch=in_ch,
         learn_sigma=learn_sigma,
         class_cond=class_cond,
         use_checkpoint=use_checkpoint,
@@ -364,6 +367,7 @@ def sr_create_model(
     small_size,
     num_channels,
     num_res_blocks,
+    in_ch,
     learn_sigma,
     class_cond,
     use_checkpoint,
@@ -382,20 +386,34 @@ def sr_create_model(
         channel_mult = (1, 1, 2, 2, 4, 4)
     elif large_size == 256:
         channel_mult = (1, 1, 2, 2, 4, 4)
+    elif large_size == 128:
+        channel_mult = (1, 1, 2, 2, 4)
     elif large_size == 64:
         channel_mult = (1, 2, 3, 4)
     else:
         raise ValueError(f"unsupported large size: {large_size}")
+    # the highway of UNetModel_v1preview reads hs[3], hs[6], hs[9], hs[12], one per
+    # level with num_res_blocks=2, into conv_trans_blocks_a, whose input widths
+    # are hard-coded to 128/128/256/256 channels
+    highway_widths = [num_channels * mult for mult in channel_mult[:4]]
+    if highway_widths != [128, 128, 256, 256]:
+        raise ValueError(
+            f"num_channels={num_channels} with channel_mult={channel_mult} gives the highway "
+            f"{highway_widths} channels, it expects [128, 128, 256, 256]"
+        )
 
     attention_ds = []
     for res in attention_resolutions.split(","):
         attention_ds.append(large_size // int(res))
 
+    # in_ch counts the conditioning channels plus the diffused radio map; the
+    # low-resolution radio map adds one more channel
     return SuperResModel(
         image_size=large_size,
-        in_channels=3,
+        in_channels=in_ch,
+        low_res_channels=1,
         model_channels=num_channels,
-        out_channels=(3 if not learn_sigma else 6),
+        out_channels=2,#(3 if not learn_sigma else 6),
         num_res_blocks=num_res_blocks,
         attention_resolutions=tuple(attention_ds),
         dropout=dropout,
@@ -0,0 +1,127 @@
+"""
+Continuous batching for the reverse diffusion loop.
+
+Instead of moving a whole batch from T to 0 in lockstep, SlotSampler keeps a
+fixed number of slots, each holding one request at its own DDIM step. Every
+iteration advances all occupied slots with one model call; a slot whose
+request reaches t = 0 is emptied and refilled from the queue right away, so
+the batch stays full under a streaming workload.
+"""
+
+from collections import deque
+
+import numpy as np
+import torch as th
+
+from .gaussian_diffusion import model_device
+
+
+class SlotSampler:
+    """
+    :param diffusion: the diffusion object to sample with.
+    :param model: the denoiser.
+    :param num_slots: the batch size of every model call.
+    :param cond_shape: (C, H, W) of the conditioning channels of one request.
+    :param steps: number of strided DDIM steps per request.
+    :param eta: DDIM eta.
+    """
+
+    def __init__(self, diffusion, model, num_slots, cond_shape, steps=50, eta=0.0,
+                 clip_denoised=True, device=None):
+        self.diffusion = diffusion
+        self.model = model
+        self.num_slots = num_slots
+        self.eta = eta
+        self.clip_denoised = clip_denoised
+        self.device = device or model_device(model)
+
+        indices = np.unique(np.linspace(0, diffusion.num_timesteps - 1, steps, dtype=int))[::-1]
+        self.timesteps = th.tensor(indices.copy(), device=self.device)
+        self.prev_timesteps = th.tensor(list(indices[1:]) + [-1], device=self.device)
+
+        C, H, W = cond_shape
+        self.x = th.zeros(num_slots, C + 1, H, W, device=self.device)
+        self.position = th.zeros(num_slots, dtype=th.long, device=self.device)
+        self.slot_ids = [None] * num_slots
+        self.pending = deque()
+
+    def submit(self, request_id, cond):
+        """
+        Queue a request.
+
+        :param cond: a [C, H, W] Tensor of conditioning channels, as the
+                     sampler's x[:, :-1] (buildings channel already including
+                     10 * Tx, like in RMDM_sample.py).
+        """
+        self.pending.append((request_id, cond))
+
+    def busy(self):
+        return bool(self.pending) or any(i is not None for i in self.slot_ids)
+
+    def fill(self):
+        """
+        Move queued requests into free slots.
+        """
+        for slot in range(self.num_slots):
+            if self.slot_ids[slot] is None and self.pending:
+                request_id, cond = self.pending.popleft()
+                self.x[slot, :-1] = cond.to(self.device)
+                self.x[slot, -1].normal_()
+                self.position[slot] = 0
+                self.slot_ids[slot] = request_id
+
+    def step(self):
+        """
+        Fill free slots, advance every occupied slot by one DDIM step, and
+        return the finished requests.
+
+        :return: a list of (request_id, [H, W] radio map) pairs.
+        """
+        self.fill()
+        active = [i for i, r in enumerate(self.slot_ids) if r is not None]
+        if not active:
+            return []
+        full = len(active) == self.num_slots
+        idx = th.tensor(active, device=self.device)
+        x = self.x if full else self.x[idx]
+        position = self.position if full else self.position[idx]
+
+        with th.no_grad():
+            out = self.diffusion.ddim_sample(
+                self.model,
+                x,
+                self.timesteps[position],
+                clip_denoised=self.clip_denoised,
+                eta=self.eta,
+                inplace=True,
+                t_prev=self.prev_timesteps[position],
+            )
+        if not full:
+            self.x[idx, -1:] = out["sample"][:, -1:]
+        self.position[idx] += 1
+
+        finished = []
+        done = (self.position[idx] >= len(self.timesteps)).tolist()
+        for slot, is_done in zip(active, done):
+            if is_done:
+                finished.append((self.slot_ids[slot], self.x[slot, -1].clone()))
+                self.slot_ids[slot] = None
+        return finished
+
+    def run(self, requests):
+        """
+        Sample an iterable of (request_id, cond) pairs; yields
+        (request_id, radio map) as requests finish.
+        """
+        requests = iter(requests)
+        exhausted = False
+        while True:
+            while not exhausted and len(self.pending) < self.num_slots:
+                try:
+                    self.submit(*next(requests))
+                except StopIteration:
+                    exhausted = True
+            if not self.busy():
+                return
+            for result in self.step():
+                yield result
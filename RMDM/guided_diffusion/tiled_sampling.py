@@ -0,0 +1,147 @@
+"""
+Tiled reverse diffusion for radio maps larger than the model's tile size.
+
+A large conditioning raster is cut into overlapping tiles, the tiles are run
+through the reverse loop in batches, and the predictions are blended with the
+Gaussian importance map of RadioNetwork. The initial noise of every tile is
+cropped from a global noise field that is never materialized: it is generated
+per block of a fixed NOISE_BLOCK grid from (seed, block row, block column), so
+overlapping tiles see the same noise across seams, and the updates are
+deterministic DDIM (eta=0). Together with per-tile blending weights, memory
+holds one batch of tiles, and the raster itself only through `cond` and `out`,
+which may be memory maps.
+"""
+
+import numpy as np
+import torch as th
+
+from .gaussian_diffusion import model_device
+from .unet import RadioNetwork
+
+NOISE_BLOCK = 64
+
+
+def tile_positions(image_size, tile_size, step_size=0.5):
+    """
+    Top-left corners of the overlapping tiles covering an image.
+
+    :param image_size: (H, W) of the raster, each >= tile_size.
+    :param tile_size: side of a square tile.
+    :param step_size: tile stride as a fraction of tile_size.
+    :return: a list of (y, x) corners.
+    """
+    steps = RadioNetwork._compute_steps_for_sliding_window(
+        (tile_size, tile_size), tuple(image_size), step_size
+    )
+    return [(y, x) for y in steps[0] for x in steps[1]]
+
+
+def noise_crop(seed, y, x, tile_size, block=NOISE_BLOCK):
+    """
+    The [1, tile_size, tile_size] crop at (y, x) of the global noise field of
+    seed, generated from the blocks it overlaps only.
+    """
+    y0, x0 = y // block * block, x // block * block
+    y1, x1 = -(-(y + tile_size) // block) * block, -(-(x + tile_size) // block) * block
+    field = np.empty((y1 - y0, x1 - x0), dtype=np.float32)
+    for by in range(y0, y1, block):
+        for bx in range(x0, x1, block):
+            rng = np.random.default_rng([seed, by // block, bx // block])
+            field[by - y0 : by - y0 + block, bx - x0 : bx - x0 + block] = rng.standard_normal((block, block), dtype=np.float32)
+    return th.from_numpy(field[None, y - y0 : y - y0 + tile_size, x - x0 : x - x0 + tile_size].copy())
+
+
+def tile_weights(steps, y, x, tile_size, gaussian):
+    """
+    Blending weights of the tile at (y, x): its Gaussian importance map
+    divided by the sum of the maps of every tile overlapping it, so the
+    weighted tiles add up to the blended raster directly.
+
+    :param steps: the (row, column) tile corners of the grid, as returned by
+                  RadioNetwork._compute_steps_for_sliding_window.
+    """
+    weight_sum = np.zeros((tile_size, tile_size), dtype=np.float32)
+    near_y = [ty - y for ty in steps[0] if abs(ty - y) < tile_size]
+    near_x = [tx - x for tx in steps[1] if abs(tx - x) < tile_size]
+    for dy in near_y:
+        for dx in near_x:
+            weight_sum[max(dy, 0) : tile_size + min(dy, 0), max(dx, 0) : tile_size + min(dx, 0)] += \
+                gaussian[max(-dy, 0) : tile_size - max(dy, 0), max(-dx, 0) : tile_size - max(dx, 0)]
+    return gaussian / weight_sum
+
+
+def iter_tiled_samples(
+    diffusion,
+    model,
+    cond,
+    tile_size=256,
+    step_size=0.5,
+    tile_batch=8,
+    steps=50,
+    seed=0,
+    clip_denoised=True,
+    model_kwargs=None,
+):
+    """
+    Sample a large raster tile by tile.
+
+    :param cond: a [C, H, W] Tensor or array (e.g. a np.memmap) of
+                 conditioning channels, preprocessed as for the 256x256
+                 sampler (the noise channel is appended here). Only the tiles
+                 of the current batch are read from it.
+    :param tile_batch: number of tiles sent through the reverse loop together.
+    :param steps: number of strided DDIM steps.
+    :return: a generator over (y, x, prediction) with a [tile_size, tile_size]
+             numpy prediction per tile, in raster order.
+    """
+    device = model_device(model)
+    C, H, W = cond.shape
+    assert H >= tile_size and W >= tile_size, "pad the raster to at least one tile"
+
+    positions = tile_positions((H, W), tile_size, step_size)
+    for i in range(0, len(positions), tile_batch):
+        chunk = positions[i : i + tile_batch]
+        img = th.zeros(len(chunk), C + 1, tile_size, tile_size)
+        noise = th.zeros(len(chunk), 1, tile_size, tile_size)
+        for j, (y, x) in enumerate(chunk):
+            img[j, :C] = th.as_tensor(np.asarray(cond[:, y : y + tile_size, x : x + tile_size]))
+            noise[j] = noise_crop(seed, y, x, tile_size)
+        sample, _, _, _, _ = diffusion.ddim_sample_loop_known(
+            model,
+            tuple(img.shape),
+            img.to(device),
+            step=steps,
+            noise=noise.to(device),
+            clip_denoised=clip_denoised,
+            model_kwargs=model_kwargs,
+        )
+        pred = sample[:, -1].float().cpu().numpy()
+        for j, (y, x) in enumerate(chunk):
+            yield y, x, pred[j]
+
+
+def sample_tiled(diffusion, model, cond, out=None, tile_size=256, step_size=0.5, **kwargs):
+    """
+    Sample a large raster and blend the overlapping tiles.
+
+    Only one batch of tiles is on the device at a time, and every tile is
+    added to `out` already normalized by its blending weights, so nothing of
+    raster size is allocated here; with `cond` and `out` as np.memmap, host
+    memory stays bounded by the tile batch.
+
+    :param cond: a [C, H, W] Tensor or array of conditioning channels.
+    :param out: an optional float32 [H, W] array receiving the result.
+    :param kwargs: forwarded to iter_tiled_samples().
+    :return: the [H, W] radio map.
+    """
+    _, H, W = cond.shape
+    if out is None:
+        out = np.zeros((H, W), dtype=np.float32)
+    else:
+        out[:] = 0
+    gaussian = RadioNetwork._get_gaussian((tile_size, tile_size), sigma_scale=1.0 / 8)
+    steps = RadioNetwork._compute_steps_for_sliding_window((tile_size, tile_size), (H, W), step_size)
+
+    for y, x, pred in iter_tiled_samples(diffusion, model, cond, tile_size=tile_size, step_size=step_size, **kwargs):
+        out[y : y + tile_size, x : x + tile_size] += pred * tile_weights(steps, y, x, tile_size, gaussian)
+    return out
@@ -5,10 +5,11 @@ import os
 import blobfile as bf
 import torch as th
 import torch.distributed as dist
+import torch.nn.functional as F
 from torch.nn.parallel.distributed import DistributedDataParallel as DDP
 from torch.optim import AdamW
 
-from . import dist_util, logger
+from . import dist_util, logger, profiling
 from .fp16_util import MixedPrecisionTrainer
 from .nn import update_ema
 from .resample import LossAwareSampler, UniformSampler
@@ -51,8 +52,12 @@ class TrainLoop:
         schedule_sampler=None,
         weight_decay=0.0,
         lr_anneal_steps=0,
+        timesteps_per_sample=1,
+        low_res_size=0,
+        profiler=None,
     ):
         self.model = model
+        self.profiler = profiler
         self.dataloader=dataloader
         self.classifier = classifier
         self.diffusion = diffusion
@@ -73,6 +78,8 @@ class TrainLoop:
         self.schedule_sampler = schedule_sampler or UniformSampler(diffusion)
         self.weight_decay = weight_decay
         self.lr_anneal_steps = lr_anneal_steps
+        self.timesteps_per_sample = timesteps_per_sample
+        self.low_res_size = low_res_size
 
         self.step = 0
         self.resume_step = 0
@@ -175,15 +182,20 @@ class TrainLoop:
         ):
 
 
-            try:
-                    batch, cond, name = next(data_iter)
-            except StopIteration:
-                    # StopIteration is thrown if dataset ends
-                    # reinitialize data loader
-                    data_iter = iter(self.dataloader)
-                    batch, cond, name = next(data_iter)
+            with profiling.phase("step"):
+                with profiling.phase("data"):
+                    try:
+                            batch, cond, name = next(data_iter)
+                    except StopIteration:
+                            # StopIteration is thrown if dataset ends
+                            # reinitialize data loader
+                            data_iter = iter(self.dataloader)
+                            batch, cond, name = next(data_iter)
 
-            self.run_step(batch, cond)
+                self.run_step(batch, cond)
+            profiling.end_step()
+            if self.profiler is not None:
+                self.profiler.step()
 
            
             i += 1
@@ -203,11 +215,17 @@ class TrainLoop:
     def run_step(self, batch, cond):
         batch=th.cat((batch, cond), dim=1)
 
-        cond={}
+        if self.low_res_size:
+            # super-resolution stage: condition on the downsampled ground-truth radio map
+            cond={"low_res": F.interpolate(cond, size=(self.low_res_size, self.low_res_size), mode="area")}
+        else:
+            cond={}
         sample = self.forward_backward(batch, cond)
-        took_step = self.mp_trainer.optimize(self.opt)
+        with profiling.phase("optimizer"):
+            took_step = self.mp_trainer.optimize(self.opt)
         if took_step:
-            self._update_ema()
+            with profiling.phase("ema"):
+                self._update_ema()
         self._anneal_lr()
         self.log_step()
         return sample
@@ -223,7 +241,10 @@ class TrainLoop:
             }
 
             last_batch = (i + self.microbatch) >= batch.shape[0]
-            t, weights = self.schedule_sampler.sample(micro.shape[0], dist_util.dev())
+            # K independent draws per conditioning sample keep the importance weights unbiased
+            t, weights = self.schedule_sampler.sample(
+                micro.shape[0] * self.timesteps_per_sample, dist_util.dev()
+            )
 
             compute_losses = functools.partial(
                 self.diffusion.training_losses_segmentation,
@@ -232,15 +253,17 @@ class TrainLoop:
                 micro,
                 t,
                 model_kwargs=micro_cond,
+                timesteps_per_sample=self.timesteps_per_sample,
             )
 
-            if last_batch or not self.use_ddp:
-                losses1 = compute_losses()
-
-            else:
-                with self.ddp_model.no_sync():
+            with profiling.phase("forward"):
+                if last_batch or not self.use_ddp:
                     losses1 = compute_losses()
 
+                else:
+                    with self.ddp_model.no_sync():
+                        losses1 = compute_losses()
+
             if isinstance(self.schedule_sampler, LossAwareSampler):
                 self.schedule_sampler.update_with_local_losses(
                     t, losses1[0]["loss"].detach()
@@ -253,7 +276,8 @@ class TrainLoop:
             log_loss_dict(
                 self.diffusion, t, {k: v * weights for k, v in losses.items()}
             )
-            self.mp_trainer.backward(loss)
+            with profiling.phase("backward"):
+                self.mp_trainer.backward(loss)
             for name, param in self.ddp_model.named_parameters():
                 if param.grad is None:
                     print(name)
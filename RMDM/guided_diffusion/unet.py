@@ -10,12 +10,11 @@ from .fp16_util import convert_module_to_f16, convert_module_to_f32
 from copy import deepcopy
 from .utils import softmax_helper,sigmoid_helper
 from .utils import InitWeights_He
-from batchgenerators.augmentations.utils import pad_nd_image
 from .utils import no_op
 from .utils import to_cuda, maybe_to_torch
-from scipy.ndimage.filters import gaussian_filter
 from typing import Union, Tuple, List
 from torch.cuda.amp import autocast
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 from .nn import (
     checkpoint,
     conv_nd,
@@ -28,6 +27,29 @@ from .nn import (
 )
 
 
+def _match_memory_format(out, like):
+    """
+    Return `out` in channels_last layout if `like` is a channels_last 4-D tensor.
+
+    Reshapes and FFTs produce contiguous NCHW results; without this a
+    channels_last model would convert back and forth around every such op.
+    """
+    if like.dim() == 4 and not like.is_contiguous() and like.is_contiguous(memory_format=th.channels_last):
+        return out.contiguous(memory_format=th.channels_last)
+    return out
+
+
+def _remove_dropout(module):
+    """
+    Replace every dropout layer below `module` with an identity, in place.
+    """
+    for name, child in module.named_children():
+        if isinstance(child, nn.modules.dropout._DropoutNd):
+            setattr(module, name, nn.Identity())
+        else:
+            _remove_dropout(child)
+
+
 class AttentionPool2d(nn.Module):
     """
     Adapted from CLIP: https://github.com/openai/CLIP/blob/main/clip/model.py
@@ -174,7 +196,9 @@ def conv_dw(inp, oup, stride):
     )
 
 class MobBlock(nn.Module):
+    """
     This block is designed for specific radio-related operations, perhaps for feature extraction from radio signals.
+    """
     def __init__(self,ind):
         super().__init__()
 
@@ -293,12 +317,16 @@ class ResBlock(TimestepBlock):
         else:
             self.skip_connection = conv_nd(dims, channels, self.out_channels, 1)
 
+        # [T x emb_out] table of emb_layers outputs, filled by build_timestep_cache().
+        self.emb_cache = None
+
     def forward(self, x, emb):
         """
         Apply the block to a Tensor, conditioned on a timestep embedding.
 
         :param x: an [N x C x ...] Tensor of features.
-        :param emb: an [N x emb_channels] Tensor of timestep embeddings.
+        :param emb: an [N x emb_channels] Tensor of timestep embeddings, or an
+                    [N] integer Tensor of rows into emb_cache.
         :return: an [N x C x ...] Tensor of outputs.
         """
         return checkpoint(
@@ -314,7 +342,10 @@ class ResBlock(TimestepBlock):
             h = in_conv(h)
         else:
             h = self.in_layers(x)
-        emb_out = self.emb_layers(emb).type(h.dtype)
+        if self.emb_cache is not None and not emb.is_floating_point():
+            emb_out = self.emb_cache[emb].type(h.dtype)
+        else:
+            emb_out = self.emb_layers(emb).type(h.dtype)
         while len(emb_out.shape) < len(h.shape):
             emb_out = emb_out[..., None]
         if self.use_scale_shift_norm:
@@ -371,11 +402,12 @@ class AttentionBlock(nn.Module):
 
     def _forward(self, x):
         b, c, *spatial = x.shape
+        x_in = x
         x = x.reshape(b, c, -1)
         qkv = self.qkv(self.norm(x))
         h = self.attention(qkv)
         h = self.proj_out(h)
-        return (x + h).reshape(b, c, *spatial)
+        return _match_memory_format((x + h).reshape(b, c, *spatial), x_in)
 
 
 def count_flops_attn(model, _x, y):
@@ -468,31 +500,56 @@ class QKVAttention(nn.Module):
         return count_flops_attn(model, _x, y)
 
 class FFParser(nn.Module):
+    """
     This module is designed for parsing radio signal features, perhaps using frequency domain analysis.
+
+    The learned filter is stored at the rfft2 size of the training resolution,
+    (h, w) = (H, H // 2 + 1). Inputs of another size use the filter resampled
+    to their own rfft2 grid; in inference the resampled filters are cached per size.
+    """
     def __init__(self, dim, h=128, w=65):
         super().__init__()
         self.complex_weight = nn.Parameter(torch.randn(dim, h, w, 2, dtype=torch.float32) * 0.02)
         self.w = w
         self.h = h
+        # (H, W//2+1, device) -> (parameter version, resampled complex filter)
+        self._resized_weights = {}
+
+    def complex_filter(self, H, W):
+        """
+        The complex filter for an H x W input, of shape [dim, H, W // 2 + 1].
+        """
+        w = W // 2 + 1
+        if (H, w) == (self.h, self.w):
+            return torch.view_as_complex(self.complex_weight)
+
+        key = (H, w, self.complex_weight.device)
+        version = self.complex_weight._version
+        cached = self._resized_weights.get(key)
+        if cached is not None and cached[0] == version and not torch.is_grad_enabled():
+            return cached[1]
+
+        # Interpolate real/imag parts over the frequency grid, with the
+        # full-length (vertical) axis fftshifted so frequencies are ordered.
+        weight = self.complex_weight.permute(0, 3, 1, 2)
+        weight = torch.fft.fftshift(weight, dim=2)
+        weight = F.interpolate(weight, size=(H, w), mode='bilinear', align_corners=True)
+        weight = torch.fft.ifftshift(weight, dim=2)
+        weight = torch.view_as_complex(weight.permute(0, 2, 3, 1).contiguous())
+        if not torch.is_grad_enabled():
+            self._resized_weights[key] = (version, weight)
+        return weight
 
     def forward(self, x, spatial_size=None):
         B, C, H, W = x.shape
-        assert H == W, "height and width are not equal"
-        if spatial_size is None:
-            a = b = H
-        else:
-            a, b = spatial_size
+        x_in = x
 
-        # x = x.view(B, a, b, C)
         x = x.to(torch.float32)
         x = torch.fft.rfft2(x, dim=(2, 3), norm='ortho')
-        weight = torch.view_as_complex(self.complex_weight)
-        x = x * weight
+        x = x * self.complex_filter(H, W)
         x = torch.fft.irfft2(x, s=(H, W), dim=(2, 3), norm='ortho')
 
-        x = x.reshape(B, C, H, W)
-
-        return x
+        return _match_memory_format(x, x_in)
 
 
 class UNetModel_v1preview(nn.Module):
@@ -567,6 +624,7 @@ class UNetModel_v1preview(nn.Module):
         self.num_classes = num_classes
         self.use_checkpoint = use_checkpoint
         self.dtype = th.float16 if use_fp16 else th.float32
+        self.memory_format = th.contiguous_format  # see convert_to_channels_last()
         self.num_heads = num_heads
         self.num_head_channels = num_head_channels
         self.num_heads_upsample = num_heads_upsample
@@ -747,7 +805,31 @@ class UNetModel_v1preview(nn.Module):
         self.input_blocks.apply(convert_module_to_f32)
         self.middle_block.apply(convert_module_to_f32)
         self.output_blocks.apply(convert_module_to_f32)
-    
+
+    def convert_to_channels_last(self):
+        """
+        Store conv weights and run the model in the channels_last (NHWC)
+        memory format; inputs are converted on entry to forward().
+        """
+        self.to(memory_format=th.channels_last)
+        for module in self.modules():
+            if isinstance(module, FFParser):
+                # [dim, h, w, 2] real/imag pairs, viewed as complex: keep it contiguous
+                module.complex_weight.data = module.complex_weight.data.contiguous()
+        self.memory_format = th.channels_last
+
+    def optimize_for_inference(self):
+        """
+        Put the model in eval mode, drop its dropout layers and fold the
+        highway's BatchNorms into their convs. Irreversible: call it after
+        load_state_dict(), and do not train or save the result.
+        """
+        self.eval()
+        _remove_dropout(self)
+        if hasattr(self, "hwm"):
+            self.hwm.optimize_for_inference()
+        return self
+
     def load_part_state_dict(self, state_dict):
 
         own_state = self.state_dict()
@@ -788,7 +870,7 @@ class UNetModel_v1preview(nn.Module):
             assert y.shape == (x.shape[0],)
             emb = emb + self.label_emb(y)
 
-        h = x.type(self.dtype)
+        h = x.type(self.dtype).contiguous(memory_format=self.memory_format)
         c = h[:,:-1,...]
         hlist= []
         for ind, module in enumerate(self.input_blocks):
@@ -878,6 +960,7 @@ class UNetModel_newpreview(nn.Module):
         self.num_classes = num_classes
         self.use_checkpoint = use_checkpoint
         self.dtype = th.float16 if use_fp16 else th.float32
+        self.memory_format = th.contiguous_format  # see convert_to_channels_last()
         self.num_heads = num_heads
         self.num_head_channels = num_head_channels
         self.num_heads_upsample = num_heads_upsample
@@ -1039,6 +1122,10 @@ class UNetModel_newpreview(nn.Module):
             zero_module(conv_nd(dims, model_channels , out_channels, 3, padding=1)),
         )
 
+        # timestep -> row of the inference cache, see build_timestep_cache()
+        self.timestep_cache_index = None
+        self.timestep_cache_values = None
+
         if high_way:
             features = 32
             self.hwm = Generic_UNet(self.in_channels - 1, features, 1, 5, anchor_out=True, upscale_logits=True)
@@ -1059,6 +1146,30 @@ class UNetModel_newpreview(nn.Module):
         self.middle_block.apply(convert_module_to_f32)
         self.output_blocks.apply(convert_module_to_f32)
 
+    def convert_to_channels_last(self):
+        """
+        Store conv weights and run the model in the channels_last (NHWC)
+        memory format; inputs are converted on entry to forward().
+        """
+        self.to(memory_format=th.channels_last)
+        for module in self.modules():
+            if isinstance(module, FFParser):
+                # [dim, h, w, 2] real/imag pairs, viewed as complex: keep it contiguous
+                module.complex_weight.data = module.complex_weight.data.contiguous()
+        self.memory_format = th.channels_last
+
+    def optimize_for_inference(self):
+        """
+        Put the model in eval mode, drop its dropout layers and fold the
+        highway's BatchNorms into their convs. Irreversible: call it after
+        load_state_dict(), and do not train or save the result.
+        """
+        self.eval()
+        _remove_dropout(self)
+        if hasattr(self, "hwm"):
+            self.hwm.optimize_for_inference()
+        return self
+
     def load_part_state_dict(self, state_dict):
 
         own_state = self.state_dict()
@@ -1078,14 +1189,67 @@ class UNetModel_newpreview(nn.Module):
     def highway_forward(self,x, hs = None):
         return self.hwm(x,hs = None)
 
+    def build_timestep_cache(self, timesteps):
+        """
+        Precompute, for inference, the timestep embedding and every ResBlock's
+        emb_layers (scale/shift) output for the given timesteps.
 
-    def forward(self, x, timesteps, y=None):
+        While the cache is set and the model is in eval mode, forward() looks
+        these up by timestep instead of recomputing them every step.
+        Rebuild it after moving the model to another device.
+
+        :param timesteps: the timestep values the model will be called with,
+                          e.g. diffusion.model_timesteps().
+        """
+        timesteps = th.as_tensor(timesteps).flatten().to(next(self.parameters()).device)
+        t = timesteps.round().long() if timesteps.is_floating_point() else timesteps.long()
+        with th.no_grad():
+            emb = self.time_embed(timestep_embedding(timesteps, self.model_channels))
+            for module in self.modules():
+                if isinstance(module, ResBlock):
+                    module.emb_cache = module.emb_layers(emb)
+        assert len(th.unique(t)) == len(t), "timesteps of the cache must not round to the same integer"
+        index = th.full((int(t.max()) + 1,), -1, dtype=th.long, device=t.device)
+        index[t] = th.arange(len(t), device=t.device)
+        self.timestep_cache_index = index
+        # exact values, so a timestep that only rounds to a cached one is not served from the cache
+        self.timestep_cache_values = timesteps.double()
+
+    def clear_timestep_cache(self):
+        self.timestep_cache_index = None
+        self.timestep_cache_values = None
+        for module in self.modules():
+            if isinstance(module, ResBlock):
+                module.emb_cache = None
+
+    def _lookup_timestep_cache(self, timesteps):
+        """
+        Rows of the timestep cache for a batch of timesteps, or None if the
+        cache is not in use or does not hold all of them exactly, e.g. the
+        continuous timesteps of DPM-Solver.
+        """
+        index = self.timestep_cache_index
+        if index is None or self.training or self.num_classes is not None:
+            return None
+        t = timesteps.round().long() if timesteps.is_floating_point() else timesteps.long()
+        # one mask and a single .any(), i.e. one device sync per forward
+        outside = (t < 0) | (t >= index.shape[0])
+        rows = index[t.clamp(0, index.shape[0] - 1)]
+        miss = outside | (rows < 0) | (timesteps.double() != self.timestep_cache_values[rows.clamp(min=0)])
+        if miss.any():
+            return None
+        return rows
+
+    def forward(self, x, timesteps, y=None, highway_repeats=1):
         """
         Apply the model to an input batch.
 
         :param x: an [N x C x ...] Tensor of inputs.
         :param timesteps: a 1-D batch of timesteps.
         :param y: an [N] Tensor of labels, if class-conditional.
+        :param highway_repeats: if K > 1, x holds K consecutive noised copies
+            of each conditioning sample; the highway runs once per sample and
+            its outputs are shared by the K copies.
         :return: an [N x C x ...] Tensor of outputs.
         """
         assert (y is not None) == (
@@ -1093,15 +1257,23 @@ class UNetModel_newpreview(nn.Module):
         ), "must specify y if and only if the model is class-conditional"
 
         hs = []
-        emb = self.time_embed(timestep_embedding(timesteps, self.model_channels))
+        rows = self._lookup_timestep_cache(timesteps)
+        if rows is not None:
+            # ResBlocks read their precomputed projections from these rows
+            emb = rows
+        else:
+            emb = self.time_embed(timestep_embedding(timesteps, self.model_channels))
 
         if self.num_classes is not None:
             assert y.shape == (x.shape[0],)
             emb = emb + self.label_emb(y)
 
-        h = x.type(self.dtype)
-        c = h[:,:-1,...]
+        h = x.type(self.dtype).contiguous(memory_format=self.memory_format)
+        c = h[::highway_repeats,:-1,...]
         anch, cal = self.highway_forward(c)
+        if highway_repeats > 1:
+            anch = tuple(a.repeat_interleave(highway_repeats, dim=0) for a in anch)
+            cal = cal.repeat_interleave(highway_repeats, dim=0)
         for ind, module in enumerate(self.input_blocks):
             if len(emb.size()) > 2:
                 emb = emb.squeeze()
@@ -1125,15 +1297,21 @@ class SuperResModel(UNetModel_v1preview):
     A UNetModel that performs super-resolution.
 
     Expects an extra kwarg `low_res` to condition on a low-resolution image.
+    The upsampled image is inserted before the last (diffused) channel of x,
+    so the highway branch sees it together with the other conditioning channels.
+
+    :param low_res_channels: channels of `low_res`; defaults to in_channels.
     """
 
-    def __init__(self, image_size, in_channels, *args, **kwargs):
-        super().__init__(image_size, in_channels * 2, *args, **kwargs)
+    def __init__(self, image_size, in_channels, *args, low_res_channels=None, **kwargs):
+        if low_res_channels is None:
+            low_res_channels = in_channels
+        super().__init__(image_size, in_channels + low_res_channels, *args, **kwargs)
 
     def forward(self, x, timesteps, low_res=None, **kwargs):
         _, _, new_height, new_width = x.shape
         upsampled = F.interpolate(low_res, (new_height, new_width), mode="bilinear")
-        x = th.cat([x, upsampled], dim=1)
+        x = th.cat([x[:, :-1], upsampled.type(x.dtype), x[:, -1:]], dim=1)
         return super().forward(x, timesteps, **kwargs)
 
 
@@ -1524,6 +1702,7 @@ class RadioNetwork(NeuralNetwork):
         center_coords = [i // 2 for i in patch_size]
         sigmas = [i * sigma_scale for i in patch_size]
         tmp[tuple(center_coords)] = 1
+        from scipy.ndimage import gaussian_filter
         gaussian_importance_map = gaussian_filter(tmp, sigmas, 0, mode='constant', cval=0)
         gaussian_importance_map = gaussian_importance_map / np.max(gaussian_importance_map) * 1
         gaussian_importance_map = gaussian_importance_map.astype(np.float32)
@@ -1574,6 +1753,7 @@ class RadioNetwork(NeuralNetwork):
 
         # for sliding window inference the image must at least be as large as the patch size. It does not matter
         # whether the shape is divisible by 2**num_pool as long as the patch size is
+        from batchgenerators.augmentations.utils import pad_nd_image
         data, slicer = pad_nd_image(x, patch_size, pad_border_mode, pad_kwargs, True, None)
         data_shape = data.shape  # still c, x, y, z
 
@@ -1715,6 +1895,7 @@ class RadioNetwork(NeuralNetwork):
                                                                   'run _internal_predict_2D_2Dconv'
         if verbose: print("do mirror:", do_mirroring)
 
+        from batchgenerators.augmentations.utils import pad_nd_image
         data, slicer = pad_nd_image(x, min_size, pad_border_mode, pad_kwargs, True,
                                     self.input_shape_must_be_divisible_by)
 
@@ -1751,6 +1932,7 @@ class RadioNetwork(NeuralNetwork):
                                                                   'run _internal_predict_3D_3Dconv'
         if verbose: print("do mirror:", do_mirroring)
 
+        from batchgenerators.augmentations.utils import pad_nd_image
         data, slicer = pad_nd_image(x, min_size, pad_border_mode, pad_kwargs, True,
                                     self.input_shape_must_be_divisible_by)
 
@@ -1905,6 +2087,7 @@ class RadioNetwork(NeuralNetwork):
 
         # for sliding window inference the image must at least be as large as the patch size. It does not matter
         # whether the shape is divisible by 2**num_pool as long as the patch size is
+        from batchgenerators.augmentations.utils import pad_nd_image
         data, slicer = pad_nd_image(x, patch_size, pad_border_mode, pad_kwargs, True, None)
         data_shape = data.shape  # still c, x, y
 
@@ -2147,6 +2330,16 @@ class ConvDropoutNormNonlin(nn.Module):
             x = self.dropout(x)
         return self.lrelu(self.instnorm(x))
 
+    def fuse_for_inference(self):
+        """
+        Drop the dropout and fold an eval-mode BatchNorm into the conv, leaving
+        conv -> in-place LeakyReLU. InstanceNorm depends on the input and is kept.
+        """
+        self.dropout = None
+        if isinstance(self.instnorm, nn.modules.batchnorm._BatchNorm) and self.instnorm.track_running_stats:
+            self.conv = fuse_conv_bn_eval(self.conv.eval(), self.instnorm.eval())
+            self.instnorm = nn.Identity()
+
 
 class ConvDropoutNonlinNorm(ConvDropoutNormNonlin):
     def forward(self, x):
@@ -2155,6 +2348,10 @@ class ConvDropoutNonlinNorm(ConvDropoutNormNonlin):
             x = self.dropout(x)
         return self.instnorm(self.lrelu(x))
 
+    def fuse_for_inference(self):
+        # the norm follows the nonlinearity, so only the dropout can go
+        self.dropout = None
+
 
 class StackedConvLayers(nn.Module):
     def __init__(self, input_feature_channels, output_feature_channels, num_convs,
@@ -2483,6 +2680,18 @@ class Generic_UNet(RadioNetwork):
             self.apply(self.weightInitializer)
             # self.apply(print_module_training_status)
 
+    def optimize_for_inference(self):
+        """
+        Eval mode, no dropout, and each conv -> BatchNorm -> LeakyReLU block
+        reduced to conv -> in-place LeakyReLU with the BatchNorm folded in.
+        """
+        self.eval()
+        for module in self.modules():
+            if isinstance(module, ConvDropoutNormNonlin):
+                module.fuse_for_inference()
+        _remove_dropout(self)
+        return self
+
     def forward(self, x, hs = None):
         skips = []
         seg_outputs = []
@@ -2504,7 +2713,7 @@ class Generic_UNet(RadioNetwork):
             
 
         x = self.conv_blocks_context[-1](x)
-        emb = conv_nd(2, x.size(1), 512, 1).to(device = x.device)(x)
+        bottleneck = x
 
         for u in range(len(self.tu)):
             x = self.tu[u](x)
@@ -2525,6 +2734,8 @@ class Generic_UNet(RadioNetwork):
                                         zip(list(self.upscale_logits_ops)[::-1], anch_outputs[:-1][::-1])]),seg_outputs[-1]
                                             
         else:
+            # only built when returned; it is a freshly initialised projection on every call
+            emb = conv_nd(2, bottleneck.size(1), 512, 1).to(device = x.device)(bottleneck)
             return emb, seg_outputs[-1]
 
     @staticmethod
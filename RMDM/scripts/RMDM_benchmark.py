@@ -0,0 +1,205 @@
+"""
+Reproducible CPU benchmark suite on a synthetic RadioMapSeer tree.
+
+Generates the tree with RMDM_synth_radiomapseer.py unless --data_dir already
+holds one, then measures:
+
+- loader/<config>: items/s of the RadioUNet loader of each --configs entry
+  (Radio, Radio_2, Radio_3, as in RMDM_train.py) through a DataLoader;
+- train: optimizer steps/s of training_losses_segmentation + backward + AdamW;
+- sample: DDIM steps/s of ddim_sample_loop_known;
+- cal_pinn: calls/s of the PINN residual on a batch of maps;
+- metrics: maps/s of the NMSE and SSIM computations of the report scripts.
+
+Model and diffusion are built from the usual flags (model_and_diffusion_defaults),
+untrained. Each figure is the median over --repeats timed runs after a warm-up.
+Results, with the flags and the git commit, are written as JSON to --out_path,
+and --compare loads an earlier result and prints the relative change of every
+figure, so two commits can be compared on the same machine:
+
+    python scripts/RMDM_benchmark.py --out_path bench_new.json --compare bench_old.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+sys.path.append(".")
+sys.path.append("./scripts")
+import numpy as np
+import torch as th
+from skimage.metrics import structural_similarity
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    add_dict_to_argparser,
+    args_to_dict,
+)
+from RadioUNet.lib import loaders
+from RMDM_synth_radiomapseer import generate
+
+
+def synthetic_dataset(config, data_dir, num_maps, num_tx):
+    """
+    :return: (dataset, in_ch) of a RMDM_train.py --data_name on the synthetic tree.
+    """
+    kwargs = dict(
+        maps_inds=np.arange(num_maps), phase="custom", ind1=0, ind2=num_maps - 1,
+        numTx=num_tx, dir_dataset=os.path.join(data_dir, ""),
+    )
+    if config == "Radio_2":
+        return loaders.RadioUNet_s(carsSimul="yes", carsInput="yes", **kwargs), 5
+    if config == "Radio_3":
+        return loaders.RadioUNet_s(simulation="rand", cityMap="missing", missing=4, **kwargs), 4
+    return loaders.RadioUNet_c(**kwargs), 3
+
+
+def median_rate(fn, count, repeats):
+    """
+    Run fn once as warm-up, then `repeats` times; :return: median of count / seconds.
+    """
+    fn()
+    rates = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        rates.append(count / (time.perf_counter() - start))
+    return float(np.median(rates))
+
+
+def bench_loader(args, config):
+    ds, _ = synthetic_dataset(config, args.data_dir, args.num_maps, args.num_tx)
+    datal = th.utils.data.DataLoader(ds, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers)
+    items = min(args.loader_batches, len(datal)) * args.batch_size
+
+    def run():
+        for i, _ in enumerate(datal):
+            if i + 1 >= args.loader_batches:
+                break
+
+    return median_rate(run, items, args.repeats)
+
+
+def bench_model(args, results):
+    th.manual_seed(0)
+    ds, args.in_ch = synthetic_dataset("Radio", args.data_dir, args.num_maps, args.num_tx)
+    b, m, _ = next(iter(th.utils.data.DataLoader(ds, batch_size=args.batch_size)))
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    opt = th.optim.AdamW(model.parameters(), lr=1e-4)
+    batch = th.cat((b, m), dim=1)
+
+    def train():
+        model.train()
+        for _ in range(args.train_steps):
+            t = th.randint(0, diffusion.num_timesteps, (batch.shape[0],))
+            losses, _ = diffusion.training_losses_segmentation(model, None, batch, t)
+            opt.zero_grad()
+            (losses["loss"] + losses["loss_cal"] * 10).mean().backward()
+            opt.step()
+
+    results["train_steps_per_s"] = median_rate(train, args.train_steps, args.repeats)
+
+    model.eval()
+    if hasattr(model, "build_timestep_cache"):
+        model.build_timestep_cache(diffusion.model_timesteps())
+    img = th.cat((b, th.zeros_like(b[:, :1])), dim=1)
+    img[:, 0] = b[:, 0] + 10 * b[:, 1]
+
+    def sample():
+        with th.no_grad():
+            diffusion.ddim_sample_loop_known(
+                model, tuple(img.shape), img, step=args.ddim_steps, clip_denoised=True
+            )
+
+    results["sample_ddim_steps_per_s"] = median_rate(sample, args.ddim_steps, args.repeats)
+
+    x = img[:, :-1].numpy()
+    cal = m[:, 0].numpy()
+    results["cal_pinn_calls_per_s"] = median_rate(
+        lambda: diffusion.cal_pinn(cal, x[:, 0], x[:, 1], k=0.2), 1, args.repeats
+    )
+
+    rng = np.random.default_rng(0)
+    preds = [g + 0.01 * rng.standard_normal(g.shape) for g in cal]
+
+    def metrics():
+        for p, g in zip(preds, cal):
+            ((p - g) ** 2).mean() / (g ** 2).mean()
+            structural_similarity(p, g, data_range=g.max() - g.min())
+
+    results["metrics_maps_per_s"] = median_rate(metrics, len(preds), args.repeats)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = create_argparser().parse_args()
+    th.set_num_threads(args.threads)
+    if not os.path.isdir(os.path.join(args.data_dir, "gain", "DPM")):
+        print(f"generating synthetic RadioMapSeer in {args.data_dir}...")
+        generate(args.data_dir, args.num_maps, args.num_tx, workers=args.num_workers or 1)
+
+    results = {}
+    for config in args.configs.split(","):
+        results[f"loader_{config}_items_per_s"] = bench_loader(args, config)
+    bench_model(args, results)
+
+    report = dict(
+        commit=git_commit(),
+        python=platform.python_version(),
+        torch=th.__version__,
+        machine=platform.machine(),
+        processor=platform.processor(),
+        threads=args.threads,
+        args=vars(args),
+        results=results,
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(args.out_path)), exist_ok=True)
+    with open(args.out_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print("| benchmark | value | vs baseline |")
+    print("|---|---:|---:|")
+    for name, value in results.items():
+        change = f"{value / baseline[name] - 1:+.1%}" if baseline.get(name) else ""
+        print(f"| {name} | {value:.2f} | {change} |")
+    print(f"written to {args.out_path}")
+
+
+def create_argparser():
+    defaults = dict(
+        data_dir="./results/synthetic_radiomapseer/",
+        num_maps=20,
+        num_tx=8,
+        configs="Radio,Radio_2,Radio_3",
+        batch_size=4,
+        num_workers=0,
+        loader_batches=20,
+        train_steps=3,
+        ddim_steps=10,
+        repeats=3,
+        threads=4,
+        out_path="./results/benchmark.json",
+        compare="",             #earlier benchmark JSON to compare against
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Convert a BRATS tree to memory-mappable .npy volumes for BRATSDataset3D.
+
+Every .nii.gz volume under --data_dir is decoded once and written slice-major
+to --cache_dir (see bratsloader.convert_brats_volumes). With --report, the
+per-item cost of BRATSDataset3D is then timed for three read paths: decoding
+.nii.gz for random slices, decoding .nii.gz for consecutive slices served by
+the volume LRU, and reading the memory maps for random slices:
+
+    python scripts/RMDM_brats_preprocess.py --data_dir ../dataset/brats2020/training --cache_dir ../dataset/brats2020/training_npy --report True
+"""
+import argparse
+import sys
+import time
+sys.path.append(".")
+import numpy as np
+from guided_diffusion.bratsloader import BRATSDataset3D, convert_brats_volumes
+from guided_diffusion.script_util import add_dict_to_argparser
+
+
+def ms_per_item(ds, indices):
+    start = time.perf_counter()
+    for i in indices:
+        ds[int(i)]
+    return (time.perf_counter() - start) / len(indices) * 1000
+
+
+def main():
+    args = create_argparser().parse_args()
+    start = time.time()
+    written = convert_brats_volumes(
+        args.data_dir, args.cache_dir, dtype=np.dtype(args.dtype), test_flag=args.test_flag
+    )
+    print(f"wrote {written} volumes to {args.cache_dir} in {time.time() - start:.0f} s")
+
+    if args.report:
+        ds = BRATSDataset3D(args.data_dir, None, test_flag=args.test_flag, cache_volumes=0)
+        indices = np.random.default_rng(0).integers(0, len(ds), size=args.report_items)
+        sequential = np.arange(min(args.report_items, 155))
+        rows = [
+            ("nii.gz, random slices", ds, indices),
+            ("nii.gz, LRU, consecutive slices", BRATSDataset3D(args.data_dir, None, test_flag=args.test_flag), sequential),
+            ("npy memmap, random slices", BRATSDataset3D(args.data_dir, None, test_flag=args.test_flag, cache_dir=args.cache_dir), indices),
+        ]
+        print("| read path | ms / item |")
+        print("|---|---:|")
+        for name, dataset, idx in rows:
+            print(f"| {name} | {ms_per_item(dataset, idx):.2f} |")
+
+
+def create_argparser():
+    defaults = dict(
+        data_dir="../dataset/brats2020/training",
+        cache_dir="../dataset/brats2020/training_npy",
+        dtype="float32",        #or float16, half the disk and page cache
+        test_flag=False,        #the tree has no seg volumes
+        report=False,
+        report_items=50,
+    )
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Build (or verify) the manifest.json index of a dataset tree.
+
+The RadioUNet, BRATS, ISIC and custom loaders read the manifest at the root of
+their dataset instead of scanning the directories, and check the files they
+need against it (see guided_diffusion/manifest.py). Rebuild it whenever files
+are added, removed or rewritten:
+
+    python scripts/RMDM_build_manifest.py --data_dir ../dataset/RadioMapSeer/
+    python scripts/RMDM_build_manifest.py --data_dir ../dataset/RadioMapSeer/ --verify True
+"""
+import argparse
+import sys
+import time
+sys.path.append(".")
+from guided_diffusion.manifest import build_manifest, load_manifest
+from guided_diffusion.script_util import add_dict_to_argparser
+
+
+def main():
+    args = create_argparser().parse_args()
+    if args.verify:
+        manifest = load_manifest(args.data_dir, args.out_path or None)
+        if manifest is None:
+            sys.exit(f"no manifest in {args.data_dir}")
+        start = time.time()
+        bad = 0
+        for rel in manifest.files:
+            problem = manifest.verify(rel)
+            if problem:
+                bad += 1
+                print(f"{rel}: {problem}")
+        print(f"verified {len(manifest)} files in {time.time() - start:.1f} s, {bad} mismatches")
+        sys.exit(1 if bad else 0)
+
+    start = time.time()
+    manifest = build_manifest(
+        args.data_dir, headers=args.headers, checksums=args.checksums, out=args.out_path or None
+    )
+    print(f"indexed {len(manifest)} files of {args.data_dir} in {time.time() - start:.1f} s")
+
+
+def create_argparser():
+    defaults = dict(
+        data_dir="../dataset/RadioMapSeer/",
+        out_path="",            #default <data_dir>/manifest.json, where the loaders look
+        headers=True,           #record shape and dtype of .png/.npy/.nii.gz files
+        checksums=False,        #record a CRC32 of every file, reads the whole tree
+        verify=False,           #check the tree against an existing manifest instead
+    )
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Two-stage radio-map sampling: the conditional model samples the map at
+--image_size (e.g. 64), then a SuperResModel trained with RMDM_sr_train.py
+upsamples it to --sr_large_size while seeing the full-resolution buildings/Tx.
+
+Model flags configure the first stage; the same flags prefixed with sr_
+configure the super-resolution stage.
+"""
+import argparse
+import sys
+import time
+sys.path.append(".")
+import numpy as np
+import torch as th
+import torch.nn.functional as F
+from guided_diffusion import dist_util, logger
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    sr_model_and_diffusion_defaults,
+    sr_create_model_and_diffusion,
+    add_dict_to_argparser,
+    args_to_dict,
+)
+from RadioUNet.lib import loaders
+
+
+def load_model(model, path):
+    state_dict = dist_util.load_state_dict(path, map_location="cpu")
+    model.load_state_dict(dist_util.strip_state_dict_prefix(state_dict))
+    model.to(dist_util.dev())
+    model.eval()
+    return model
+
+
+def cascade_sample(args, model, diffusion, sr_model, sr_diffusion, b):
+    """
+    :param b: an [N x C x H x W] batch of full-resolution conditioning channels.
+    :return: (low-res map [N x 1 x h x w], full-res map [N x 1 x H x W]).
+    """
+    small = args.image_size
+    b_small = F.adaptive_max_pool2d(b, small)
+    img = th.cat((b_small, th.zeros_like(b_small[:, :1])), dim=1)
+    img[:, 0] = b_small[:, 0] + 10 * b_small[:, 1]
+    low_res, _, _, _, _ = diffusion.ddim_sample_loop_known(
+        model, tuple(img.shape), img, step=args.ddim_steps, clip_denoised=args.clip_denoised
+    )
+    low_res = low_res[:, -1:].clone()
+
+    img = th.cat((b, th.zeros_like(b[:, :1])), dim=1)
+    img[:, 0] = b[:, 0] + 10 * b[:, 1]
+    sample, _, _, _, _ = sr_diffusion.ddim_sample_loop_known(
+        sr_model, tuple(img.shape), img, step=args.sr_ddim_steps, clip_denoised=args.clip_denoised,
+        model_kwargs={"low_res": low_res},
+    )
+    return low_res, sample[:, -1:]
+
+
+def main():
+    args = create_argparser().parse_args()
+    dist_util.setup_dist(args)
+    logger.configure(dir=args.out_dir)
+
+    if args.data_name == 'Radio_2':
+        ds = loaders.RadioUNet_s(phase="test", carsSimul="yes", carsInput="yes")
+        args.in_ch = args.sr_in_ch = 5
+    elif args.data_name == 'Radio_3':
+        ds = loaders.RadioUNet_s(phase="test", simulation="rand", cityMap="missing", missing=4)
+        args.in_ch = args.sr_in_ch = 4
+    else:
+        args.data_name = 'Radio'
+        ds = loaders.RadioUNet_c(phase="test")
+        args.in_ch = args.sr_in_ch = 3
+    datal = th.utils.data.DataLoader(ds, batch_size=args.batch_size, shuffle=False)
+
+    logger.log("creating models and diffusions...")
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    sr_args = {k: getattr(args, "sr_" + k) for k in sr_model_and_diffusion_defaults().keys()}
+    sr_model, sr_diffusion = sr_create_model_and_diffusion(**sr_args)
+    for m, d, path in ((model, diffusion, args.model_path), (sr_model, sr_diffusion, args.sr_model_path)):
+        load_model(m, path)
+        if hasattr(m, "build_timestep_cache"):
+            m.build_timestep_cache(d.model_timesteps())
+
+    nmse = []
+    for i, (b, m, _) in enumerate(datal):
+        if i >= args.num_batches:
+            break
+        start = time.time()
+        low_res, sample = cascade_sample(args, model, diffusion, sr_model, sr_diffusion, b.to(dist_util.dev()))
+        elapsed = time.time() - start
+        m = m.to(sample.device)
+        nmse.append(float(((sample - m) ** 2).mean() / (m ** 2).mean()))
+        logger.logkv("nmse", nmse[-1])
+        logger.logkv("sec_per_batch", elapsed)
+        logger.dumpkvs()
+        if args.save_samples:
+            np.savez(f"{args.out_dir}/cascade_{i}.npz", low_res=low_res.cpu().numpy(), sample=sample.cpu().numpy())
+    logger.log(f"mean nmse over {len(nmse)} batches: {np.mean(nmse):.5f}")
+
+
+def create_argparser():
+    defaults = dict(
+        data_name='Radio',
+        clip_denoised=True,
+        batch_size=1,
+        num_batches=100,
+        ddim_steps=50,          #DDIM steps of the low-resolution stage
+        sr_ddim_steps=10,       #DDIM steps of the super-resolution stage
+        model_path="",          #low-resolution model
+        sr_model_path="",       #SuperResModel
+        save_samples=False,
+        gpu_dev="0",
+        out_dir='./results/cascade/',
+        multi_gpu=None,
+    )
+    defaults.update(model_and_diffusion_defaults())
+    defaults.update({"sr_" + k: v for k, v in sr_model_and_diffusion_defaults().items()})
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark of the channels_last (NHWC) model against the default NCHW one.
+
+Both formats use a copy of the same randomly initialised model. The script
+checks that their (out, cal) agree, then times training steps
+(training_losses_segmentation + backward + AdamW) and DDIM sampling steps
+(with the timestep cache) and prints one table row per format.
+"""
+import argparse
+import copy
+import sys
+import time
+sys.path.append(".")
+import torch as th
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    add_dict_to_argparser,
+    args_to_dict,
+)
+
+
+def sync(device):
+    if device.type == "cuda":
+        th.cuda.synchronize()
+
+
+def time_train_steps(model, diffusion, x_start, repeats):
+    opt = th.optim.AdamW(model.parameters(), lr=1e-4)
+    model.train()
+
+    def step():
+        t = th.randint(0, diffusion.num_timesteps, (x_start.shape[0],), device=x_start.device)
+        losses, _ = diffusion.training_losses_segmentation(model, None, x_start, t)
+        loss = (losses["loss"] + losses["loss_cal"] * 10).mean()
+        opt.zero_grad()
+        loss.backward()
+        opt.step()
+
+    step()  # warm-up
+    sync(x_start.device)
+    start = time.time()
+    for _ in range(repeats):
+        step()
+    sync(x_start.device)
+    return (time.time() - start) / repeats * 1000
+
+
+def time_sample_steps(model, diffusion, img, repeats):
+    model.eval()
+    model.build_timestep_cache(diffusion.model_timesteps())
+    t = th.full((img.shape[0],), diffusion.num_timesteps - 1, device=img.device, dtype=th.long)
+    with th.no_grad():
+        diffusion.ddim_sample(model, img, t)  # warm-up
+        sync(img.device)
+        start = time.time()
+        for _ in range(repeats):
+            diffusion.ddim_sample(model, img, t)
+        sync(img.device)
+    model.clear_timestep_cache()
+    return (time.time() - start) / repeats * 1000
+
+
+def main():
+    args = create_argparser().parse_args()
+    device = th.device(args.device)
+    th.manual_seed(0)
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    model.to(device)
+    nhwc = copy.deepcopy(model)
+    nhwc.convert_to_channels_last()
+
+    x_start = th.rand(args.batch_size, args.in_ch, args.image_size, args.image_size, device=device)
+    t = th.randint(0, diffusion.num_timesteps, (args.batch_size,), device=device)
+    model.eval()
+    nhwc.eval()
+    with th.no_grad():
+        out, cal = model(x_start, t)
+        out_cl, cal_cl = nhwc(x_start, t)
+    print(f"parity: out {(out - out_cl).abs().max().item():.3e} cal {(cal - cal_cl).abs().max().item():.3e}")
+
+    print(f"| format | train ms/step | sample ms/step |  (batch {args.batch_size}, {args.image_size} px, {device})")
+    print("|---|---:|---:|")
+    for name, m in (("NCHW", model), ("channels_last", nhwc)):
+        train_ms = time_train_steps(m, diffusion, x_start, args.repeats)
+        sample_ms = time_sample_steps(m, diffusion, x_start, args.repeats)
+        print(f"| {name} | {train_ms:.1f} | {sample_ms:.1f} |")
+
+
+def create_argparser():
+    defaults = dict(
+        batch_size=2,
+        repeats=10,
+        device="cpu",
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Stub client and load generator for RMDM_server.py.
+
+Sends synthetic building/Tx(/measurement/cars) rasters from --concurrency
+threads and reports throughput, latency percentiles and the batch sizes the
+server formed. No dataset or outside service is needed.
+"""
+import argparse
+import io
+import sys
+import threading
+import time
+import urllib.request
+sys.path.append(".")
+import numpy as np
+from guided_diffusion.script_util import add_dict_to_argparser
+
+CHANNELS = {
+    'Radio': ("buildings", "tx"),
+    'Radio_2': ("buildings", "tx", "samples", "cars"),
+    'Radio_3': ("buildings", "tx", "samples"),
+}
+
+
+def synthetic_rasters(rng, channels, size=256):
+    """
+    Random rectangular buildings, one transmitter pixel and sparse measurements.
+    """
+    buildings = np.zeros((size, size), dtype=np.float32)
+    for _ in range(rng.integers(20, 60)):
+        y, x = rng.integers(0, size - 16, size=2)
+        h, w = rng.integers(4, 16, size=2)
+        buildings[y : y + h, x : x + w] = 1
+    tx = np.zeros((size, size), dtype=np.float32)
+    tx[tuple(rng.integers(0, size, size=2))] = 1
+    samples = np.zeros((size, size), dtype=np.float32)
+    n = rng.integers(10, 300)
+    samples[rng.integers(0, size, size=n), rng.integers(0, size, size=n)] = rng.random(n)
+    cars = (rng.random((size, size)) < 0.002).astype(np.float32)
+    rasters = dict(buildings=buildings, tx=tx, samples=samples, cars=cars)
+    return {c: rasters[c] for c in channels}
+
+
+def predict(url, rasters, timeout=600):
+    """
+    Send one request; returns the server's npz fields as a dict.
+    """
+    body = io.BytesIO()
+    np.savez(body, **rasters)
+    request = urllib.request.Request(
+        url.rstrip("/") + "/predict", data=body.getvalue(),
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        result = np.load(io.BytesIO(response.read()))
+        return {k: result[k] for k in result.files}
+
+
+def main():
+    args = create_argparser().parse_args()
+    channels = CHANNELS[args.data_name]
+    latencies, batch_sizes, lock = [], [], threading.Lock()
+    counter = iter(range(args.num_requests))
+
+    def client(seed):
+        rng = np.random.default_rng(seed)
+        for _ in counter:
+            rasters = synthetic_rasters(rng, channels, args.image_size)
+            start = time.time()
+            result = predict(args.url, rasters)
+            with lock:
+                latencies.append((time.time() - start) * 1000)
+                batch_sizes.append(int(result["batch_size"]))
+
+    start = time.time()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    print(f"{len(latencies)} requests in {elapsed:.1f}s: {len(latencies) / elapsed:.2f} maps/s")
+    print("latency ms p50 %.0f p90 %.0f p99 %.0f" % tuple(np.percentile(latencies, [50, 90, 99])))
+    print(f"mean batch size {np.mean(batch_sizes):.2f}")
+
+
+def create_argparser():
+    defaults = dict(
+        url="http://127.0.0.1:8808",
+        data_name='Radio',
+        image_size=256,
+        concurrency=8,
+        num_requests=64,
+    )
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Quality/latency sweep of strided DDIM sampling over a fixed set of test maps.
+
+For every step count in --ddim_steps, the same maps are sampled with the same
+initial noise, and the mean NMSE against the ground-truth radio map and the mean
+wall-clock time per batch are reported as a markdown table.
+"""
+import argparse
+import sys
+import time
+sys.path.append(".")
+import numpy as np
+import torch as th
+from guided_diffusion import dist_util, logger
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    add_dict_to_argparser,
+    args_to_dict,
+)
+from RadioUNet.lib import loaders
+
+
+def nmse(pred, target):
+    return float(((pred - target) ** 2).mean() / (target ** 2).mean())
+
+
+def main():
+    args = create_argparser().parse_args()
+    dist_util.setup_dist(args)
+    logger.configure(dir=args.out_dir)
+
+    if args.data_name == 'Radio_2':
+        ds = loaders.RadioUNet_s(phase="test", carsSimul="yes", carsInput="yes")
+        args.in_ch = 5
+    elif args.data_name == 'Radio_3':
+        ds = loaders.RadioUNet_s(phase="test", simulation="rand", cityMap="missing", missing=4)
+        args.in_ch = 4
+    else:
+        args.data_name = 'Radio'
+        ds = loaders.RadioUNet_c(phase="test")
+        args.in_ch = 3
+    datal = th.utils.data.DataLoader(ds, batch_size=args.batch_size, shuffle=False)
+
+    logger.log("creating model and diffusion...")
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    state_dict = dist_util.load_state_dict(args.model_path, map_location="cpu")
+    model.load_state_dict(dist_util.strip_state_dict_prefix(state_dict))
+    model.to(dist_util.dev())
+    if args.use_fp16:
+        model.convert_to_fp16()
+    model.eval()
+    if hasattr(model, "build_timestep_cache"):
+        model.build_timestep_cache(diffusion.model_timesteps())
+
+    batches = []
+    for i, (b, m, _) in enumerate(datal):
+        if i >= args.num_batches:
+            break
+        batches.append((b, m))
+
+    rows = []
+    for steps in [int(s) for s in args.ddim_steps.split(",")]:
+        errors, times = [], []
+        for i, (b, m) in enumerate(batches):
+            img = th.cat((b, th.zeros_like(b[:, :1, ...])), dim=1)
+            img[:, 0, ...] = b[:, 0, ...] + 10 * b[:, 1, ...]
+            th.manual_seed(args.seed + i)  # same initial noise for every step count
+            if th.cuda.is_available():
+                th.cuda.synchronize()
+            start = time.time()
+            sample, _, _, _, _ = diffusion.ddim_sample_loop_known(
+                model,
+                tuple(img.shape), img,
+                step=steps,
+                clip_denoised=args.clip_denoised,
+                model_kwargs={},
+            )
+            if th.cuda.is_available():
+                th.cuda.synchronize()
+            times.append(time.time() - start)
+            errors.append(nmse(sample[:, -1:, ...].float().cpu(), m.float()))
+        rows.append((steps, np.mean(errors), np.mean(times)))
+        logger.logkv("ddim_steps", steps)
+        logger.logkv("nmse", np.mean(errors))
+        logger.logkv("sec_per_batch", np.mean(times))
+        logger.dumpkvs()
+
+    table = ["| DDIM steps | NMSE | s / batch |", "|---:|---:|---:|"]
+    table += ["| %d | %.4f | %.3f |" % row for row in rows]
+    logger.log("\n".join(table))
+
+
+def create_argparser():
+    defaults = dict(
+        data_name='Radio',
+        clip_denoised=True,
+        batch_size=1,
+        num_batches=20,         #number of test batches sampled per step count
+        ddim_steps="10,25,50,100",
+        seed=10,
+        model_path="",          #path to pretrain model
+        gpu_dev="0",
+        out_dir='./results/ddim_sweep/',
+        multi_gpu=None,
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
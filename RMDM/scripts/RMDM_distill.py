@@ -0,0 +1,124 @@
+"""
+Progressive distillation of a trained RMDM model into a few-step student.
+
+Starting from a teacher sampled with --start_steps DDIM steps, every stage
+trains a student (initialised from the teacher) for --stage_steps iterations
+to take one step where the teacher takes two, saves it as
+student_{N}steps.pt in --out_dir and makes it the next teacher, until the
+student reaches --final_steps.
+
+Sample with a student via:
+    python scripts/RMDM_sample.py --use_ddim True --student_steps 4 --model_path results/distill/student_4steps.pt ...
+"""
+import sys
+import argparse
+import copy
+import os
+sys.path.append("../")
+sys.path.append("./")
+import blobfile as bf
+import torch as th
+import torch.distributed as dist
+from guided_diffusion import dist_util, logger
+from guided_diffusion.distillation import DistillLoop
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    args_to_dict,
+    add_dict_to_argparser,
+)
+from RadioUNet.lib import loaders
+
+
+def main():
+    args = create_argparser().parse_args()
+
+    dist_util.setup_dist(args)
+    logger.configure(dir = args.out_dir)
+
+    logger.log("creating data loader...")
+    if args.data_name == 'Radio_2':
+        ds = loaders.RadioUNet_s(phase="train", carsSimul="yes", carsInput="yes")
+        args.in_ch = 5
+    elif args.data_name == 'Radio_3':
+        ds = loaders.RadioUNet_s(phase="train", simulation="rand", cityMap="missing", missing=4)
+        args.in_ch = 4
+    else:
+        args.data_name = 'Radio'
+        ds = loaders.RadioUNet_c(phase="train")
+        args.in_ch = 3
+    datal = th.utils.data.DataLoader(
+        ds,
+        batch_size=args.batch_size,
+        shuffle=True)
+
+    logger.log("creating teacher and student...")
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    state_dict = dist_util.load_state_dict(args.model_path, map_location="cpu")
+    model.load_state_dict(dist_util.strip_state_dict_prefix(state_dict))
+    model.to(dist_util.dev())
+    teacher = copy.deepcopy(model)
+
+    steps = args.start_steps // 2
+    while steps >= args.final_steps:
+        logger.configure(dir = os.path.join(args.out_dir, f"stage_{steps}steps"))
+        logger.log(f"distilling {2 * steps} teacher steps into {steps} student steps...")
+        DistillLoop(
+            teacher=teacher,
+            student_steps=steps,
+            model=model,
+            diffusion=diffusion,
+            classifier=None,
+            data=iter(datal),
+            dataloader=datal,
+            batch_size=args.batch_size,
+            microbatch=args.microbatch,
+            lr=args.lr,
+            ema_rate=args.ema_rate,
+            log_interval=args.log_interval,
+            save_interval=args.save_interval,
+            resume_checkpoint=None,
+            use_fp16=args.use_fp16,
+            fp16_scale_growth=args.fp16_scale_growth,
+            weight_decay=args.weight_decay,
+            lr_anneal_steps=args.stage_steps,
+        ).run_loop()
+
+        if dist.get_rank() == 0:
+            path = bf.join(args.out_dir, f"student_{steps}steps.pt")
+            logger.log(f"saving {path}...")
+            with bf.BlobFile(path, "wb") as f:
+                th.save(model.state_dict(), f)
+        teacher.load_state_dict(model.state_dict())
+        steps //= 2
+
+
+def create_argparser():
+    defaults = dict(
+        data_name = 'Radio',
+        model_path="",          #the trained RMDM model, teacher of the first stage
+        start_steps=64,         #DDIM steps of the first teacher
+        final_steps=4,          #stop after the student with this many steps
+        stage_steps=10000,      #training iterations per halving, lr decays linearly to 0 within a stage
+        lr=1e-4,
+        weight_decay=0.0,
+        batch_size=4,
+        microbatch=-1,  # -1 disables microbatches
+        ema_rate="0.9999",  # comma-separated list of EMA values
+        log_interval=100,
+        save_interval=5000,
+        fp16_scale_growth=1e-3,
+        gpu_dev = "0",
+        multi_gpu = None,
+        out_dir='./results/distill/'
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Write a slim inference checkpoint and report its cold-start cost.
+
+The exported file holds only model weights, with wrapper prefixes stripped:
+with --ema_rate, the EMA weights saved next to a training checkpoint
+(emasavedmodel_{rate}_NNNNNN.pt for savedmodelNNNNNN.pt) are exported instead
+of the raw ones. --fp16 stores floating-point tensors as float16, which halves
+the file; they are cast back when loaded into a float32 model. An --out_path
+ending in .safetensors is written with safetensors, anything else with
+torch.save.
+
+With --report, the input and the exported checkpoint are loaded into a fresh
+model on dist_util.dev() in separate processes, both with the memory-mapped
+loader and with the old read-everything loader, and the load time and peak
+RSS of each are printed. Run it twice to tell a cold page cache from a warm one.
+
+    python scripts/RMDM_export_checkpoint.py --model_path results/savedmodel100000.pt --ema_rate 0.9999 --fp16 True --out_path rmdm_slim.safetensors --report True
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+sys.path.append(".")
+import blobfile as bf
+import torch as th
+from guided_diffusion import dist_util
+from guided_diffusion.train_util import parse_resume_step_from_filename
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    add_dict_to_argparser,
+    args_to_dict,
+)
+
+
+def ema_path(path, rate):
+    step = parse_resume_step_from_filename(path)
+    return bf.join(bf.dirname(path), f"emasavedmodel_{rate}_{step:06d}.pt")
+
+
+def export(args):
+    path = ema_path(args.model_path, args.ema_rate) if args.ema_rate else args.model_path
+    state_dict = dist_util.strip_state_dict_prefix(dist_util.load_state_dict(path, map_location="cpu"))
+    slim = {}
+    for k, v in state_dict.items():
+        if args.fp16 and v.is_floating_point():
+            v = v.half()
+        # own, contiguous storage: safetensors rejects shared or strided tensors
+        slim[k] = v.contiguous().clone()
+    if args.out_path.endswith(".safetensors"):
+        from safetensors.torch import save_file
+
+        save_file(slim, args.out_path)
+    else:
+        th.save(slim, args.out_path)
+    size = lambda p: os.path.getsize(p) / 2 ** 20
+    print(f"{path} ({size(path):.1f} MiB) -> {args.out_path} ({size(args.out_path):.1f} MiB)")
+    return path
+
+
+def measure(args):
+    """
+    Load --measure into a fresh model and print the cost as one JSON line.
+    """
+    model, _ = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    model.to(dist_util.dev())
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if args.legacy_load:
+        with open(args.measure, "rb") as f:
+            state_dict = th.load(io.BytesIO(f.read()), map_location="cpu")
+    else:
+        state_dict = dist_util.load_state_dict(args.measure, map_location="cpu")
+    model.load_state_dict(dist_util.strip_state_dict_prefix(state_dict))
+    if th.cuda.is_available():
+        th.cuda.synchronize()
+    elapsed = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux
+    print(json.dumps(dict(seconds=elapsed, peak_rss_mib=peak_rss / 1024, load_rss_mib=(peak_rss - base_rss) / 1024)))
+
+
+def report(args, paths):
+    print("| checkpoint | loader | load s | peak RSS MiB | RSS added by load MiB |")
+    print("|---|---|---:|---:|---:|")
+    for path in paths:
+        for legacy in (True, False):
+            if legacy and path.endswith(".safetensors"):
+                continue
+            cmd = [sys.executable, __file__, *sys.argv[1:], "--report", "False",
+                   "--measure", path, "--legacy_load", str(legacy)]
+            out = json.loads(subprocess.run(cmd, capture_output=True, text=True, check=True).stdout.splitlines()[-1])
+            if legacy:
+                loader = "read + BytesIO"
+            else:
+                loader = "safetensors" if path.endswith(".safetensors") else "mmap"
+            print(f"| {path} | {loader} | {out['seconds']:.2f} | {out['peak_rss_mib']:.0f} | {out['load_rss_mib']:.0f} |")
+
+
+def main():
+    args = create_argparser().parse_args()
+    dist_util.setup_dist(args)
+    if args.measure:
+        measure(args)
+        return
+    source = export(args)
+    if args.report:
+        report(args, [source, args.out_path])
+
+
+def create_argparser():
+    defaults = dict(
+        model_path="",          #training checkpoint, savedmodelNNNNNN.pt or a plain state dict
+        ema_rate="",            #export emasavedmodel_{rate}_NNNNNN.pt next to model_path instead
+        fp16=False,             #store floating-point tensors as float16
+        out_path="rmdm_inference.pt",
+        report=False,           #measure load time and peak RSS of the input and the export
+        measure="",             #internal: load this checkpoint and print the cost
+        legacy_load=False,      #internal: with measure, read the file into memory instead of mmap
+        gpu_dev="0",
+        multi_gpu=None,
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
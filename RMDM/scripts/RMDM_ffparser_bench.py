@@ -0,0 +1,71 @@
+"""
+Parity check and latency table for the resolution-agnostic FFParser.
+
+The parity check compares FFParser at its training size (256 px maps, i.e. the
+128 x 65 filter of the first highway level) against the original fixed-size
+formula. The latency table times the same level for 64/128/256/512 px maps,
+with the filter resampled (and cached) for every non-native size.
+"""
+import argparse
+import sys
+import time
+sys.path.append(".")
+import torch as th
+from guided_diffusion.unet import FFParser
+from guided_diffusion.script_util import add_dict_to_argparser
+
+
+def reference_forward(module, x):
+    x = th.fft.rfft2(x.float(), dim=(2, 3), norm='ortho')
+    x = x * th.view_as_complex(module.complex_weight)
+    return th.fft.irfft2(x, s=(module.h, module.h), dim=(2, 3), norm='ortho')
+
+
+def time_forward(module, x, repeats):
+    module(x)  # warm-up, fills the resampled filter cache
+    if x.is_cuda:
+        th.cuda.synchronize()
+    start = time.time()
+    for _ in range(repeats):
+        module(x)
+    if x.is_cuda:
+        th.cuda.synchronize()
+    return (time.time() - start) / repeats * 1000
+
+
+def main():
+    args = create_argparser().parse_args()
+    device = th.device(args.device)
+    th.manual_seed(0)
+    # first highway level: a 256 px map is parsed at 128 px with a 128 x 65 filter
+    module = FFParser(args.dim, 128, 65).to(device).eval()
+
+    with th.no_grad():
+        x = th.randn(args.batch_size, args.dim, 128, 128, device=device)
+        diff = (module(x) - reference_forward(module, x)).abs().max().item()
+        print(f"parity at 256 px: max abs diff {diff:.3e}")
+        assert diff < 1e-5, "FFParser output changed at the training resolution"
+
+        print("| map size | FFParser input | ms / forward |")
+        print("|---:|---:|---:|")
+        for size in [int(s) for s in args.sizes.split(",")]:
+            x = th.randn(args.batch_size, args.dim, size // 2, size // 2, device=device)
+            ms = time_forward(module, x, args.repeats)
+            print(f"| {size} | {size // 2} | {ms:.3f} |")
+
+
+def create_argparser():
+    defaults = dict(
+        dim=32,
+        batch_size=4,
+        sizes="64,128,256,512",
+        repeats=50,
+        device="cuda" if th.cuda.is_available() else "cpu",
+    )
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Routed fraction, latency and NMSE of confidence-gated hybrid inference.
+
+For every threshold on the highway's PINN residual, hybrid_sample() predicts
+--eval_batches test batches; the rows "diffusion only" (every sample routed)
+and "highway only" (none routed) bound the trade-off. Without --thresholds,
+the 25/50/75 % quantiles of the residuals on the evaluated batches are used.
+"""
+import argparse
+import itertools
+import sys
+import time
+sys.path.append(".")
+import numpy as np
+import torch as th
+from guided_diffusion import dist_util, logger
+from guided_diffusion.hybrid import hybrid_sample, pinn_residual
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    add_dict_to_argparser,
+    args_to_dict,
+)
+from RadioUNet.lib import loaders
+
+
+def run(args, model, diffusion, batches, threshold):
+    """
+    :return: (routed fraction, ms per map, NMSE).
+    """
+    routed, nmse, elapsed, count = 0, [], 0.0, 0
+    for b, m, *_ in batches:
+        b, m = b.to(dist_util.dev()), m.to(dist_util.dev())
+        img = th.cat((b, th.zeros_like(b[:, :1])), dim=1)
+        img[:, 0] = b[:, 0] + 10 * b[:, 1]
+        if th.cuda.is_available():
+            th.cuda.synchronize()
+        start = time.time()
+        out = hybrid_sample(
+            diffusion, model, img, threshold, steps=args.ddim_steps,
+            warm_start=args.warm_start if args.warm_start >= 0 else None,
+        )
+        if th.cuda.is_available():
+            th.cuda.synchronize()
+        elapsed += time.time() - start
+        routed += int(out["routed"].sum())
+        count += b.shape[0]
+        nmse.extend((((out["sample"] - m) ** 2).mean((1, 2, 3)) / (m ** 2).mean((1, 2, 3))).tolist())
+    return routed / count, elapsed / count * 1000, float(np.mean(nmse))
+
+
+def main():
+    args = create_argparser().parse_args()
+    dist_util.setup_dist(args)
+    logger.configure(dir=args.out_dir)
+
+    if args.data_name == 'Radio_2':
+        ds = loaders.RadioUNet_s(phase="test", carsSimul="yes", carsInput="yes")
+        args.in_ch = 5
+    elif args.data_name == 'Radio_3':
+        ds = loaders.RadioUNet_s(phase="test", simulation="rand", cityMap="missing", missing=4)
+        args.in_ch = 4
+    else:
+        ds = loaders.RadioUNet_c(phase="test")
+        args.in_ch = 3
+    batches = list(itertools.islice(th.utils.data.DataLoader(ds, batch_size=args.batch_size, shuffle=False), args.eval_batches))
+
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    state_dict = dist_util.load_state_dict(args.model_path, map_location="cpu")
+    model.load_state_dict(dist_util.strip_state_dict_prefix(state_dict))
+    model.to(dist_util.dev())
+    model.eval()
+    model.build_timestep_cache(diffusion.model_timesteps())
+
+    if args.thresholds:
+        thresholds = [float(t) for t in args.thresholds.split(",")]
+    else:
+        residuals = []
+        with th.no_grad():
+            for b, *_ in batches:
+                b = b.to(dist_util.dev())
+                x = b.clone()
+                x[:, 0] = b[:, 0] + 10 * b[:, 1]
+                _, cal = model.highway_forward(x)
+                residuals.extend(pinn_residual(diffusion, cal, x).tolist())
+        thresholds = list(np.quantile(residuals, [0.25, 0.5, 0.75]))
+
+    rows = [("diffusion only", -float("inf"))]
+    rows += [(f"residual <= {t:.4g}", t) for t in thresholds]
+    rows += [("highway only", float("inf"))]
+    results = [(name,) + run(args, model, diffusion, batches, t) for name, t in rows]
+    full_nmse = results[0][3]
+    logger.log(f"| routing | routed | ms/map | NMSE | dNMSE |  (batch {args.batch_size}, {args.ddim_steps} DDIM steps)")
+    logger.log("|---|---:|---:|---:|---:|")
+    for name, fraction, ms, nmse in results:
+        logger.log(f"| {name} | {fraction:.1%} | {ms:.1f} | {nmse:.5f} | {nmse - full_nmse:+.5f} |")
+
+
+def create_argparser():
+    defaults = dict(
+        data_name='Radio',
+        model_path="",
+        thresholds="",          #comma-separated PINN residual thresholds; empty: residual quartiles
+        warm_start=-1,          #>= 0: routed samples run a truncated chain from this timestep
+        ddim_steps=50,
+        batch_size=8,
+        eval_batches=25,
+        gpu_dev="0",
+        multi_gpu=None,
+        out_dir='./results/hybrid/',
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
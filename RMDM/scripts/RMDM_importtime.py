@@ -0,0 +1,82 @@
+"""
+Import-time budget of the entry points.
+
+Every module in --modules is imported in a fresh interpreter under
+`python -X importtime`; the report gives its total import time, the top-level
+packages it spends that time in, and any of the --forbidden optional
+integrations that got imported although no flag asked for them. The exit
+status is 1 if a module exceeds --budget_ms or imports a forbidden package,
+so the script can gate CI or a server image build.
+
+Run it from the repository root:
+    python scripts/RMDM_importtime.py --budget_ms 4000
+"""
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def importtime(module, repeat):
+    """
+    :return: (best total ms, {top-level package: ms spent in its own modules}) over `repeat` runs.
+    """
+    best = None
+    for _ in range(repeat):
+        code = f"import sys; sys.path[:0] = ['.', 'scripts']; import {module}"
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True, text=True, env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"),
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"importing {module} failed:\n{proc.stderr[-2000:]}")
+        packages = defaultdict(float)
+        total = 0.0
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "[us]" in line:
+                continue
+            self_us, _, name = line[len("import time:"):].split("|")
+            # self time, so that a package nested in another one is not counted twice
+            ms = int(self_us) / 1000
+            packages[name.strip().split(".")[0]] += ms
+            total += ms
+        if best is None or total < best[0]:
+            best = (total, dict(packages))
+    return best
+
+
+def main():
+    args = create_argparser().parse_args()
+    forbidden = set(filter(None, args.forbidden.split(",")))
+    failed = False
+    for module in args.modules.split(","):
+        total, packages = importtime(module, args.repeat)
+        over = args.budget_ms > 0 and total > args.budget_ms
+        leaked = sorted(forbidden & packages.keys())
+        failed |= over or bool(leaked)
+        print(f"## {module}: {total:.0f} ms" + (f" (budget {args.budget_ms:.0f} ms exceeded)" if over else ""))
+        print("| package | ms |")
+        print("|---|---:|")
+        for name, ms in sorted(packages.items(), key=lambda kv: -kv[1])[:args.top]:
+            print(f"| {name} | {ms:.1f} |")
+        if leaked:
+            print(f"imported without a flag: {', '.join(leaked)}")
+        print()
+    sys.exit(1 if failed else 0)
+
+
+def create_argparser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", default="RMDM_train,RMDM_sample,RMDM_server",
+                        help="comma-separated modules to import (scripts/ is on the path)")
+    parser.add_argument("--budget_ms", type=float, default=0, help="fail above this total; 0 reports only")
+    parser.add_argument("--forbidden", default="visdom,tensorflow,nibabel,cv2,sklearn,matplotlib,torchsummary",
+                        help="packages that must only be imported when a flag asks for them")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per module, the fastest is reported")
+    parser.add_argument("--top", type=int, default=15)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Export the denoiser to ONNX, check it against PyTorch and compare CPU speed.
+
+Writes --onnx_path, then:
+  - parity: max abs difference of "out" and "cal" between eager PyTorch and
+    ONNX Runtime, for each batch size in --parity_batches (dynamic batch axis);
+  - speed: DDIM steps/s of ddim_sample_loop_known on the CPU, eager PyTorch
+    (with the timestep cache) against the OnnxRuntimeModel backend, and the
+    max abs difference of the two final samples drawn from the same noise.
+
+Example:
+    python scripts/RMDM_onnx_export.py --model_path savedmodel.pt --image_size 256 --onnx_path rmdm.onnx
+    python scripts/RMDM_sample.py --data_name Radio --use_ddim True --onnx_path rmdm.onnx ...
+"""
+import argparse
+import sys
+import time
+sys.path.append(".")
+import torch as th
+from guided_diffusion import dist_util
+from guided_diffusion.onnx_backend import export_onnx, OnnxRuntimeModel
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    add_dict_to_argparser,
+    args_to_dict,
+)
+
+CHANNELS = {'Radio': 2, 'Radio_2': 4, 'Radio_3': 3}
+
+
+def time_sampling(diffusion, model, img, steps, seed):
+    th.manual_seed(seed)
+    start = time.time()
+    with th.no_grad():
+        sample, _, _, _, _ = diffusion.ddim_sample_loop_known(
+            model, tuple(img.shape), img.clone(), step=steps, clip_denoised=True
+        )
+    elapsed = time.time() - start
+    return sample[:, -1].clone(), steps / elapsed
+
+
+def main():
+    args = create_argparser().parse_args()
+    th.set_num_threads(args.num_threads)
+    args.in_ch = CHANNELS[args.data_name] + 1
+
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    if args.model_path:
+        state_dict = dist_util.load_state_dict(args.model_path, map_location="cpu")
+        model.load_state_dict(dist_util.strip_state_dict_prefix(state_dict))
+    model.eval()
+
+    export_onnx(model, args.onnx_path, args.in_ch, args.image_size)
+    print(f"exported {args.onnx_path}")
+    ort_model = OnnxRuntimeModel(args.onnx_path, num_threads=args.num_threads)
+
+    with th.no_grad():
+        for batch in [int(b) for b in args.parity_batches.split(",")]:
+            x = th.randn(batch, args.in_ch, args.image_size, args.image_size)
+            t = th.randint(0, diffusion.num_timesteps, (batch,))
+            out, cal = model(x, t)
+            ort_out, ort_cal = ort_model(x, t)
+            print(f"parity batch {batch}: out {(out - ort_out).abs().max().item():.3e}"
+                  f" cal {(cal - ort_cal).abs().max().item():.3e}")
+
+    b = th.rand(args.batch_size, args.in_ch - 1, args.image_size, args.image_size)
+    img = th.cat((b, th.zeros_like(b[:, :1])), dim=1)
+    img[:, 0] = b[:, 0] + 10 * b[:, 1]
+    model.build_timestep_cache(diffusion.model_timesteps())
+    torch_sample, torch_rate = time_sampling(diffusion, model, img, args.ddim_steps, args.seed)
+    ort_sample, ort_rate = time_sampling(diffusion, ort_model, img, args.ddim_steps, args.seed)
+
+    print(f"| backend | steps/s (batch {args.batch_size}, {args.num_threads} threads) |")
+    print("|---|---:|")
+    print(f"| PyTorch eager | {torch_rate:.3f} |")
+    print(f"| ONNX Runtime | {ort_rate:.3f} |")
+    print(f"sample max abs diff {(torch_sample - ort_sample).abs().max().item():.3e}")
+
+
+def create_argparser():
+    defaults = dict(
+        data_name='Radio',
+        model_path="",          #empty: export randomly initialised weights
+        onnx_path="rmdm.onnx",
+        parity_batches="1,3",
+        batch_size=1,
+        ddim_steps=10,
+        num_threads=4,
+        seed=0,
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Parity check and timing for optimize_for_inference().
+
+A randomly initialised model gets random BatchNorm statistics and affine
+parameters, so folding is not a no-op. The eval-mode model is compared with
+an optimized copy on random inputs, and both are timed per forward call.
+"""
+import argparse
+import copy
+import sys
+import time
+sys.path.append(".")
+import torch as th
+import torch.nn as nn
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    add_dict_to_argparser,
+    args_to_dict,
+)
+
+
+def randomize_batchnorm(model):
+    for module in model.modules():
+        if isinstance(module, nn.modules.batchnorm._BatchNorm):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+            if module.affine:
+                module.weight.data.uniform_(0.5, 1.5)
+                module.bias.data.uniform_(-0.5, 0.5)
+
+
+def time_forward(model, x, t, repeats):
+    model(x, t)  # warm-up
+    if x.is_cuda:
+        th.cuda.synchronize()
+    start = time.time()
+    for _ in range(repeats):
+        model(x, t)
+    if x.is_cuda:
+        th.cuda.synchronize()
+    return (time.time() - start) / repeats * 1000
+
+
+def main():
+    args = create_argparser().parse_args()
+    device = th.device(args.device)
+    th.manual_seed(0)
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    randomize_batchnorm(model)
+    model.to(device).eval()
+    optimized = copy.deepcopy(model).optimize_for_inference()
+    num_bn = sum(isinstance(m, nn.modules.batchnorm._BatchNorm) for m in model.modules())
+    num_bn_left = sum(isinstance(m, nn.modules.batchnorm._BatchNorm) for m in optimized.modules())
+    print(f"BatchNorm layers: {num_bn} -> {num_bn_left}")
+
+    with th.no_grad():
+        worst = 0.0
+        for _ in range(args.trials):
+            x = th.randn(args.batch_size, args.in_ch, args.image_size, args.image_size, device=device)
+            t = th.randint(0, diffusion.num_timesteps, (args.batch_size,), device=device)
+            out, cal = model(x, t)
+            out_opt, cal_opt = optimized(x, t)
+            worst = max(worst, (out - out_opt).abs().max().item(), (cal - cal_opt).abs().max().item())
+        print(f"max abs diff over {args.trials} random inputs: {worst:.3e}")
+        assert worst < args.tolerance, "optimize_for_inference changed the model output"
+
+        print(f"eager: {time_forward(model, x, t, args.repeats):.1f} ms/forward")
+        print(f"optimized: {time_forward(optimized, x, t, args.repeats):.1f} ms/forward")
+
+
+def create_argparser():
+    defaults = dict(
+        batch_size=2,
+        trials=5,
+        tolerance=1e-4,
+        repeats=10,
+        device="cpu",
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Post-training int8 quantization of a trained RMDM denoiser.
+
+Calibrates on the first --calib_batches batches of the RadioMapSeer training
+split, converts the model (see guided_diffusion/quantization.py), saves the
+int8 state dict to --quant_path, then samples --eval_batches test batches with
+the float and the int8 model from the same noise and reports NMSE, SSIM and
+DDIM steps/s of both, with the deltas.
+
+Sample with the result via:
+    python scripts/RMDM_sample.py --quantized True --model_path rmdm_int8.pt ...
+"""
+import argparse
+import itertools
+import sys
+import time
+sys.path.append(".")
+import numpy as np
+import torch as th
+from skimage.metrics import structural_similarity
+from guided_diffusion import dist_util, logger
+from guided_diffusion.quantization import prepare_int8, calibrate, convert_int8
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    add_dict_to_argparser,
+    args_to_dict,
+)
+from RadioUNet.lib import loaders
+
+
+def load_float_model(args):
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    state_dict = dist_util.load_state_dict(args.model_path, map_location="cpu")
+    model.load_state_dict(dist_util.strip_state_dict_prefix(state_dict))
+    model.eval()
+    return model, diffusion
+
+
+def evaluate(model, diffusion, batches, args):
+    """
+    :return: (nmse, ssim, DDIM steps/s) averaged over the batches.
+    """
+    if hasattr(model, "build_timestep_cache"):
+        model.build_timestep_cache(diffusion.model_timesteps())
+    nmse, ssim, elapsed = [], [], 0.0
+    with th.no_grad():
+        for i, (b, m, *_) in enumerate(batches):
+            th.manual_seed(args.seed + i)
+            img = th.cat((b, th.zeros_like(b[:, :1])), dim=1)
+            img[:, 0] = b[:, 0] + 10 * b[:, 1]
+            start = time.time()
+            sample, _, _, _, _ = diffusion.ddim_sample_loop_known(
+                model, tuple(img.shape), img, step=args.ddim_steps, clip_denoised=args.clip_denoised
+            )
+            elapsed += time.time() - start
+            pred, gt = sample[:, -1].numpy(), m[:, 0].numpy()
+            nmse.append(((pred - gt) ** 2).mean() / (gt ** 2).mean())
+            ssim.extend(structural_similarity(p, g, data_range=g.max() - g.min()) for p, g in zip(pred, gt))
+    return float(np.mean(nmse)), float(np.mean(ssim)), len(batches) * args.ddim_steps / elapsed
+
+
+def main():
+    args = create_argparser().parse_args()
+    logger.configure(dir=args.out_dir)
+    th.set_num_threads(args.num_threads)
+
+    if args.data_name == 'Radio_2':
+        train = loaders.RadioUNet_s(phase="train", carsSimul="yes", carsInput="yes")
+        test = loaders.RadioUNet_s(phase="test", carsSimul="yes", carsInput="yes")
+        args.in_ch = 5
+    elif args.data_name == 'Radio_3':
+        train = loaders.RadioUNet_s(phase="train", simulation="rand", cityMap="missing", missing=4)
+        test = loaders.RadioUNet_s(phase="test", simulation="rand", cityMap="missing", missing=4)
+        args.in_ch = 4
+    else:
+        train = loaders.RadioUNet_c(phase="train")
+        test = loaders.RadioUNet_c(phase="test")
+        args.in_ch = 3
+    calib = list(itertools.islice(th.utils.data.DataLoader(train, batch_size=args.batch_size, shuffle=True), args.calib_batches))
+    evals = list(itertools.islice(th.utils.data.DataLoader(test, batch_size=args.batch_size, shuffle=False), args.eval_batches))
+
+    logger.log("evaluating the float model...")
+    model, diffusion = load_float_model(args)
+    float_nmse, float_ssim, float_rate = evaluate(model, diffusion, evals, args)
+
+    logger.log(f"calibrating on {len(calib)} training batches...")
+    prepare_int8(model, args.engine or None)
+    calibrate(model, diffusion, calib, steps=args.ddim_steps, clip_denoised=args.clip_denoised)
+    convert_int8(model)
+    th.save(model.state_dict(), args.quant_path)
+    logger.log(f"saved {args.quant_path}")
+
+    logger.log("evaluating the int8 model...")
+    int8_nmse, int8_ssim, int8_rate = evaluate(model, diffusion, evals, args)
+
+    logger.log(f"| model | NMSE | SSIM | steps/s (batch {args.batch_size}, {args.num_threads} threads) |")
+    logger.log("|---|---:|---:|---:|")
+    logger.log(f"| float32 | {float_nmse:.5f} | {float_ssim:.4f} | {float_rate:.3f} |")
+    logger.log(f"| int8 | {int8_nmse:.5f} | {int8_ssim:.4f} | {int8_rate:.3f} |")
+    logger.log(f"| delta | {int8_nmse - float_nmse:+.5f} | {int8_ssim - float_ssim:+.4f} | x{int8_rate / float_rate:.2f} |")
+
+
+def create_argparser():
+    defaults = dict(
+        data_name='Radio',
+        model_path="",
+        quant_path="rmdm_int8.pt",
+        engine="",              #"fbgemm" (x86) or "qnnpack" (ARM); empty keeps torch's default
+        calib_batches=16,       #training batches seen by the observers
+        eval_batches=16,
+        batch_size=4,
+        ddim_steps=10,
+        clip_denoised=True,
+        num_threads=4,
+        seed=0,
+        out_dir='./results/quantize/',
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,15 @@
-
-
 import argparse
 import os
-from ssl import OP_NO_TLSv1
-import nibabel as nib
-# from visdom import Visdom
-# viz = Visdom(port=8850)
 import sys
 import random
 sys.path.append(".")
 import numpy as np
 import time
 import torch as th
-from PIL import Image
 import torch.distributed as dist
-from guided_diffusion import dist_util, logger
-from guided_diffusion.bratsloader import BRATSDataset, BRATSDataset3D
-from guided_diffusion.isicloader import ISICDataset
-from guided_diffusion.custom_dataset_loader import CustomDataset
-import torchvision.utils as vutils
+from guided_diffusion import dist_util, logger, profiling
+from guided_diffusion.distillation import student_timesteps
 from guided_diffusion.utils import staple
-import matplotlib.pyplot as plt
 from torch.utils.data import DataLoader
 from guided_diffusion.script_util import (
     NUM_CLASSES,
@@ -29,16 +18,13 @@ from guided_diffusion.script_util import (
     add_dict_to_argparser,
     args_to_dict,
 )
-from RadioUNet.lib import loaders, modules
-import torchvision.transforms as transforms
-from torchsummary import summary
+from RadioUNet.lib import loaders
 seed=10
 th.manual_seed(seed)
 th.cuda.manual_seed_all(seed)
 np.random.seed(seed)
 random.seed(seed)
 import torch.nn as nn
-from tqdm import tqdm
 criterion = nn.MSELoss()
 nmse = []
 def visualize(img):
@@ -48,12 +34,6 @@ def visualize(img):
     return normalized_img
 
 
-import torch
-import torchvision.transforms.functional as F
-from skimage.metrics import structural_similarity as ssim_skimage
-import numpy as np
-
-
 def calculate_ssim(ss, m):
     """
     计算结构相似性指数（SSIM）
@@ -78,6 +58,7 @@ def calculate_ssim(ss, m):
     # m_gray = np.dot(m_np[...,:3], [0.2989, 0.5870, 0.1140])
     
     # 使用scikit-image的ssim函数计算SSIM值
+    from skimage.metrics import structural_similarity as ssim_skimage
     ssim_value = ssim_skimage(ss_np, m_np, data_range=m_np.max() - m_np.min())
     return ssim_value
 
@@ -107,6 +88,8 @@ def main():
         ds = loaders.RadioUNet_s(phase="test", simulation="rand", cityMap="missing", missing=4,dir_dataset="/home/user/dxc/motion/MedSegDiff/RadioUNet/RadioMapSeer/")
         args.in_ch = 4
     else:
+        import torchvision.transforms as transforms
+        from guided_diffusion.custom_dataset_loader import CustomDataset
         tran_list = [transforms.Resize((args.image_size,args.image_size)), transforms.ToTensor()]
         transform_test = transforms.Compose(tran_list)
 
@@ -127,23 +110,41 @@ def main():
     all_images = []
 
 
+    if args.quantized:
+        # int8 checkpoint from RMDM_quantize.py; quantized kernels run on the CPU only
+        from guided_diffusion.quantization import quantize_structure
+        quantize_structure(model)
+    if not args.quantized:
+        # place the model first: each tensor is then copied straight from the
+        # memory-mapped checkpoint to the device
+        model.to(dist_util.dev())
     state_dict = dist_util.load_state_dict(args.model_path, map_location="cpu")
-    from collections import OrderedDict
-    new_state_dict = OrderedDict()
-    for k, v in state_dict.items():
-        # name = k[7:] # remove `module.`
-        if 'module.' in k:
-            new_state_dict[k[7:]] = v
-            # load params
-        else:
-            new_state_dict = state_dict
-
-    model.load_state_dict(new_state_dict)
-
-    model.to(dist_util.dev())
+    model.load_state_dict(dist_util.strip_state_dict_prefix(state_dict))
+    del state_dict
+
     if args.use_fp16:
         model.convert_to_fp16()
     model.eval()
+    if args.optimize_for_inference and not args.quantized:
+        model.optimize_for_inference()
+    if args.channels_last:
+        model.convert_to_channels_last()
+    if args.timestep_cache and hasattr(model, "build_timestep_cache"):
+        model.build_timestep_cache(diffusion.model_timesteps())
+    if args.phase_timers:
+        profiling.enable(sync=args.sync_timers)
+        if not args.onnx_path:
+            profiling.attach_module_timers(model)
+    profiler = None
+    if args.profile_samples:
+        first, last = (int(n) for n in args.profile_samples.split(":"))
+        profiler = profiling.make_profiler(os.path.join(args.out_dir, "profile"), first, last - first)
+        profiler.start()
+    if args.onnx_path:
+        # sample with the ONNX Runtime backend instead of the torch module
+        from guided_diffusion.onnx_backend import OnnxRuntimeModel
+        model = OnnxRuntimeModel(args.onnx_path, device=dist_util.dev())
+    from tqdm import tqdm
     for b,m,path in tqdm(DataLoader(ds,batch_size=1, shuffle=True, num_workers=1)):
         #b, m, path = next(data)  #should return an image from the dataloader "data"
         c = th.randn_like(b[:, :1, ...])
@@ -159,27 +160,34 @@ def main():
 
         logger.log("sampling...")
 
-        start = th.cuda.Event(enable_timing=True)
-        end = th.cuda.Event(enable_timing=True)
         enslist = []
         
         for i in range(args.num_ensemble):  #this is for the generation of an ensemble of 5 masks.
             model_kwargs = {}
-            start.record()
+            start = profiling.synchronized_time()
             sample_fn = (
                 diffusion.p_sample_loop_known if not args.use_ddim else diffusion.ddim_sample_loop_known
             )
-            sample, x_noisy, org, cal, cal_out = sample_fn(
-                model,
-                (args.batch_size, 3, args.image_size, args.image_size), img,
-                step = args.diffusion_steps,
-                clip_denoised=args.clip_denoised,
-                model_kwargs=model_kwargs,
-            )
-
-            end.record()
-            th.cuda.synchronize()
-            print('time for 1 sample', start.elapsed_time(end))  #time measurement for the generation of 1 sample
+            sample_kwargs = {}
+            if args.use_ddim and args.student_steps:
+                # a distilled student samples on the grid it was trained on
+                sample_kwargs["timesteps"] = student_timesteps(diffusion.num_timesteps, args.student_steps)
+            with profiling.phase("sample"):
+                sample, x_noisy, org, cal, cal_out = sample_fn(
+                    model,
+                    (args.batch_size, 3, args.image_size, args.image_size), img,
+                    step = args.diffusion_steps if not args.use_ddim else args.ddim_steps,
+                    clip_denoised=args.clip_denoised,
+                    model_kwargs=model_kwargs,
+                    **sample_kwargs,
+                )
+
+            print('time for 1 sample', (profiling.synchronized_time() - start) * 1000)  #time measurement for the generation of 1 sample, in ms
+            if args.phase_timers:
+                profiling.end_step()
+                logger.dumpkvs()
+            if profiler is not None:
+                profiler.step()
 
             co = th.tensor(cal_out)
             if args.version == 'new':
@@ -225,6 +233,7 @@ def main():
 
                     # 使用savez函数存储为.npz文件
                     np.savez(f'/home/user/dxc/motion/MedSegDiff/results/results_3/combined_{id}.npz', data = data)
+                    import matplotlib.pyplot as plt
                     fig, axs = plt.subplots(1, 3)  # 创建1行3列的子图布局
 
                     # 绘制第一张图
@@ -271,12 +280,22 @@ def create_argparser():
         num_samples=1,
         batch_size=1,
         use_ddim=False,
+        ddim_steps=50,       #number of strided DDIM steps when use_ddim is set
         model_path="",         #path to pretrain model
         num_ensemble=1,      #number of samples in the ensemble
         gpu_dev = "0",
         out_dir='./results/',
         multi_gpu = None, #"0,1,2"
-        debug = False
+        debug = False,
+        timestep_cache = True,  #precompute timestep embeddings and ResBlock projections once
+        onnx_path = "",  #sample with this RMDM_onnx_export.py graph in ONNX Runtime
+        quantized = False,  #model_path is an int8 state dict from RMDM_quantize.py
+        channels_last = False,  #run the model in NHWC memory format
+        student_steps = 0,  #sampling steps of a RMDM_distill.py student loaded from model_path, e.g. 4 or 8
+        optimize_for_inference = False,  #fold the highway BatchNorms into their convs and drop dropout
+        phase_timers = False,  #log time_<phase> per sample: sample, highway, unet_body, attention, ffparser
+        sync_timers = False,  #synchronize CUDA around every timed phase for exact attribution
+        profile_samples = "",  #"START:END": torch.profiler trace and operator table of these samples in out_dir/profile
     )
     defaults.update(model_and_diffusion_defaults())
     parser = argparse.ArgumentParser()
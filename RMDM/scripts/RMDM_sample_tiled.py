@@ -0,0 +1,115 @@
+"""
+Sample a radio map for a building/Tx raster of any size with overlapping tiles.
+
+Example:
+    python scripts/RMDM_sample_tiled.py --model_path savedmodel.pt --image_size 256 \
+        --buildings_path district.png --tx_path district_tx.png --out_path district_gain.npy
+"""
+import argparse
+import os
+import sys
+sys.path.append(".")
+import numpy as np
+from skimage import io
+from guided_diffusion import dist_util, logger
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    add_dict_to_argparser,
+    args_to_dict,
+)
+from guided_diffusion.tiled_sampling import sample_tiled
+
+
+def load_conditioning(args, path, rows=1024):
+    """
+    Stack the input rasters the way RadioUNet_c does, pad them to at least one
+    tile, and fold the Tx channel into the buildings channel like the sampler.
+    The result is written to a float32 .npy memory map at path, one channel
+    and `rows` rows at a time, so the float raster is never held in memory.
+    """
+    paths = [args.buildings_path, args.tx_path] + ([args.cars_path] if args.cars_path else [])
+    # RadioUNet_c divides by 256 with cars; without, ToTensor scales its uint8 stack by 1/255
+    scale = np.float32(256 if args.cars_path else 255)
+    cond = None
+    for c, image_path in enumerate(paths):
+        image = np.asarray(io.imread(image_path))
+        if cond is None:
+            H, W = image.shape[:2]
+            shape = (len(paths), max(H, args.image_size), max(W, args.image_size))
+            cond = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+        for r in range(0, H, rows):
+            cond[c, r : r + rows, :W] = image[r : r + rows] / scale
+        del image
+    for r in range(0, H, rows):
+        cond[0, r : r + rows] += 10 * cond[1, r : r + rows]
+    cond.flush()
+    return cond, (H, W)
+
+
+def main():
+    args = create_argparser().parse_args()
+    dist_util.setup_dist(args)
+    logger.configure(dir=args.out_dir)
+
+    cond_path = os.path.splitext(args.out_path)[0] + "_cond.npy"
+    cond, (H, W) = load_conditioning(args, cond_path)
+    args.in_ch = cond.shape[0] + 1
+
+    logger.log("creating model and diffusion...")
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    state_dict = dist_util.load_state_dict(args.model_path, map_location="cpu")
+    model.load_state_dict(dist_util.strip_state_dict_prefix(state_dict))
+    model.to(dist_util.dev())
+    if args.use_fp16:
+        model.convert_to_fp16()
+    model.eval()
+    if hasattr(model, "build_timestep_cache"):
+        model.build_timestep_cache(diffusion.model_timesteps())
+
+    out = np.lib.format.open_memmap(args.out_path, mode="w+", dtype=np.float32, shape=tuple(cond.shape[1:]))
+    logger.log(f"sampling a {H}x{W} raster in {args.image_size}px tiles...")
+    sample_tiled(
+        diffusion,
+        model,
+        cond,
+        out=out,
+        tile_size=args.image_size,
+        step_size=args.tile_step,
+        tile_batch=args.tile_batch,
+        steps=args.ddim_steps,
+        seed=args.seed,
+        clip_denoised=args.clip_denoised,
+    )
+    out.flush()
+    del cond
+    os.remove(cond_path)
+    logger.log(f"saved to {args.out_path} (crop [:{H}, :{W}] if the raster was padded)")
+
+
+def create_argparser():
+    defaults = dict(
+        buildings_path="",
+        tx_path="",
+        cars_path="",          #optional cars raster
+        out_path="./results/tiled_gain.npy",
+        tile_step=0.5,         #tile stride as a fraction of the tile size
+        tile_batch=8,          #tiles sent through the reverse loop together
+        ddim_steps=50,
+        seed=0,
+        clip_denoised=True,
+        model_path="",
+        gpu_dev="0",
+        out_dir='./results/',
+        multi_gpu=None,
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
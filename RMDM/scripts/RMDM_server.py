@@ -0,0 +1,295 @@
+"""
+Long-running local radio-map service.
+
+The model, the diffusion schedule and the timestep cache are loaded once.
+POST /predict takes an .npz body with 256x256 rasters "buildings", "tx" and,
+depending on --data_name, "samples" (sparse measurements) and "cars", scaled
+to [0, 1] like the RadioMapSeer loaders' inputs. It
+returns an .npz with "radio_map" and the timing fields "queue_ms",
+"compute_ms" and "batch_size".
+
+Concurrent requests are grouped into one batch: a batch is sampled as soon as
+it holds --max_batch requests or its oldest request has waited --max_latency_ms.
+With --continuous_batching, requests instead join a SlotSampler of --max_batch
+slots between denoising steps and leave it as soon as their own map is done.
+With --wnet_path, the maps come from a distilled RadioWNet in a single pass.
+
+Example:
+    python scripts/RMDM_server.py --model_path savedmodel.pt --image_size 256 --port 8808
+    python scripts/RMDM_client.py --url http://127.0.0.1:8808 --concurrency 8
+"""
+import argparse
+import io
+import queue
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.append(".")
+import numpy as np
+import torch as th
+from guided_diffusion import dist_util, logger
+from guided_diffusion.slot_sampler import SlotSampler
+from RadioUNet.lib import modules
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    add_dict_to_argparser,
+    args_to_dict,
+)
+
+# input rasters, in model channel order, for every dataset configuration
+CHANNELS = {
+    'Radio': ("buildings", "tx"),
+    'Radio_2': ("buildings", "tx", "samples", "cars"),
+    'Radio_3': ("buildings", "tx", "samples"),
+}
+
+
+class PendingRequest:
+    def __init__(self, cond):
+        self.cond = cond
+        self.arrival = time.time()
+        self.start = None
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchingSampler:
+    """
+    Collects requests from a queue and samples them in batches on one worker thread.
+    """
+
+    def __init__(self, model, diffusion, args):
+        self.model = model
+        self.diffusion = diffusion
+        self.args = args
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, cond):
+        request = PendingRequest(cond)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        deadline = batch[0].arrival + self.args.max_latency_ms / 1000
+        while len(batch) < self.args.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _predict(self, b):
+        img = th.cat((b, th.zeros_like(b[:, :1])), dim=1)
+        img[:, 0] = b[:, 0] + 10 * b[:, 1]
+        sample, _, _, _, _ = self.diffusion.ddim_sample_loop_known(
+            self.model, tuple(img.shape), img, step=self.args.ddim_steps,
+            clip_denoised=self.args.clip_denoised,
+        )
+        return sample[:, -1]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            start = time.time()
+            try:
+                b = th.stack([r.cond for r in batch]).to(dist_util.dev())
+                with th.no_grad():
+                    maps = self._predict(b).float().cpu().numpy()
+            except Exception as e:  # report to every waiting client, keep serving
+                for r in batch:
+                    r.error = e
+                    r.done.set()
+                continue
+            compute_ms = (time.time() - start) * 1000
+            for r, radio_map in zip(batch, maps):
+                r.result = dict(
+                    radio_map=radio_map,
+                    queue_ms=(start - r.arrival) * 1000,
+                    compute_ms=compute_ms,
+                    batch_size=len(batch),
+                )
+                r.done.set()
+
+
+class ContinuousSampler(BatchingSampler):
+    """
+    Feeds queued requests into a SlotSampler between denoising steps.
+    """
+
+    def _run(self):
+        slots = None
+        in_flight = {}
+        while True:
+            # block only when no slot is busy, otherwise pick up whatever has arrived
+            if not in_flight:
+                incoming = [self.requests.get()]
+            else:
+                incoming = []
+            while True:
+                try:
+                    incoming.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            # registered before anything can raise, so the handler below answers all of them
+            for r in incoming:
+                in_flight[id(r)] = r
+            try:
+                for r in incoming:
+                    cond = r.cond.clone()
+                    cond[0] = r.cond[0] + 10 * r.cond[1]
+                    if slots is None:
+                        slots = SlotSampler(
+                            self.diffusion, self.model, self.args.max_batch, tuple(cond.shape),
+                            steps=self.args.ddim_steps, clip_denoised=self.args.clip_denoised,
+                            device=dist_util.dev(),
+                        )
+                    slots.submit(id(r), cond)
+                slots.fill()
+                step_start = time.time()
+                occupied = [i for i in slots.slot_ids if i is not None]
+                for request_id in occupied:
+                    if in_flight[request_id].start is None:
+                        in_flight[request_id].start = step_start
+                finished = slots.step()
+            except Exception as e:  # report to every waiting client, keep serving
+                for r in in_flight.values():
+                    r.error = e
+                    r.done.set()
+                in_flight.clear()
+                slots = None
+                continue
+            for request_id, radio_map in finished:
+                r = in_flight.pop(request_id)
+                r.result = dict(
+                    radio_map=radio_map.float().cpu().numpy(),
+                    queue_ms=(r.start - r.arrival) * 1000,
+                    compute_ms=(time.time() - r.start) * 1000,
+                    batch_size=len(occupied),
+                )
+                r.done.set()
+
+
+class WNetSampler(BatchingSampler):
+    """
+    Answers from a RadioWNet distilled with RMDM_wnet_distill.py, in one forward pass.
+    """
+
+    def _predict(self, b):
+        return self.model(b)[1][:, 0]
+
+
+def make_handler(sampler, channels, image_size):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/predict":
+                self.send_error(404)
+                return
+            try:
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                rasters = np.load(io.BytesIO(body))
+                cond = th.from_numpy(np.stack([rasters[c] for c in channels]).astype(np.float32))
+                if cond.shape[1:] != (image_size, image_size):
+                    raise ValueError(f"rasters must be {image_size}x{image_size}, got {tuple(cond.shape[1:])}")
+            except Exception as e:
+                self.send_error(400, str(e))
+                return
+            try:
+                result = sampler.submit(cond)
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            out = io.BytesIO()
+            np.savez(out, **result)
+            payload = out.getvalue()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return Handler
+
+
+def main():
+    args = create_argparser().parse_args()
+    dist_util.setup_dist(args)
+    logger.configure(dir=args.out_dir)
+
+    channels = CHANNELS[args.data_name]
+    args.in_ch = len(channels) + 1
+
+    if args.wnet_path:
+        logger.log("loading distilled RadioWNet...")
+        wnet = modules.RadioWNet(inputs=len(channels), phase="secondU")
+        wnet.load_state_dict(th.load(args.wnet_path, map_location="cpu"))
+        wnet.to(dist_util.dev()).eval()
+        sampler = WNetSampler(wnet, None, args)
+        serve(args, sampler, channels)
+        return
+
+    logger.log("creating model and diffusion...")
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    model.to(dist_util.dev())
+    state_dict = dist_util.load_state_dict(args.model_path, map_location="cpu")
+    model.load_state_dict(dist_util.strip_state_dict_prefix(state_dict))
+    del state_dict
+    if args.use_fp16:
+        model.convert_to_fp16()
+    model.eval()
+    if hasattr(model, "build_timestep_cache"):
+        model.build_timestep_cache(diffusion.model_timesteps())
+
+    if args.continuous_batching:
+        sampler = ContinuousSampler(model, diffusion, args)
+    else:
+        sampler = BatchingSampler(model, diffusion, args)
+    serve(args, sampler, channels)
+
+
+def serve(args, sampler, channels):
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(sampler, channels, args.image_size))
+    logger.log(f"serving on http://{args.host}:{args.port}/predict")
+    server.serve_forever()
+
+
+def create_argparser():
+    defaults = dict(
+        data_name='Radio',
+        host="127.0.0.1",
+        port=8808,
+        max_batch=8,            #largest batch sent through the reverse loop
+        max_latency_ms=50.0,    #longest a request waits for its batch to fill
+        continuous_batching=False,  #refill finished slots every DDIM step instead of whole batches
+        wnet_path="",           #serve a RMDM_wnet_distill.py RadioWNet instead of the diffusion sampler
+        ddim_steps=50,
+        clip_denoised=True,
+        model_path="",
+        gpu_dev="0",
+        out_dir='./results/server/',
+        multi_gpu=None,
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Train the super-resolution stage of the cascade: a SuperResModel that denoises
+the full-resolution radio map conditioned on the buildings/Tx channels and on
+the radio map downsampled to --small_size.
+
+The first stage is trained with RMDM_train.py --data_size 64 --image_size 64.
+"""
+import sys
+import argparse
+sys.path.append("../")
+sys.path.append("./")
+from guided_diffusion import dist_util, logger
+from guided_diffusion.resample import create_named_schedule_sampler
+from guided_diffusion.script_util import (
+    sr_model_and_diffusion_defaults,
+    sr_create_model_and_diffusion,
+    args_to_dict,
+    add_dict_to_argparser,
+)
+import torch as th
+from guided_diffusion.train_util import TrainLoop
+from RadioUNet.lib import loaders
+
+
+def main():
+    args = create_argparser().parse_args()
+
+    dist_util.setup_dist(args)
+    logger.configure(dir = args.out_dir)
+
+    logger.log("creating data loader...")
+    if args.data_name == 'Radio_2':
+        ds = loaders.RadioUNet_s(phase="train", carsSimul="yes", carsInput="yes")
+        args.in_ch = 5
+    elif args.data_name == 'Radio_3':
+        ds = loaders.RadioUNet_s(phase="train", simulation="rand", cityMap="missing", missing=4)
+        args.in_ch = 4
+    else:
+        args.data_name = 'Radio'
+        ds = loaders.RadioUNet_c(phase="train")
+        args.in_ch = 3
+    if args.large_size != 256:
+        ds = loaders.RadioUNet_resized(ds, args.large_size)
+
+    datal = th.utils.data.DataLoader(
+        ds,
+        batch_size=args.batch_size,
+        shuffle=True)
+    data = iter(datal)
+
+    logger.log("creating model and diffusion...")
+    model, diffusion = sr_create_model_and_diffusion(
+        **args_to_dict(args, sr_model_and_diffusion_defaults().keys())
+    )
+    model.to(dist_util.dev())
+    schedule_sampler = create_named_schedule_sampler(args.schedule_sampler, diffusion,  maxt=args.diffusion_steps, sync_every=args.schedule_sync_every)
+
+    logger.log("training...")
+    TrainLoop(
+        model=model,
+        diffusion=diffusion,
+        classifier=None,
+        data=data,
+        dataloader=datal,
+        batch_size=args.batch_size,
+        microbatch=args.microbatch,
+        lr=args.lr,
+        ema_rate=args.ema_rate,
+        log_interval=args.log_interval,
+        save_interval=args.save_interval,
+        resume_checkpoint=args.resume_checkpoint,
+        use_fp16=args.use_fp16,
+        fp16_scale_growth=args.fp16_scale_growth,
+        schedule_sampler=schedule_sampler,
+        weight_decay=args.weight_decay,
+        lr_anneal_steps=args.lr_anneal_steps,
+        low_res_size=args.small_size,
+    ).run_loop()
+
+
+def create_argparser():
+    defaults = dict(
+        data_name = 'Radio',
+        schedule_sampler="loss-second-moment",
+        schedule_sync_every=10,  # steps between cross-rank syncs of the loss-aware sampler
+        lr=1e-4,
+        weight_decay=0.0,
+        lr_anneal_steps=0,
+        batch_size=1,
+        microbatch=-1,  # -1 disables microbatches
+        ema_rate="0.9999",  # comma-separated list of EMA values
+        log_interval=100,
+        save_interval=5000,
+        resume_checkpoint=None,
+        fp16_scale_growth=1e-3,
+        gpu_dev = "0",
+        multi_gpu = None,
+        out_dir='./results/sr/'
+    )
+    defaults.update(sr_model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
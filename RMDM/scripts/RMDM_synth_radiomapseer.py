@@ -0,0 +1,146 @@
+"""
+Write a synthetic dataset with the RadioMapSeer directory layout.
+
+The maps are not physically meaningful, but every file the RadioUNet loaders
+read exists with the right name, size and dtype, so loaders, training and
+sampling can be benchmarked without the real dataset:
+
+    png/buildings_complete/{map}.png          256 x 256 uint8, 255 on buildings
+    png/buildings_missing{1..4}/{1..6}/{map}.png   the same with 1..4 buildings removed
+    png/cars/{map}.png                         cars along the streets
+    png/antennas/{map}_{tx}.png                one transmitter pixel
+    gain/{DPM,IRT2,carsDPM,carsIRT2}/{map}_{tx}.png   log-distance path loss,
+                                               attenuated by buildings (and cars)
+
+Maps are numbered 1..--num_maps, with --num_tx transmitters each. Load them with
+phase="custom", maps_inds=np.arange(num_maps), ind1=0, ind2=num_maps-1 and
+numTx=num_tx (see synthetic_dataset in RMDM_benchmark.py).
+"""
+import argparse
+import os
+import sys
+from multiprocessing import Pool
+sys.path.append(".")
+import numpy as np
+from skimage import io
+from guided_diffusion.script_util import add_dict_to_argparser
+
+SIZE = 256
+GAIN_DIRS = ("DPM", "IRT2", "carsDPM", "carsIRT2")
+
+
+def random_buildings(rng, count):
+    """
+    :return: a list of (y0, y1, x0, x1) rectangles.
+    """
+    boxes = []
+    for _ in range(count):
+        h, w = rng.integers(8, 40, size=2)
+        y, x = rng.integers(0, SIZE - h), rng.integers(0, SIZE - w)
+        boxes.append((y, y + h, x, x + w))
+    return boxes
+
+
+def rasterize(boxes):
+    img = np.zeros((SIZE, SIZE), dtype=np.uint8)
+    for y0, y1, x0, x1 in boxes:
+        img[y0:y1, x0:x1] = 255
+    return img
+
+
+def path_loss(tx, obstacles, rng, exponent, wall_db):
+    """
+    Gain map in [0, 255]: log-distance path loss from tx, minus `wall_db` per
+    obstacle pixel crossed on the line of sight (sampled at 32 points), zero
+    inside obstacles.
+    """
+    yy, xx = np.mgrid[0:SIZE, 0:SIZE].astype(np.float32)
+    d = np.hypot(yy - tx[0], xx - tx[1]) + 1.0
+    db = -10 * exponent * np.log10(d)
+    steps = np.linspace(0.0, 1.0, 32, dtype=np.float32)[:, None, None]
+    ys = np.clip(np.rint(tx[0] + steps * (yy - tx[0])), 0, SIZE - 1).astype(np.int32)
+    xs = np.clip(np.rint(tx[1] + steps * (xx - tx[1])), 0, SIZE - 1).astype(np.int32)
+    crossed = (obstacles[ys, xs] > 0).sum(0)
+    db = db - wall_db * crossed + rng.normal(0, 1.0, size=db.shape)
+    gain = np.clip((db + 60) / 60, 0, 1) * 255
+    gain[obstacles > 0] = 0
+    return gain.astype(np.uint8)
+
+
+def write_map(job):
+    root, map_id, num_tx, seed = job
+    rng = np.random.default_rng([seed, map_id])
+    boxes = random_buildings(rng, int(rng.integers(30, 60)))
+    buildings = rasterize(boxes)
+    name = f"{map_id}.png"
+    io.imsave(os.path.join(root, "png", "buildings_complete", name), buildings, check_contrast=False)
+    for missing in range(1, 5):
+        for version in range(1, 7):
+            keep = np.ones(len(boxes), dtype=bool)
+            keep[rng.choice(len(boxes), size=missing, replace=False)] = False
+            img = rasterize([b for b, k in zip(boxes, keep) if k])
+            io.imsave(os.path.join(root, "png", f"buildings_missing{missing}", str(version), name), img, check_contrast=False)
+
+    street = np.argwhere(buildings == 0)
+    cars = np.zeros_like(buildings)
+    for y, x in street[rng.choice(len(street), size=60, replace=False)]:
+        cars[y:y + 2, x:x + 4] = 255
+    cars[buildings > 0] = 0
+    io.imsave(os.path.join(root, "png", "cars", name), cars, check_contrast=False)
+
+    for tx_id in range(num_tx):
+        tx = street[rng.integers(len(street))]
+        antenna = np.zeros_like(buildings)
+        antenna[tx[0], tx[1]] = 255
+        name2 = f"{map_id}_{tx_id}.png"
+        io.imsave(os.path.join(root, "png", "antennas", name2), antenna, check_contrast=False)
+        with_cars = np.maximum(buildings, cars)
+        gains = dict(
+            DPM=path_loss(tx, buildings, rng, 2.0, 1.0),
+            IRT2=path_loss(tx, buildings, rng, 2.2, 0.8),
+            carsDPM=path_loss(tx, with_cars, rng, 2.0, 1.0),
+            carsIRT2=path_loss(tx, with_cars, rng, 2.2, 0.8),
+        )
+        for sim, gain in gains.items():
+            io.imsave(os.path.join(root, "gain", sim, name2), gain, check_contrast=False)
+
+
+def generate(root, num_maps, num_tx, seed=0, workers=4):
+    """
+    Write maps 1..num_maps with num_tx transmitters each into root.
+    """
+    dirs = [os.path.join("png", "buildings_complete"), os.path.join("png", "cars"), os.path.join("png", "antennas")]
+    dirs += [os.path.join("png", f"buildings_missing{m}", str(v)) for m in range(1, 5) for v in range(1, 7)]
+    dirs += [os.path.join("gain", sim) for sim in GAIN_DIRS]
+    for d in dirs:
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+    jobs = [(root, map_id, num_tx, seed) for map_id in range(1, num_maps + 1)]
+    if workers > 1:
+        with Pool(workers) as pool:
+            pool.map(write_map, jobs)
+    else:
+        for job in jobs:
+            write_map(job)
+
+
+def main():
+    args = create_argparser().parse_args()
+    generate(args.out_dir, args.num_maps, args.num_tx, args.seed, args.workers)
+    print(f"wrote {args.num_maps} maps x {args.num_tx} transmitters to {args.out_dir}")
+
+
+def create_argparser():
+    defaults = dict(
+        out_dir="./results/synthetic_radiomapseer/",
+        num_maps=20,        #the real dataset has 700
+        num_tx=8,           #transmitters per map, 80 in the real dataset
+        seed=0,
+        workers=4,
+    )
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
 
 import sys
 import argparse
+import os
 sys.path.append("../")
 sys.path.append("./")
-from guided_diffusion import dist_util, logger
+from guided_diffusion import dist_util, logger, profiling
 from guided_diffusion.resample import create_named_schedule_sampler
-from guided_diffusion.custom_dataset_loader import CustomDataset
 from guided_diffusion.script_util import (
     model_and_diffusion_defaults,
     create_model_and_diffusion,
@@ -14,16 +14,13 @@ from guided_diffusion.script_util import (
 )
 import torch as th
 from guided_diffusion.train_util import TrainLoop
-from visdom import Visdom
-viz = Visdom(port=8850)
-import torchvision.transforms as transforms
-from RadioUNet.lib import loaders, modules
+from RadioUNet.lib import loaders
 
 def main():
     args = create_argparser().parse_args()
 
     dist_util.setup_dist(args)
-    logger.configure(dir = args.out_dir)
+    logger.configure(dir = args.out_dir, format_strs=args.log_format.split(",") if args.log_format else None)
 
     logger.log("creating data loader...")
 
@@ -46,12 +43,17 @@ def main():
         ds = loaders.RadioUNet_s(phase="train", simulation="rand", cityMap="missing", missing=4,dir_dataset="/home/user/dxc/motion/MedSegDiff/RadioUNet/RadioMapSeer/")
         args.in_ch = 4
     else :
+        import torchvision.transforms as transforms
+        from guided_diffusion.custom_dataset_loader import CustomDataset
         tran_list = [transforms.Resize((args.image_size,args.image_size)), transforms.ToTensor(),]
         transform_train = transforms.Compose(tran_list)
         print("Your current directory : ",args.data_dir)
         ds = CustomDataset(args, args.data_dir, transform_train)
         args.in_ch = 4
         
+    if args.data_size != 256:
+        ds = loaders.RadioUNet_resized(ds, args.data_size)
+
     datal= th.utils.data.DataLoader(
         ds,
         batch_size=args.batch_size,
@@ -63,12 +65,22 @@ def main():
     model, diffusion = create_model_and_diffusion(
         **args_to_dict(args, model_and_diffusion_defaults().keys())
     )
+    if args.channels_last:
+        model.convert_to_channels_last()
+    if args.phase_timers:
+        profiling.enable(sync=args.sync_timers)
+        profiling.attach_module_timers(model)
+    profiler = None
+    if args.profile_steps:
+        start, end = (int(s) for s in args.profile_steps.split(":"))
+        profiler = profiling.make_profiler(os.path.join(args.out_dir, "profile"), start, end - start)
+        profiler.start()
     if args.multi_gpu:
         model = th.nn.DataParallel(model,device_ids=[int(id) for id in args.multi_gpu.split(',')])
         model.to(device = th.device('cuda', int(args.gpu_dev)))
     else:
         model.to(dist_util.dev())
-    schedule_sampler = create_named_schedule_sampler(args.schedule_sampler, diffusion,  maxt=args.diffusion_steps)
+    schedule_sampler = create_named_schedule_sampler(args.schedule_sampler, diffusion,  maxt=args.diffusion_steps, sync_every=args.schedule_sync_every)
 
 
     logger.log("training...")
@@ -90,6 +102,8 @@ def main():
         schedule_sampler=schedule_sampler,
         weight_decay=args.weight_decay,
         lr_anneal_steps=args.lr_anneal_steps,
+        timesteps_per_sample=args.timesteps_per_sample,
+        profiler=profiler,
     ).run_loop()
 
 
@@ -97,18 +111,26 @@ def create_argparser():
     defaults = dict(
         data_name = 'BRATS',
         data_dir="../dataset/brats2020/training",
-        schedule_sampler="uniform",
+        schedule_sampler="loss-second-moment",
+        schedule_sync_every=10,  # steps between cross-rank syncs of the loss-aware sampler
         lr=1e-4,
         weight_decay=0.0,
         lr_anneal_steps=0,
         batch_size=1,
         microbatch=-1,  # -1 disables microbatches
+        timesteps_per_sample=1,  # noise levels drawn per conditioning sample; the highway runs once per sample
+        data_size=256,  # train on maps resized to this size, e.g. 64 for the first stage of the cascade
         ema_rate="0.9999",  # comma-separated list of EMA values
         log_interval=100,
         save_interval=5000,
         resume_checkpoint=None, #"/results/pretrainedmodel.pt"
         use_fp16=False,
+        channels_last=False,  # NHWC weights and activations, usually faster with oneDNN/cuDNN
         fp16_scale_growth=1e-3,
+        phase_timers=True,  # log time_<phase> per step: data, forward, highway, unet_body, attention, ffparser, pinn, backward, optimizer, ema
+        sync_timers=False,  # synchronize CUDA around every timed phase for exact attribution (slower)
+        profile_steps="",  # "START:END": torch.profiler trace and operator table of these steps in out_dir/profile
+        log_format="",  # comma-separated logger formats, e.g. "stdout,log,csv,visdom"; visdom/tensorboard are imported only when listed
         gpu_dev = "0",
         multi_gpu = None, #"0,1,2"
         out_dir='./results/'
@@ -0,0 +1,187 @@
+"""
+Distill RMDM into RadioWNet, a one-pass predictor for latency-critical use.
+
+1. Teacher maps: the RMDM sampler predicts the radio maps of the first
+   --num_teacher_maps training items. Each map is cached as
+   teacher_{idx:06d}.npz together with the exact inputs and ground truth it was
+   sampled from, since Radio_2/Radio_3 draw new measurements, simulations and
+   building versions on every read. The cache lives in a subdirectory of
+   --teacher_cache keyed by data_name, model_path and the sampling steps, and
+   maps already there are not sampled again.
+2. RadioWNet is trained like RadioUNet on these cached triples, first the
+   firstU phase (first U-Net) and then the secondU phase (the W refinement,
+   first U-Net frozen), on the target
+   teacher_weight * RMDM map + (1 - teacher_weight) * ground truth.
+   The weights after each phase are saved as wnet_firstU.pt / wnet_secondU.pt.
+
+Serve the result with RMDM_server.py --wnet_path, and compare it with the full
+sampler with RMDM_wnet_report.py.
+"""
+import sys
+import argparse
+import hashlib
+import json
+import os
+sys.path.append("../")
+sys.path.append("./")
+import numpy as np
+import torch as th
+import torch.nn.functional as F
+from guided_diffusion import dist_util, logger
+from guided_diffusion.distillation import student_timesteps
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    args_to_dict,
+    add_dict_to_argparser,
+)
+from RadioUNet.lib import loaders, modules
+
+
+def radio_dataset(data_name, phase):
+    """
+    :return: (dataset, number of input channels).
+    """
+    if data_name == 'Radio_2':
+        return loaders.RadioUNet_s(phase=phase, carsSimul="yes", carsInput="yes"), 4
+    if data_name == 'Radio_3':
+        return loaders.RadioUNet_s(phase=phase, simulation="rand", cityMap="missing", missing=4), 3
+    return loaders.RadioUNet_c(phase=phase), 2
+
+
+def teacher_cache_dir(args):
+    """
+    The subdirectory of args.teacher_cache holding the maps of this teacher
+    configuration, so a cache sampled with another data_name, checkpoint or
+    number of steps is never reused.
+    """
+    model_path = os.path.abspath(args.model_path)
+    config = dict(
+        data_name=args.data_name,
+        model_path=model_path,
+        model_mtime=int(os.path.getmtime(model_path)) if os.path.exists(model_path) else None,
+        ddim_steps=args.ddim_steps,
+        student_steps=args.student_steps,
+    )
+    key = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+    cache_dir = os.path.join(args.teacher_cache, f"{args.data_name}_{key}")
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, "config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+    return cache_dir
+
+
+def generate_teacher_maps(args, ds, cache_dir):
+    todo = [i for i in range(min(args.num_teacher_maps, len(ds)))
+            if not os.path.exists(os.path.join(cache_dir, "teacher_%06d.npz" % i))]
+    if not todo:
+        return
+    logger.log(f"sampling {len(todo)} teacher maps into {cache_dir}...")
+    args.in_ch = ds[0][0].shape[0] + 1
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    state_dict = dist_util.load_state_dict(args.model_path, map_location="cpu")
+    model.load_state_dict(dist_util.strip_state_dict_prefix(state_dict))
+    model.to(dist_util.dev())
+    model.eval()
+    model.build_timestep_cache(diffusion.model_timesteps())
+    sample_kwargs = {}
+    if args.student_steps:
+        sample_kwargs["timesteps"] = student_timesteps(diffusion.num_timesteps, args.student_steps)
+
+    datal = th.utils.data.DataLoader(th.utils.data.Subset(ds, todo), batch_size=args.teacher_batch, shuffle=False)
+    done = 0
+    for b_cpu, m, name, *_ in datal:
+        b = b_cpu.to(dist_util.dev())
+        img = th.cat((b, th.zeros_like(b[:, :1])), dim=1)
+        img[:, 0] = b[:, 0] + 10 * b[:, 1]
+        with th.no_grad():
+            sample, _, _, _, _ = diffusion.ddim_sample_loop_known(
+                model, tuple(img.shape), img, step=args.ddim_steps, clip_denoised=True, **sample_kwargs
+            )
+        for i, radio_map in enumerate(sample[:, -1].cpu().numpy()):
+            # the inputs this map was sampled from: the loader may draw different ones on the next read
+            path = os.path.join(cache_dir, "teacher_%06d.npz" % todo[done])
+            with open(path + ".tmp", "wb") as f:
+                np.savez_compressed(
+                    f, inputs=b_cpu[i].numpy(), image_gain=m[i].numpy(),
+                    teacher=radio_map.astype(np.float16), name=np.array(name[i]),
+                )
+            os.replace(path + ".tmp", path)
+            done += 1
+        logger.log(f"{done}/{len(todo)} teacher maps")
+
+
+def train_phase(args, wnet, datal, phase):
+    wnet.phase = phase
+    output = 0 if phase == "firstU" else 1
+    opt = th.optim.Adam(filter(lambda p: p.requires_grad, wnet.parameters()), lr=args.lr)
+    scheduler = th.optim.lr_scheduler.StepLR(opt, step_size=args.lr_step, gamma=0.1)
+    wnet.train()
+    for epoch in range(args.epochs):
+        for b, m, teacher, *_ in datal:
+            b, m, teacher = b.to(dist_util.dev()), m.to(dist_util.dev()), teacher.to(dist_util.dev())
+            target = args.teacher_weight * teacher + (1 - args.teacher_weight) * m
+            pred = wnet(b)[output]
+            loss = F.mse_loss(pred, target)
+            opt.zero_grad()
+            loss.backward()
+            opt.step()
+            logger.logkv_mean(f"loss_{phase}", loss.item())
+            logger.logkv_mean(f"mse_gt_{phase}", F.mse_loss(pred.detach(), m).item())
+        scheduler.step()
+        logger.logkv("epoch", epoch)
+        logger.dumpkvs()
+    path = os.path.join(args.out_dir, f"wnet_{phase}.pt")
+    th.save(wnet.state_dict(), path)
+    logger.log(f"saved {path}")
+
+
+def main():
+    args = create_argparser().parse_args()
+    dist_util.setup_dist(args)
+    logger.configure(dir = args.out_dir)
+
+    ds, inputs = radio_dataset(args.data_name, "train")
+    cache_dir = teacher_cache_dir(args)
+    generate_teacher_maps(args, ds, cache_dir)
+
+    datal = th.utils.data.DataLoader(
+        loaders.RadioUNet_teacher(cache_dir),
+        batch_size=args.batch_size,
+        shuffle=True,
+        num_workers=args.num_workers)
+    wnet = modules.RadioWNet(inputs=inputs, phase="firstU").to(dist_util.dev())
+    for phase in ("firstU", "secondU"):
+        logger.log(f"training RadioWNet, {phase}...")
+        train_phase(args, wnet, datal, phase)
+
+
+def create_argparser():
+    defaults = dict(
+        data_name = 'Radio',
+        model_path="",              #the RMDM teacher
+        student_steps=0,            #model_path is a RMDM_distill.py student with this many steps
+        ddim_steps=50,              #DDIM steps of the teacher otherwise
+        teacher_cache='./results/wnet/teacher/',   #one subdirectory per data_name/model_path/steps
+        num_teacher_maps=10000,     #training items labelled by the teacher
+        teacher_batch=16,
+        teacher_weight=0.5,         #weight of the RMDM map in the target, the rest is ground truth
+        epochs=30,                  #per phase
+        lr=1e-4,
+        lr_step=10,                 #epochs between 10x lr decays
+        batch_size=15,
+        num_workers=1,
+        gpu_dev = "0",
+        multi_gpu = None,
+        out_dir='./results/wnet/'
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
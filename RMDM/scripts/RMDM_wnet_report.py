@@ -0,0 +1,113 @@
+"""
+Accuracy/latency report of the distilled RadioWNet against the RMDM sampler.
+
+Both predict the same --eval_batches test batches; the report gives NMSE and
+SSIM against the ground truth, and milliseconds per map.
+"""
+import argparse
+import itertools
+import sys
+import time
+sys.path.append(".")
+import numpy as np
+import torch as th
+from skimage.metrics import structural_similarity
+from guided_diffusion import dist_util, logger
+from guided_diffusion.distillation import student_timesteps
+from guided_diffusion.script_util import (
+    model_and_diffusion_defaults,
+    create_model_and_diffusion,
+    add_dict_to_argparser,
+    args_to_dict,
+)
+from RadioUNet.lib import modules
+from RMDM_wnet_distill import radio_dataset
+
+
+def report(name, preds, gts, elapsed):
+    nmse = np.mean([((p - g) ** 2).mean() / (g ** 2).mean() for p, g in zip(preds, gts)])
+    ssim = np.mean([structural_similarity(p, g, data_range=g.max() - g.min()) for p, g in zip(preds, gts)])
+    logger.log(f"| {name} | {nmse:.5f} | {ssim:.4f} | {elapsed / len(preds) * 1000:.1f} |")
+
+
+def timed(device, fn):
+    if device.type == "cuda":
+        th.cuda.synchronize()
+    start = time.time()
+    out = fn()
+    if device.type == "cuda":
+        th.cuda.synchronize()
+    return out, time.time() - start
+
+
+def main():
+    args = create_argparser().parse_args()
+    dist_util.setup_dist(args)
+    logger.configure(dir=args.out_dir)
+    device = dist_util.dev()
+
+    ds, inputs = radio_dataset(args.data_name, "test")
+    batches = list(itertools.islice(th.utils.data.DataLoader(ds, batch_size=args.batch_size, shuffle=False), args.eval_batches))
+    gts = [g for _, m, *_ in batches for g in m[:, 0].numpy()]
+
+    wnet = modules.RadioWNet(inputs=inputs, phase="secondU")
+    wnet.load_state_dict(th.load(args.wnet_path, map_location="cpu"))
+    wnet.to(device).eval()
+    preds, elapsed = [], 0.0
+    with th.no_grad():
+        for b, *_ in batches:
+            out, dt = timed(device, lambda: wnet(b.to(device))[1])
+            preds.extend(out[:, 0].cpu().numpy())
+            elapsed += dt
+
+    args.in_ch = inputs + 1
+    model, diffusion = create_model_and_diffusion(
+        **args_to_dict(args, model_and_diffusion_defaults().keys())
+    )
+    state_dict = dist_util.load_state_dict(args.model_path, map_location="cpu")
+    model.load_state_dict(dist_util.strip_state_dict_prefix(state_dict))
+    model.to(device).eval()
+    model.build_timestep_cache(diffusion.model_timesteps())
+    sample_kwargs = {}
+    if args.student_steps:
+        sample_kwargs["timesteps"] = student_timesteps(diffusion.num_timesteps, args.student_steps)
+    rmdm_preds, rmdm_elapsed = [], 0.0
+    with th.no_grad():
+        for b, *_ in batches:
+            b = b.to(device)
+            img = th.cat((b, th.zeros_like(b[:, :1])), dim=1)
+            img[:, 0] = b[:, 0] + 10 * b[:, 1]
+            (sample, _, _, _, _), dt = timed(device, lambda: diffusion.ddim_sample_loop_known(
+                model, tuple(img.shape), img, step=args.ddim_steps, clip_denoised=True, **sample_kwargs
+            ))
+            rmdm_preds.extend(sample[:, -1].cpu().numpy())
+            rmdm_elapsed += dt
+
+    logger.log(f"| model | NMSE | SSIM | ms/map (batch {args.batch_size}, {device}) |")
+    logger.log("|---|---:|---:|---:|")
+    report("RadioWNet (distilled)", preds, gts, elapsed)
+    steps = args.student_steps or args.ddim_steps
+    report(f"RMDM ({steps} DDIM steps)", rmdm_preds, gts, rmdm_elapsed)
+
+
+def create_argparser():
+    defaults = dict(
+        data_name='Radio',
+        wnet_path="./results/wnet/wnet_secondU.pt",
+        model_path="",
+        student_steps=0,
+        ddim_steps=50,
+        batch_size=8,
+        eval_batches=25,
+        gpu_dev="0",
+        multi_gpu=None,
+        out_dir='./results/wnet_report/',
+    )
+    defaults.update(model_and_diffusion_defaults())
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()